@@ -3,26 +3,108 @@ Music Classification Configuration
 Settings and constants for music genre classification.
 """
 import os
+import tempfile
 from typing import List
 
 # Model paths
 MODEL_DIR = os.path.join(os.path.dirname(__file__), "../cnn-models")
 MODEL_PATH = os.path.join(MODEL_DIR, "efficientnet_music_genre_model.h5")
 LABEL_ENCODER_PATH = os.path.join(MODEL_DIR, "label_encoder.pkl")
+FUSED_MODEL_PATH = os.getenv("FUSED_MODEL_PATH", os.path.join(MODEL_DIR, "efficientnet_music_genre_fused.tflite"))
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", os.path.join(MODEL_DIR, "efficientnet_music_genre_fused.onnx"))
+MODEL_BUNDLE_PATH = os.getenv("MODEL_BUNDLE_PATH", os.path.join(MODEL_DIR, "efficientnet_music_genre_bundle"))
+MODEL_BUNDLE_VERIFY = os.getenv("MODEL_BUNDLE_VERIFY", "true").lower() in ("1", "true", "yes")  # hash-check bundle files on load
+MOOD_HEAD_PATH = os.getenv("MOOD_HEAD_PATH", os.path.join(MODEL_DIR, "mood_head.npz"))  # optional; results carry mood when it exists
+# bundle, keras, tflite or onnx; defaults to the bundle when one has been built
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "bundle" if os.path.isdir(MODEL_BUNDLE_PATH) else "keras").lower()
+SERVING_MODEL_PATH = {
+    "bundle": MODEL_BUNDLE_PATH, "tflite": FUSED_MODEL_PATH, "onnx": ONNX_MODEL_PATH
+}.get(INFERENCE_BACKEND, MODEL_PATH)
 
 # Audio processing settings
 DEFAULT_SEGMENT_DURATION = 30  # seconds
 MAX_SEGMENT_DURATION = 300     # seconds (5 minutes)
-MAX_FILE_SIZE = 100 * 1024 * 1024  # 100 MB
+MIN_SEGMENT_HOP = 1.0          # seconds between overlapping segment starts
+MAX_FILE_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(100 * 1024 * 1024)))  # 100 MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # bytes per disk write when streaming uploads and downloads to disk
+UPLOAD_SCRATCH_DIR = os.getenv("UPLOAD_SCRATCH_DIR") or None  # defaults to the system temp dir
 
 # Supported audio formats
 SUPPORTED_AUDIO_FORMATS = ['.mp3', '.wav', '.m4a', '.flac', '.ogg', '.aac']
+NATIVE_AUDIO_FORMATS = ['.mp3', '.wav', '.flac', '.ogg']  # read by librosa/libsndfile; the rest go through FFmpeg
+
+# FFmpeg settings
+FFMPEG_PATH = os.getenv("FFMPEG_PATH") or None  # defaults to PATH, then the imageio-ffmpeg binary
+FFMPEG_TIMEOUT_SECONDS = int(os.getenv("FFMPEG_TIMEOUT_SECONDS", "120"))
 
 # Model settings
 IMAGE_SIZE = (224, 224)
 SAMPLE_RATE = 22050
 N_MELS = 128
 FMAX = 8000
+N_FFT = 2048       # librosa.feature.melspectrogram defaults
+HOP_LENGTH = 512
+
+# Inference settings
+MAX_INFERENCE_BATCH_SIZE = int(os.getenv("MAX_INFERENCE_BATCH_SIZE", "16"))  # segments per forward pass
+CLASSIFICATION_WORKERS = int(os.getenv("CLASSIFICATION_WORKERS", "0"))  # worker processes; 0 runs in-process
+TF_INTRA_OP_THREADS = int(os.getenv("TF_INTRA_OP_THREADS", "0"))  # per worker; 0 splits the cores evenly
+TF_INTER_OP_THREADS = int(os.getenv("TF_INTER_OP_THREADS", "0"))  # per worker; 0 lets TensorFlow decide
+INFERENCE_NUM_THREADS = int(os.getenv("INFERENCE_NUM_THREADS", "0"))  # TFLite/ONNX threads in-process; 0 lets the runtime decide
+SHARED_MODEL_WEIGHTS = os.getenv("SHARED_MODEL_WEIGHTS", "false").lower() in ("1", "true", "yes")  # TFLite/ONNX run on the mapped model file instead of packed copies
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))  # how long a batch waits for more requests
+MAX_CONCURRENT_CLASSIFICATIONS = int(os.getenv("MAX_CONCURRENT_CLASSIFICATIONS", "4"))  # decode/render threads
+WARMUP_ON_STARTUP = os.getenv("CLASSIFIER_WARMUP", "true").lower() in ("1", "true", "yes")  # load model at startup
+
+# Segment sampling settings
+MAX_SEGMENTS_PER_TRACK = int(os.getenv("MAX_SEGMENTS_PER_TRACK", "0"))  # evenly spaced beyond this; 0 means no cap
+ADAPTIVE_SAMPLING = os.getenv("CLASSIFICATION_ADAPTIVE_SAMPLING", "false").lower() in ("1", "true", "yes")  # callers can opt in per request
+ADAPTIVE_MIN_SEGMENTS = int(os.getenv("ADAPTIVE_MIN_SEGMENTS", "3"))  # classified before an early exit is considered
+ADAPTIVE_CONFIDENCE = float(os.getenv("ADAPTIVE_CONFIDENCE", "0.95"))  # one-sided confidence to stop early
+
+# Streaming settings for long tracks
+STREAMING_MIN_DURATION = float(os.getenv("STREAMING_MIN_DURATION", "600"))  # seconds; longer tracks are decoded in blocks, 0 disables
+STREAMING_BLOCK_SECONDS = float(os.getenv("STREAMING_BLOCK_SECONDS", "5"))  # audio decoded per block
+
+# Background classification job settings
+JOB_TTL_SECONDS = int(os.getenv("CLASSIFICATION_JOB_TTL_SECONDS", "3600"))  # how long finished jobs are kept
+MAX_CLASSIFICATION_JOBS = int(os.getenv("MAX_CLASSIFICATION_JOBS", "1000"))
+
+# Result and embedding cache settings
+CACHE_MAX_BYTES = int(os.getenv("CLASSIFICATION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # in-process LRU tier
+EMBEDDINGS_CACHE_MAX_BYTES = int(os.getenv("EMBEDDINGS_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))  # in-process LRU tier of segment embeddings, ~125 KB per 30 s segment
+REDIS_URL = os.getenv("REDIS_URL")  # optional shared tier, e.g. redis://localhost:6379/0
+CACHE_TTL_SECONDS = int(os.getenv("CLASSIFICATION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Song preview classification settings
+SONG_PREVIEW_HOSTS = {host.strip() for host in os.getenv("SONG_PREVIEW_HOSTS", "p.scdn.co").split(",") if host.strip()}  # /songs/classify downloads only from these
+SONG_PREVIEW_TIMEOUT_SECONDS = float(os.getenv("SONG_PREVIEW_TIMEOUT_SECONDS", "15"))
+
+# Similar-track index settings
+TRACK_INDEX_DIR = os.getenv("TRACK_INDEX_DIR", os.path.join(os.path.dirname(__file__), "../track-index"))  # empty disables indexing
+TRACK_INDEX_STORAGE = os.getenv("TRACK_INDEX_STORAGE", "float32").lower()  # float32, float16 or pq (after build_track_index)
+TRACK_INDEX_ANN_MIN_TRACKS = int(os.getenv("TRACK_INDEX_ANN_MIN_TRACKS", "50000"))  # exact search below this size
+TRACK_INDEX_NPROBE = int(os.getenv("TRACK_INDEX_NPROBE", "16"))  # inverted lists scored per query
+TRACK_INDEX_RERANK = int(os.getenv("TRACK_INDEX_RERANK", "50"))  # pq: exact re-scores per track returned
+MAX_SIMILAR_TRACKS = 50
+
+# Request profiling settings
+PROFILING_ADMIN_UIDS = {uid.strip() for uid in os.getenv("PROFILING_ADMIN_UIDS", "").split(",") if uid.strip()}  # may send X-Profile
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))  # share of classification requests profiled anyway
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))  # time between stack samples
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR") or os.path.join(tempfile.gettempdir(), "vibesync-profiles")
+
+# Metrics settings
+METRICS_MULTIPROCESS_DIR = os.getenv("METRICS_MULTIPROCESS_DIR") or None  # shared by the uvicorn workers; empty it before starting them
+METRICS_WRITE_INTERVAL_SECONDS = float(os.getenv("METRICS_WRITE_INTERVAL_SECONDS", "5"))  # how far behind the other workers a scrape can be
+
+# Model registry settings
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", MODEL_DIR)  # model versions that can be deployed at runtime
+MODEL_ADMIN_UIDS = {uid.strip() for uid in os.getenv("MODEL_ADMIN_UIDS", "").split(",") if uid.strip()}  # may deploy model versions
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.1"))  # default share of tracks scored by a shadow version
+MAX_SHADOW_CLASSIFICATIONS = int(os.getenv("MAX_SHADOW_CLASSIFICATIONS", "2"))  # shadow scorings at once; more are skipped
+MODEL_DEPLOYMENT_STATE_PATH = os.getenv("MODEL_DEPLOYMENT_STATE_PATH", os.path.join(MODEL_REGISTRY_DIR, "deployment.json"))  # shared by all API processes
+MODEL_SYNC_INTERVAL_SECONDS = float(os.getenv("MODEL_SYNC_INTERVAL_SECONDS", "5"))  # how often each process checks it for a new deployment
 
 # Expected genres (should match the trained model)
 EXPECTED_GENRES = [
@@ -42,7 +124,7 @@ class MusicClassificationConfig:
     """Configuration class for music classification settings."""
     
     def __init__(self):
-        self.model_path = MODEL_PATH
+        self.model_path = SERVING_MODEL_PATH
         self.label_encoder_path = LABEL_ENCODER_PATH
         self.supported_formats = SUPPORTED_AUDIO_FORMATS
         self.default_segment_duration = DEFAULT_SEGMENT_DURATION
@@ -61,7 +143,8 @@ class MusicClassificationConfig:
         if not os.path.exists(self.model_path):
             issues.append(f"Model file not found: {self.model_path}")
             
-        if not os.path.exists(self.label_encoder_path):
+        # Bundles carry their genre list
+        if not os.path.isdir(self.model_path) and not os.path.exists(self.label_encoder_path):
             issues.append(f"Label encoder not found: {self.label_encoder_path}")
             
         return issues
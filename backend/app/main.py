@@ -2,21 +2,39 @@
 Main application entry point.
 This module initializes the FastAPI application and includes all routers.
 """
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from .config.settings import SESSION_SECRET
 from .auth.firebase_auth import get_current_user
+from .config.music_config import MAX_FILE_SIZE, METRICS_MULTIPROCESS_DIR, METRICS_WRITE_INTERVAL_SECONDS
+from .services.upload_storage import UploadSizeLimitMiddleware, MULTIPART_OVERHEAD
+from .services.metrics import REGISTRY, RequestMetricsMiddleware
 
 # Import routers
-from .routers import user, music_classification, health
+from .routers import user, music_classification, health, metrics
 from .routers.spotify import songs, auth
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load and warm up the classifier (or its worker pool) on startup and stop it cleanly on shutdown."""
+    if METRICS_MULTIPROCESS_DIR:
+        REGISTRY.share(METRICS_MULTIPROCESS_DIR, METRICS_WRITE_INTERVAL_SECONDS)
+    music_classification.start_warm_up()
+    music_classification.start_model_sync()
+    try:
+        yield
+    finally:
+        music_classification.shutdown_classification()
+
 # Create FastAPI app
 app = FastAPI(
     title="Vibe-Sync API",
     description="Music streaming and analysis platform",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -37,6 +55,16 @@ app.add_middleware(
     # https_only=True
 )
 
+# Reject oversized classification uploads before the body is parsed
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_body_size=MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    path_prefix="/api/music/classify"
+)
+
+# Count and time every request; added last so it also sees rejected uploads
+app.add_middleware(RequestMetricsMiddleware)
+
 # Root endpoint
 @app.get("/")
 def read_root():
@@ -50,6 +78,7 @@ def read_root():
 app.include_router(user.router)
 app.include_router(music_classification.router)
 app.include_router(health.router)
+app.include_router(metrics.router)
 app.include_router(songs.router)
 app.include_router(auth.router)
 
@@ -3,11 +3,13 @@ Health Check Service for Music Classification
 Provides endpoints to check if the classification service is working properly.
 """
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
 from typing import Dict, Any
 import os
 import logging
 from datetime import datetime
 from ..config.music_config import MusicClassificationConfig
+from . import music_classification
 
 logger = logging.getLogger(__name__)
 
@@ -79,6 +81,24 @@ async def check_classification_health() -> Dict[str, Any]:
             detail=f"Failed to check classification service health: {str(e)}"
         )
 
+@router.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 200 once the classifier is loaded and warmed up, 503 before.
+    
+    Returns:
+        Readiness status of the classification service
+    """
+    readiness = music_classification.get_readiness()
+    body = {
+        "ready": readiness["ready"],
+        "timestamp": datetime.now().isoformat(),
+        "services": {
+            "classification": readiness["status"]
+        }
+    }
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=body)
+
 @router.get("/")
 async def general_health_check() -> Dict[str, Any]:
     """
@@ -0,0 +1,23 @@
+"""
+Metrics Endpoint
+Exposes request, classifier stage, FFmpeg, cache and Spotify metrics for Prometheus.
+"""
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from ..services.metrics import REGISTRY, CONTENT_TYPE
+
+router = APIRouter(tags=["Metrics"])
+
+@router.get("/metrics")
+async def get_metrics() -> Response:
+    """
+    Get all metrics in the Prometheus text exposition format.
+
+    Without METRICS_MULTIPROCESS_DIR these are the metrics of the uvicorn
+    worker that answers; with it, of all workers.
+    
+    Returns:
+        Plain-text metrics for a Prometheus scrape
+    """
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
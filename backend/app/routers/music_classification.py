@@ -2,17 +2,75 @@
 Music Classification Router
 Handles endpoints for music genre classification.
 """
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form
-from fastapi.responses import JSONResponse
-from typing import Optional, Dict, Any
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from pydantic import BaseModel
+from typing import Callable, Optional, Dict, Any, Tuple, Union
 import os
-import tempfile
-import aiofiles
+import re
+import uuid
+import random
+import asyncio
+import threading
+from functools import partial
 from pathlib import Path
 import logging
 
+import anyio
+import numpy as np
+
 from ..services.music_classifier import MusicGenreClassifier
+from ..services.model_registry import DeploymentState, ModelDeployment, ModelRegistry
+from ..services.classification_cache import ClassificationCache
+from ..services.track_index import TrackIndex, track_vector
+from ..services.upload_storage import ReceivedUpload, receive_upload, InvalidUploadError, UploadTooLargeError
+from ..services.classification_pool import ClassificationPool, default_intra_op_threads
+from ..services.classification_jobs import ClassificationJob, ClassificationJobManager, SharedClassificationJob
+from ..services.metrics import CLASSIFICATIONS_IN_FLIGHT, CACHE_HIT_RATIO
+from ..services.request_profiler import RequestProfiler, current_profiler, profile_path
 from ..auth.firebase_auth import get_current_user
+from ..config.music_config import (
+    MAX_INFERENCE_BATCH_SIZE,
+    INFERENCE_MAX_WAIT_MS,
+    MAX_CONCURRENT_CLASSIFICATIONS,
+    CACHE_MAX_BYTES,
+    REDIS_URL,
+    CACHE_TTL_SECONDS,
+    EMBEDDINGS_CACHE_MAX_BYTES,
+    MAX_FILE_SIZE,
+    MAX_SEGMENT_DURATION,
+    DEFAULT_SEGMENT_DURATION,
+    UPLOAD_SCRATCH_DIR,
+    UPLOAD_CHUNK_SIZE,
+    SERVING_MODEL_PATH,
+    LABEL_ENCODER_PATH,
+    CLASSIFICATION_WORKERS,
+    TF_INTRA_OP_THREADS,
+    TF_INTER_OP_THREADS,
+    JOB_TTL_SECONDS,
+    MAX_CLASSIFICATION_JOBS,
+    WARMUP_ON_STARTUP,
+    INFERENCE_NUM_THREADS,
+    ADAPTIVE_SAMPLING,
+    MAX_SEGMENTS_PER_TRACK,
+    MIN_SEGMENT_HOP,
+    PROFILING_ADMIN_UIDS,
+    PROFILING_SAMPLE_RATE,
+    PROFILING_INTERVAL_MS,
+    PROFILE_OUTPUT_DIR,
+    MODEL_REGISTRY_DIR,
+    MODEL_ADMIN_UIDS,
+    SHADOW_SAMPLE_RATE,
+    MAX_SHADOW_CLASSIFICATIONS,
+    MODEL_DEPLOYMENT_STATE_PATH,
+    MODEL_SYNC_INTERVAL_SECONDS,
+    TRACK_INDEX_DIR,
+    TRACK_INDEX_STORAGE,
+    TRACK_INDEX_ANN_MIN_TRACKS,
+    TRACK_INDEX_NPROBE,
+    TRACK_INDEX_RERANK,
+    MAX_SIMILAR_TRACKS,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -21,104 +79,678 @@ router = APIRouter(
     tags=["Music Classification"]
 )
 
-# Initialize classifier (will be loaded when first endpoint is called)
-classifier = None
+# Loaded model versions; the active one is loaded at startup, or when first endpoint is called if warm-up is disabled
+model_registry = ModelRegistry(MAX_SHADOW_CLASSIFICATIONS)
+_classifier_lock = threading.Lock()
+
+# Model versions every API process should serve; the registry of this process follows it
+deployment_state = DeploymentState(MODEL_DEPLOYMENT_STATE_PATH, SERVING_MODEL_PATH, LABEL_ENCODER_PATH)
+_applied_state = deployment_state.initial()
+_sync_lock = asyncio.Lock()
+_sync_task = None
+_sync_wakeup = asyncio.Event()
+_apply_tasks = set()  # referenced until they finish
+
+# Startup model loading and warm-up; requests wait for it instead of loading the model themselves
+_warmup_task = None
+classification_status = "not_started"  # not_started, warming_up, ready or failed
+
+# Caps how many requests decode and render audio at the same time
+classification_limiter = anyio.CapacityLimiter(MAX_CONCURRENT_CLASSIFICATIONS)
+
+# Results and embeddings keyed by upload content hash
+classification_cache = ClassificationCache(CACHE_MAX_BYTES, REDIS_URL, CACHE_TTL_SECONDS, EMBEDDINGS_CACHE_MAX_BYTES)
+CACHE_HIT_RATIO.set_function(lambda: classification_cache.get_stats()['hit_ratio'])
+
+# Track embeddings for similar-track queries; opened when first used
+_track_index = None
+_track_index_lock = threading.Lock()
+
+# Background classification jobs with progressive results
+job_manager = ClassificationJobManager(JOB_TTL_SECONDS, MAX_CLASSIFICATION_JOBS, REDIS_URL)
+
+# Classifier methods whose inference goes through the shared scheduler when run in-process
+_BATCHED_METHODS = ("classify_full_track", "predict_genre_from_audio_segment")
+
+# Shadow scorings running in the background, referenced until they finish
+_shadow_tasks = set()
+
+# Request IDs double as profile file names
+_PROFILE_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+def get_deployment() -> ModelDeployment:
+    """Get the active model version, loading the configured model if none is active yet."""
+    if model_registry.active is None:
+        # Only one thread builds the model; the others wait for it
+        with _classifier_lock:
+            if model_registry.active is not None:
+                return model_registry.active
+            
+            # Paths to model files
+            model_path = SERVING_MODEL_PATH
+            encoder_path = LABEL_ENCODER_PATH
+            
+            if not os.path.exists(model_path):
+                raise HTTPException(
+                    status_code=500, 
+                    detail="Model file not found. Please ensure the model is properly deployed."
+                )
+            if not os.path.isdir(model_path) and not os.path.exists(encoder_path):
+                raise HTTPException(
+                    status_code=500, 
+                    detail="Label encoder file not found. Please ensure the encoder is properly deployed."
+                )
+            
+            try:
+                music_classifier = MusicGenreClassifier(model_path, encoder_path, num_threads=INFERENCE_NUM_THREADS)
+                model_registry.activate(ModelDeployment(
+                    music_classifier, max_batch_size=MAX_INFERENCE_BATCH_SIZE, max_wait_ms=INFERENCE_MAX_WAIT_MS
+                ))
+                logger.info("Music classifier initialized successfully")
+            except Exception as e:
+                logger.error(f"Failed to initialize classifier: {str(e)}")
+                raise HTTPException(status_code=500, detail="Failed to initialize music classifier")
+    
+    return model_registry.active
 
 def get_classifier() -> MusicGenreClassifier:
-    """Get or initialize the music classifier."""
-    global classifier
-    if classifier is None:
-        # Paths to model files
-        model_path = os.path.join(os.path.dirname(__file__), "../cnn-models/efficientnet_music_genre_model.h5")
-        encoder_path = os.path.join(os.path.dirname(__file__), "../cnn-models/label_encoder.pkl")
-        
-        if not os.path.exists(model_path):
-            raise HTTPException(
-                status_code=500, 
-                detail="Model file not found. Please ensure the model is properly deployed."
-            )
-        if not os.path.exists(encoder_path):
-            raise HTTPException(
-                status_code=500, 
-                detail="Label encoder file not found. Please ensure the encoder is properly deployed."
+    """Get or initialize the classifier of the active model version."""
+    return get_deployment().classifier
+
+async def model_deployment():
+    """
+    Lease the active model version for the whole request.
+    
+    A model swap during the request does not affect it: all its batches run on
+    the version it started with, which drains only after the request ends.
+    
+    Yields:
+        The leased ModelDeployment
+    """
+    await wait_for_warm_up()
+    get_deployment()
+    try:
+        deployment = model_registry.acquire()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    try:
+        yield deployment
+    finally:
+        model_registry.release(deployment)
+
+async def load_deployment(model_path: str, encoder_path: str, warm_up: bool = True) -> ModelDeployment:
+    """
+    Load a model version off the event loop, with its own worker pool if CLASSIFICATION_WORKERS > 0.
+    
+    In pool mode the API process only reads the genres and the model and
+    extractor versions it needs for request validation and cache keys, from
+    the label encoder, bundle manifest or file hashes; the model itself is
+    loaded and warmed up by every worker.
+    
+    Args:
+        model_path: Model file or bundle directory
+        encoder_path: Label encoder pickle file
+        warm_up: Run dummy inference before returning, so the first requests see steady-state latency
+        
+    Returns:
+        The loaded deployment, not yet active
+    """
+    music_classifier = await anyio.to_thread.run_sync(partial(
+        MusicGenreClassifier, model_path, encoder_path, num_threads=INFERENCE_NUM_THREADS,
+        metadata_only=CLASSIFICATION_WORKERS > 0
+    ))
+    if CLASSIFICATION_WORKERS <= 0:
+        if warm_up:
+            await anyio.to_thread.run_sync(music_classifier.warm_up, (1, MAX_INFERENCE_BATCH_SIZE))
+        deployment = ModelDeployment(
+            music_classifier, max_batch_size=MAX_INFERENCE_BATCH_SIZE, max_wait_ms=INFERENCE_MAX_WAIT_MS
+        )
+        if warm_up:
+            deployment.get_scheduler()
+        return deployment
+    
+    pool = ClassificationPool(
+        model_path,
+        encoder_path,
+        workers=CLASSIFICATION_WORKERS,
+        intra_op_threads=default_intra_op_threads(CLASSIFICATION_WORKERS, TF_INTRA_OP_THREADS),
+        inter_op_threads=TF_INTER_OP_THREADS,
+        warmup_batch_sizes=(1, MAX_INFERENCE_BATCH_SIZE) if warm_up else ()
+    )
+    try:
+        await pool.start()
+    except Exception:
+        pool.shutdown(wait=False)
+        raise
+    return ModelDeployment(music_classifier, pool=pool)
+
+async def warm_up_classification():
+    """Load the configured model version and run dummy inference so the first requests see steady-state latency."""
+    global classification_status
+    classification_status = "warming_up"
+    try:
+        deployment = await load_deployment(
+            SERVING_MODEL_PATH, LABEL_ENCODER_PATH, warm_up=WARMUP_ON_STARTUP or CLASSIFICATION_WORKERS > 0
+        )
+        model_registry.activate(deployment)
+        classification_status = "ready"
+        logger.info("Music classification ready")
+    except Exception as e:
+        classification_status = "failed"
+        logger.error(f"Classification warm-up failed: {str(e)}")
+
+async def deploy_and_wait(version: Dict[str, Any], shadow_sample_rate: Optional[float] = None):
+    """Load a version in the background and wait until it is active, shadowing, or has failed."""
+    try:
+        model_registry.deploy(
+            partial(load_deployment, version['model_path'], version['encoder_path']),
+            {"model_path": version['model_path'], "encoder_path": version['encoder_path']},
+            shadow_sample_rate
+        )
+    except RuntimeError as e:
+        logger.error(f"Could not deploy {version['model_path']}: {str(e)}")
+        return
+    await model_registry.wait_for_load()
+
+async def apply_deployment_state(state: Dict[str, Any]):
+    """
+    Load, promote or stop model versions until this process serves the shared deployment state.
+    
+    A version that fails to load is reported in GET /models and not retried
+    until the state changes again.
+    
+    Args:
+        state: State from deployment_state; older generations than the applied one are ignored
+    """
+    global _applied_state
+    async with _sync_lock:
+        applied = _applied_state
+        # Generations only grow, unless the file was removed and the state fell back to the initial one
+        if 0 < state['generation'] <= applied['generation'] or state == applied:
+            return
+        await wait_for_warm_up()
+        
+        if state['active'] != applied['active']:
+            shadow = applied['shadow']
+            if (shadow is not None and model_registry.shadow is not None
+                    and shadow['model_path'] == state['active']['model_path']):
+                model_registry.promote_shadow()
+            else:
+                await deploy_and_wait(state['active'])
+        
+        if state['shadow'] is None:
+            model_registry.stop_shadow()
+        elif (applied['shadow'] is not None and model_registry.shadow is not None
+              and state['shadow']['model_path'] == applied['shadow']['model_path']
+              and state['shadow']['encoder_path'] == applied['shadow']['encoder_path']):
+            model_registry.shadow_sample_rate = state['shadow']['sample_rate']
+        else:
+            await deploy_and_wait(state['shadow'], state['shadow']['sample_rate'])
+        _applied_state = state
+        logger.info(f"Model deployment generation {state['generation']} applied in process {os.getpid()}")
+
+async def sync_model_versions():
+    """Apply deployments made through any API process, checking the shared state every MODEL_SYNC_INTERVAL_SECONDS."""
+    while True:
+        try:
+            await apply_deployment_state(await anyio.to_thread.run_sync(deployment_state.read))
+        except Exception as e:
+            logger.error(f"Model version sync failed: {str(e)}")
+        try:
+            await asyncio.wait_for(_sync_wakeup.wait(), MODEL_SYNC_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _sync_wakeup.clear()
+
+def start_model_sync():
+    """Start following the shared deployment state, if MODEL_SYNC_INTERVAL_SECONDS > 0."""
+    global _sync_task
+    if _sync_task is None and MODEL_SYNC_INTERVAL_SECONDS > 0:
+        _sync_task = asyncio.create_task(sync_model_versions())
+
+def start_warm_up():
+    """Start loading and warming up the classifier in the background, if configured."""
+    global _warmup_task
+    if _warmup_task is None and (WARMUP_ON_STARTUP or CLASSIFICATION_WORKERS > 0):
+        _warmup_task = asyncio.create_task(warm_up_classification())
+
+async def wait_for_warm_up():
+    """Wait for a running startup warm-up so requests don't load the model a second time."""
+    if _warmup_task is not None and not _warmup_task.done():
+        await asyncio.shield(_warmup_task)
+
+def get_readiness() -> Dict[str, Any]:
+    """Get whether classification requests will be served at steady-state latency."""
+    if _warmup_task is None:
+        # Lazy mode: the model loads on the first request
+        return {"ready": True, "status": "lazy" if model_registry.active is None else "ready"}
+    return {"ready": classification_status == "ready", "status": classification_status}
+
+def shutdown_classification():
+    """Stop the worker process pools and inference schedulers of every model version."""
+    global _warmup_task, _sync_task
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+        _warmup_task = None
+    if _sync_task is not None:
+        _sync_task.cancel()
+        _sync_task = None
+    model_registry.close()
+
+def get_track_index() -> Optional[TrackIndex]:
+    """Get the similar-track index, loading it from TRACK_INDEX_DIR on first use; None if indexing is disabled."""
+    global _track_index
+    if not TRACK_INDEX_DIR:
+        return None
+    with _track_index_lock:
+        if _track_index is None:
+            _track_index = TrackIndex(
+                TRACK_INDEX_DIR, storage=TRACK_INDEX_STORAGE, nprobe=TRACK_INDEX_NPROBE,
+                ann_min_tracks=TRACK_INDEX_ANN_MIN_TRACKS, rerank=TRACK_INDEX_RERANK
             )
+    return _track_index
+
+def index_track(content_hash: str, embeddings: np.ndarray, result: Dict[str, Any], extractor_version: str,
+                metadata: Dict[str, Any]):
+    """
+    Add a classified track to the similar-track index; failures are logged, not raised.
+    
+    Args:
+        content_hash: SHA-256 hex digest of the audio, the track's ID in the index
+        embeddings: Segment embeddings the result was computed from
+        result: Classification result, whose genre and mood are stored with the track
+        extractor_version: Extractor the embeddings come from
+        metadata: Where the track came from: 'source' ('upload' or 'spotify'), 'title'
+            and, for uploads, the 'owner' allowed to see it
+    """
+    try:
+        index = get_track_index()
+        if index is None or content_hash in index or len(embeddings) == 0:
+            return
+        mood = result.get('mood_prediction')
+        index.add(content_hash, track_vector(embeddings), {
+            **metadata,
+            'predicted_genre': result['overall_prediction']['predicted_genre'],
+            'predicted_mood': mood['predicted_mood'] if mood else None,
+            'duration': result['track_info']['duration']
+        }, extractor_version)
+    except Exception as e:
+        logger.error(f"Failed to index track {content_hash}: {str(e)}")
+
+async def run_classification(deployment: ModelDeployment, method_name: str, *args,
+                             on_segment: Optional[Callable[[Dict], None]] = None, **kwargs):
+    """
+    Run a blocking classifier method of a model version off the event loop.
+    
+    With a process pool the call goes to a worker process. Otherwise it runs in
+    a worker thread, and inference is routed through the version's scheduler so
+    segments from concurrent requests are batched together.
+    
+    Args:
+        deployment: Leased model version to run on
+        method_name: Name of the MusicGenreClassifier method to call
+        *args: Positional arguments for the method
+        on_segment: Progress callback for methods that support it, always called on the event loop
+        **kwargs: Keyword arguments for the method
+        
+    Returns:
+        The method's return value
+    """
+    with CLASSIFICATIONS_IN_FLIGHT.track_inprogress():
+        if deployment.pool is not None:
+            if on_segment is not None:
+                return await deployment.pool.run_with_progress(on_segment, method_name, *args, **kwargs)
+            return await deployment.pool.run(method_name, *args, **kwargs)
         
+        if method_name in _BATCHED_METHODS:
+            kwargs.setdefault('predict_fn', deployment.get_scheduler().predict)
+        if on_segment is not None:
+            loop = asyncio.get_running_loop()
+            kwargs['on_segment'] = lambda segment: loop.call_soon_threadsafe(on_segment, segment)
+        call = partial(getattr(deployment.classifier, method_name), *args, **kwargs)
+        profiler = current_profiler.get()
+        if profiler is not None:
+            if deployment.scheduler is not None:
+                profiler.add_thread(deployment.scheduler.worker_ident, 'inference-scheduler')
+            call = partial(profiler.call_sampled, 'classifier', call)
+        return await anyio.to_thread.run_sync(call, limiter=classification_limiter)
+
+def start_shadow_classification(primary: Dict[str, Any], audio_path: str, content_hash: str,
+                                segment_duration: int, adaptive: bool, segment_hop: Optional[float] = None):
+    """
+    Score a sample of full-track classifications with the shadow model version in the background.
+    
+    The shadow result is compared with the primary one (see the model status
+    and the vibesync_shadow_* metrics) and cached under the shadow version, but
+    never returned to the client.
+    
+    Args:
+        primary: Result of the active version
+        audio_path: The upload, which the request deletes when it returns
+        content_hash: SHA-256 hex digest of the upload
+        segment_duration: Duration of each segment in seconds
+        adaptive: Whether the primary classification used adaptive sampling
+        segment_hop: Seconds between segment starts
+    """
+    shadow = model_registry.sample_shadow()
+    if shadow is None:
+        return
+    
+    # A second link keeps the upload around after the request deletes its own
+    base, ext = os.path.splitext(audio_path)
+    shadow_path = f"{base}-shadow{ext}"
+    try:
+        os.link(audio_path, shadow_path)
+    except OSError:
+        model_registry.finish_shadow(shadow, primary, None)
+        logger.warning(f"Could not keep {audio_path} for shadow scoring")
+        return
+    
+    async def score():
+        result = None
         try:
-            classifier = MusicGenreClassifier(model_path, encoder_path)
-            logger.info("Music classifier initialized successfully")
+            result = await classify_track_cached(shadow, shadow_path, content_hash, segment_duration, adaptive,
+                                                 segment_hop=segment_hop)
         except Exception as e:
-            logger.error(f"Failed to initialize classifier: {str(e)}")
-            raise HTTPException(status_code=500, detail="Failed to initialize music classifier")
+            logger.error(f"Shadow classification with model {shadow.version} failed: {str(e)}")
+        finally:
+            model_registry.finish_shadow(shadow, primary, result)
+            try:
+                os.unlink(shadow_path)
+            except OSError:
+                pass
     
-    return classifier
+    task = asyncio.create_task(score())
+    _shadow_tasks.add(task)
+    task.add_done_callback(_shadow_tasks.discard)
+
+def track_cache_params(segment_duration: int, adaptive: bool, segment_hop: Optional[float] = None) -> Dict[str, Any]:
+    """Request parameters that change a full-track result, for its cache keys."""
+    return {
+        'segment_duration': segment_duration,
+        'segment_hop': segment_hop or segment_duration,
+        'adaptive': adaptive,
+        'max_segments': MAX_SEGMENTS_PER_TRACK
+    }
 
-@router.post("/upload")
+def upload_request_body(**fields: Dict[str, Any]) -> Dict[str, Any]:
+    """OpenAPI request body of an endpoint that reads its upload with receive_audio_upload."""
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["file"],
+        "properties": {"file": {"type": "string", "format": "binary"}, **fields}
+    }}}}}
+
+async def receive_audio_upload(request: Request, music_classifier: MusicGenreClassifier) -> ReceivedUpload:
+    """
+    Stream the 'file' field of a multipart request to a scratch file, hashing it on the way.
+    
+    Args:
+        request: Request whose body has not been read
+        music_classifier: Classifier whose supported formats are accepted
+        
+    Returns:
+        ReceivedUpload; the caller must delete its file
+        
+    Raises:
+        HTTPException: 413 if the file is too large, 400 if there is no supported audio file
+    """
+    try:
+        return await receive_upload(
+            request, 'file', music_classifier.get_supported_formats(), MAX_FILE_SIZE, UPLOAD_SCRATCH_DIR,
+            UPLOAD_CHUNK_SIZE
+        )
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def validate_segment_params(segment_duration: int, segment_hop: Optional[float]):
+    """Raise 400 for a segment duration or hop outside the allowed range."""
+    if segment_duration <= 0 or segment_duration > MAX_SEGMENT_DURATION:  # Max 5 minutes per segment
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Segment duration must be between 1 and {MAX_SEGMENT_DURATION} seconds"
+        )
+    if segment_hop is not None and (segment_hop < MIN_SEGMENT_HOP or segment_hop > segment_duration):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Segment hop must be between {MIN_SEGMENT_HOP} seconds and the segment duration"
+        )
+
+class ModelDeployRequest(BaseModel):
+    model: str  # model file or bundle directory inside the model directory
+    encoder: str = "label_encoder.pkl"  # not needed for bundles
+    shadow: bool = False  # shadow the active version instead of replacing it
+    shadow_sample_rate: Optional[float] = None  # default: SHADOW_SAMPLE_RATE
+
+def is_model_admin(user_info: dict) -> bool:
+    """Whether the user may deploy, promote and retire model versions."""
+    return user_info.get('uid') in MODEL_ADMIN_UIDS
+
+def resolve_model_path(name: str) -> str:
+    """Absolute path of a model file inside MODEL_REGISTRY_DIR; 400 for paths outside it, 404 if missing."""
+    root = os.path.realpath(MODEL_REGISTRY_DIR)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        raise HTTPException(status_code=400, detail="Model files must be inside the model directory")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Model file not found: {name}")
+    return path
+
+def is_profiling_admin(user_info: dict) -> bool:
+    """Whether the user may request profiles and read them."""
+    return user_info.get('uid') in PROFILING_ADMIN_UIDS
+
+async def request_profiling(request: Request, response: Response,
+                            user_info: dict = Depends(get_current_user)):
+    """
+    Profile the request if an admin sent 'X-Profile: 1', or for a PROFILING_SAMPLE_RATE share of requests.
+    
+    The profile covers the endpoint and the classifier call and is stored
+    under the request ID, which is returned in the X-Profile-ID response
+    header. Profiling admins may choose it with a valid X-Request-ID header
+    that no profile uses yet (409 otherwise); all other profiles get a new one.
+    
+    Yields:
+        The active RequestProfiler, or None when the request is not profiled
+    """
+    requested = request.headers.get('X-Profile', '').lower() in ('1', 'true', 'yes')
+    if requested and not is_profiling_admin(user_info):
+        raise HTTPException(status_code=403, detail="Profiling is restricted to administrators")
+    if not requested and not (PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE):
+        yield None
+        return
+    
+    request_id = request.headers.get('X-Request-ID', '')
+    if not (is_profiling_admin(user_info) and _PROFILE_ID_PATTERN.fullmatch(request_id)):
+        request_id = uuid.uuid4().hex
+    elif os.path.exists(profile_path(PROFILE_OUTPUT_DIR, request_id)):
+        raise HTTPException(status_code=409, detail=f"A profile with request ID {request_id} exists already")
+    profiler = RequestProfiler(request_id, PROFILING_INTERVAL_MS / 1000, PROFILE_OUTPUT_DIR)
+    response.headers['X-Profile-ID'] = request_id
+    try:
+        with profiler.activate():
+            yield profiler
+    finally:
+        try:
+            await anyio.to_thread.run_sync(profiler.save)
+        except FileExistsError:
+            logger.warning(f"Profile {request_id} was written by another request meanwhile, dropping this one")
+
+async def classify_track_cached(deployment: ModelDeployment, audio_path: str, content_hash: str,
+                                segment_duration: int, adaptive: bool = False,
+                                on_segment: Optional[Callable[[Dict], None]] = None,
+                                segment_hop: Optional[float] = None,
+                                index_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Classify a full track and cache its segment embeddings and result.
+    
+    If embeddings for the same content and segmentation are already cached,
+    only the classifier head runs, e.g. after a head-only model update.
+    Embeddings are cached as float16, half the size of the float32 maps;
+    the head's probabilities on them differ from float32 by well under 1e-3.
+    With index_metadata the track is also added to the similar-track index.
+    
+    Args:
+        deployment: Leased model version to use
+        audio_path: Path to the uploaded audio file
+        content_hash: SHA-256 hex digest of the upload
+        segment_duration: Duration of each segment in seconds
+        adaptive: Stop classifying segments once the genre is decided
+        on_segment: Called on the event loop with each segment as it finishes (not on a cache hit)
+        segment_hop: Seconds between segment starts (default: segment_duration, no overlap)
+        index_metadata: Metadata to index the track with, see index_track (None: not indexed)
+        
+    Returns:
+        Classification result without file metadata
+    """
+    embeddings_key = classification_cache.make_key(
+        'embeddings', content_hash, deployment.classifier.extractor_version,
+        **track_cache_params(segment_duration, adaptive, segment_hop)
+    )
+    cached = classification_cache.get_embeddings(embeddings_key)
+    if cached is not None:
+        embeddings = cached['embeddings'].astype(np.float32)
+        result = await run_classification(
+            deployment,
+            'classify_from_embeddings',
+            embeddings,
+            cached['start_times'].tolist(),
+            int(cached['segment_duration']),
+            float(cached['total_duration']),
+            int(cached['num_segments_total']) if 'num_segments_total' in cached else None
+        )
+    else:
+        result = await run_classification(
+            deployment, 'classify_full_track', audio_path, segment_duration, return_embeddings=True, on_segment=on_segment,
+            adaptive=adaptive, segment_hop=segment_hop
+        )
+        embeddings = result.pop('segment_embeddings')
+        await anyio.to_thread.run_sync(partial(
+            classification_cache.set_embeddings,
+            embeddings_key,
+            embeddings=embeddings.astype(np.float16),
+            start_times=np.array([s['start_time'] for s in result['segment_predictions']], dtype=np.float64),
+            segment_duration=np.array(result['track_info']['segment_duration']),
+            total_duration=np.array(result['track_info']['duration']),
+            num_segments_total=np.array(result['track_info']['num_segments_total'])
+        ))
+    
+    if index_metadata is not None:
+        await anyio.to_thread.run_sync(
+            index_track, content_hash, embeddings, result, deployment.classifier.extractor_version, index_metadata
+        )
+    
+    result_key = classification_cache.make_key(
+        'track', content_hash, deployment.version,
+        **track_cache_params(segment_duration, adaptive, segment_hop)
+    )
+    classification_cache.set_result(result_key, result)
+    return result
+
+async def classify_stored_track(deployment: ModelDeployment, audio_path: str, content_hash: str,
+                                segment_duration: int, adaptive: bool,
+                                segment_hop: Optional[float] = None,
+                                index_metadata: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Classify a track saved to a scratch file, answering repeated content from the result cache.
+    
+    A shadow version, if one is deployed, scores the track either way.
+    
+    Args:
+        deployment: Leased model version to use
+        audio_path: Path to the saved audio file
+        content_hash: SHA-256 hex digest of the file
+        segment_duration: Duration of each segment in seconds
+        adaptive: Stop classifying segments once the genre is decided
+        segment_hop: Seconds between segment starts (default: segment_duration, no overlap)
+        index_metadata: Metadata to index the track with when it is classified, see index_track
+        
+    Returns:
+        Tuple of the classification result and whether it came from the cache
+    """
+    result_key = classification_cache.make_key(
+        'track', content_hash, deployment.version,
+        **track_cache_params(segment_duration, adaptive, segment_hop)
+    )
+    result = classification_cache.get_result(result_key)
+    cached = result is not None
+    if not cached:
+        result = await classify_track_cached(
+            deployment, audio_path, content_hash, segment_duration, adaptive, segment_hop=segment_hop,
+            index_metadata=index_metadata
+        )
+    start_shadow_classification(result, audio_path, content_hash, segment_duration, adaptive, segment_hop)
+    return result, cached
+
+@router.post("/upload", openapi_extra=upload_request_body())
 async def classify_uploaded_track(
-    file: UploadFile = File(...),
+    request: Request,
     segment_duration: Optional[int] = 30,
-    user_info: dict = Depends(get_current_user)
+    adaptive: Optional[bool] = None,
+    segment_hop: Optional[float] = None,
+    user_info: dict = Depends(get_current_user),
+    profiler: Optional[RequestProfiler] = Depends(request_profiling),
+    deployment: ModelDeployment = Depends(model_deployment)
 ) -> Dict[str, Any]:
     """
     Classify genre of an uploaded music track.
     
     The track will be divided into segments and each segment will be classified.
     The final prediction is based on majority voting across all segments.
+    In adaptive mode classification stops once the genre is decided;
+    track_info reports how many segments were used. When a mood head is
+    loaded (MOOD_HEAD_PATH), every segment also gets a mood from the same
+    embeddings, and the track's mood is reported under mood_prediction.
+    Classified tracks are added to the similar-track index; pass
+    file_info.content_hash to /similar to find tracks that sound alike.
     
     Args:
-        file: Audio file to classify
+        request: Request with the audio file to classify in its 'file' form field
         segment_duration: Duration of each segment in seconds (default: 30)
+        adaptive: Stop early once the genre is decided (default: CLASSIFICATION_ADAPTIVE_SAMPLING)
+        segment_hop: Seconds between segment starts; shorter than segment_duration for
+            overlapping segments and a denser timeline (default: segment_duration)
         user_info: Current user information from Firebase auth
+        profiler: Active profiler when the request is profiled, see request_profiling
+        deployment: Model version the request runs on, see model_deployment
         
     Returns:
         Classification results including overall prediction and segment details
     """
     try:
-        # Initialize classifier
-        music_classifier = get_classifier()
-        
-        # Validate file
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="No file provided")
+        # Validate segment duration and hop
+        validate_segment_params(segment_duration, segment_hop)
         
-        # Check file extension
-        file_ext = Path(file.filename).suffix.lower()
-        if file_ext not in music_classifier.get_supported_formats():
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Unsupported file format. Supported formats: {music_classifier.get_supported_formats()}"
-            )
-        
-        # Validate segment duration
-        if segment_duration <= 0 or segment_duration > 300:  # Max 5 minutes per segment
-            raise HTTPException(
-                status_code=400, 
-                detail="Segment duration must be between 1 and 300 seconds"
-            )
-        
-        # Save uploaded file temporarily
-        content = await file.read()
-        
-        # Create temporary file
-        tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_ext)
-        tmp_file_path = tmp_file.name
-        tmp_file.close()  # Close the file handle so we can write to it with aiofiles
+        # Stream the upload to a scratch file, hashing it on the way
+        upload = await receive_audio_upload(request, deployment.classifier)
+        tmp_file_path = upload.path
+        content_hash = upload.content_hash
+        file_info = {
+            'filename': upload.filename,
+            'file_size': upload.size,
+            'content_hash': content_hash,
+            'user_id': user_info.get('uid')
+        }
         
         try:
-            # Write content to temporary file
-            async with aiofiles.open(tmp_file_path, 'wb') as f:
-                await f.write(content)
-            
-            # Classify the track
-            result = music_classifier.classify_full_track(tmp_file_path, segment_duration)
+            # Classify the track, or answer a repeated upload straight from the cache
+            if adaptive is None:
+                adaptive = ADAPTIVE_SAMPLING
+            result, cached = await classify_stored_track(
+                deployment, tmp_file_path, content_hash, segment_duration, adaptive, segment_hop,
+                {'source': 'upload', 'owner': user_info.get('uid'), 'title': upload.filename}
+            )
             
             # Add metadata
-            result['file_info'] = {
-                'filename': file.filename,
-                'file_size': len(content),
-                'user_id': user_info.get('uid')
-            }
+            result['file_info'] = file_info
+            result['cached'] = cached
             
-            logger.info(f"Successfully classified track {file.filename} for user {user_info.get('uid')}")
+            if cached:
+                logger.info(f"Served cached classification of {upload.filename} for user {user_info.get('uid')}")
+            else:
+                logger.info(f"Successfully classified track {upload.filename} for user {user_info.get('uid')}")
             return result
             
         finally:
@@ -134,6 +766,201 @@ async def classify_uploaded_track(
         logger.error(f"Error classifying uploaded track: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error during classification")
 
+async def run_classification_job(job: ClassificationJob, deployment: ModelDeployment,
+                                 tmp_file_path: str, content_hash: str, file_info: Dict[str, Any],
+                                 adaptive: bool = False, segment_hop: Optional[float] = None):
+    """
+    Background task of a classification job; publishes segments as they finish.
+    
+    Args:
+        job: Job to run
+        deployment: Model version to use, leased for the job and released when it ends
+        tmp_file_path: Scratch file of the upload, deleted when the job ends
+        content_hash: SHA-256 hex digest of the upload
+        file_info: File metadata added to the final result
+        adaptive: Stop classifying segments once the genre is decided
+        segment_hop: Seconds between segment starts (default: the job's segment duration)
+    """
+    try:
+        result_key = classification_cache.make_key(
+            'track', content_hash, deployment.version,
+            **track_cache_params(job.segment_duration, adaptive, segment_hop)
+        )
+        result = classification_cache.get_result(result_key)
+        cached = result is not None
+        
+        job.mark_running()
+        if not cached:
+            result = await classify_track_cached(
+                deployment, tmp_file_path, content_hash, job.segment_duration, adaptive,
+                on_segment=job.add_segment, segment_hop=segment_hop,
+                index_metadata={'source': 'upload', 'owner': job.user_id, 'title': file_info['filename']}
+            )
+        start_shadow_classification(result, tmp_file_path, content_hash, job.segment_duration, adaptive, segment_hop)
+        
+        result['file_info'] = file_info
+        result['cached'] = cached
+        job.complete(result)
+        logger.info(f"Classification job {job.id} completed for user {job.user_id}")
+        
+    except Exception as e:
+        logger.error(f"Classification job {job.id} failed: {str(e)}")
+        job.fail("Internal server error during classification")
+    finally:
+        model_registry.release(deployment)
+        try:
+            os.unlink(tmp_file_path)
+        except:
+            pass
+
+async def get_owned_job(job_id: str, user_info: dict) -> Union[ClassificationJob, SharedClassificationJob]:
+    """Get a job of the current user, run by this or (with REDIS_URL) another API process, or raise 404."""
+    job = await job_manager.find_job(job_id)
+    if job is None or job.user_id != user_info.get('uid'):
+        raise HTTPException(status_code=404, detail="Classification job not found")
+    return job
+
+@router.post("/jobs", status_code=202, openapi_extra=upload_request_body())
+async def create_classification_job(
+    request: Request,
+    segment_duration: Optional[int] = DEFAULT_SEGMENT_DURATION,
+    adaptive: Optional[bool] = None,
+    segment_hop: Optional[float] = None,
+    user_info: dict = Depends(get_current_user),
+    deployment: ModelDeployment = Depends(model_deployment)
+) -> Dict[str, Any]:
+    """
+    Start classifying an uploaded track in the background.
+    
+    Returns as soon as the upload is stored. Segment predictions and the running
+    genre votes can be followed on the job's events URL (Server-Sent Events) or
+    polled on its status URL.
+    
+    Args:
+        request: Request with the audio file to classify in its 'file' form field
+        segment_duration: Duration of each segment in seconds (default: 30)
+        adaptive: Stop early once the genre is decided (default: CLASSIFICATION_ADAPTIVE_SAMPLING)
+        segment_hop: Seconds between segment starts (default: segment_duration, no overlap)
+        user_info: Current user information from Firebase auth
+        deployment: Model version the job runs on, see model_deployment
+        
+    Returns:
+        Job id and the URLs to follow it
+    """
+    try:
+        music_classifier = deployment.classifier
+        
+        validate_segment_params(segment_duration, segment_hop)
+        
+        upload = await receive_audio_upload(request, music_classifier)
+        
+        try:
+            job = job_manager.create_job(music_classifier.genres, upload.filename, user_info.get('uid'), segment_duration)
+        except RuntimeError as e:
+            os.unlink(upload.path)
+            raise HTTPException(status_code=503, detail=str(e))
+        
+        file_info = {
+            'filename': upload.filename,
+            'file_size': upload.size,
+            'content_hash': upload.content_hash,
+            'user_id': user_info.get('uid')
+        }
+        # The job keeps the model version after this request has returned its lease
+        job_manager.start(run_classification_job(
+            job, model_registry.acquire(deployment), upload.path, upload.content_hash, file_info,
+            ADAPTIVE_SAMPLING if adaptive is None else adaptive, segment_hop
+        ))
+        
+        logger.info(f"Started classification job {job.id} for {upload.filename}, user {user_info.get('uid')}")
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"{router.prefix}/jobs/{job.id}",
+            "events_url": f"{router.prefix}/jobs/{job.id}/events"
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error starting classification job: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to start classification job")
+
+@router.get("/jobs/{job_id}")
+async def get_classification_job(job_id: str, user_info: dict = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    Get the status and the segment predictions so far of a classification job.
+    
+    Args:
+        job_id: Job id returned when the job was created
+        user_info: Current user information from Firebase auth
+        
+    Returns:
+        Job status, partial results and, once completed, the full result
+    """
+    return (await get_owned_job(job_id, user_info)).to_dict()
+
+@router.get("/jobs/{job_id}/events")
+async def stream_classification_job(job_id: str, user_info: dict = Depends(get_current_user)):
+    """
+    Stream a classification job's progress as Server-Sent Events.
+    
+    Events: 'status', one 'segment' per finished segment (with the running
+    genre votes), then 'completed' with the full result or 'failed'.
+    
+    Args:
+        job_id: Job id returned when the job was created
+        user_info: Current user information from Firebase auth
+    """
+    job = await get_owned_job(job_id, user_info)
+    return StreamingResponse(
+        job.stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/similar/{content_hash}")
+async def get_similar_tracks(content_hash: str, k: int = 10,
+                             user_info: dict = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    Find the classified tracks that sound most like a given one.
+    
+    Tracks are compared by the cosine similarity of their mean EfficientNetB0
+    embeddings. Uploads are only visible to the user who uploaded them,
+    song previews to everyone.
+    
+    Args:
+        content_hash: content_hash from the file_info of a classification result
+        k: Number of tracks to return (at most MAX_SIMILAR_TRACKS)
+        user_info: Current user information from Firebase auth
+        
+    Returns:
+        The track, its most similar tracks with their similarity scores, and index statistics
+    """
+    if not 1 <= k <= MAX_SIMILAR_TRACKS:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {MAX_SIMILAR_TRACKS}")
+    
+    track_index = await anyio.to_thread.run_sync(get_track_index)
+    if track_index is None:
+        raise HTTPException(status_code=503, detail="Similar-track search is disabled")
+    
+    uid = user_info.get('uid')
+    visible = lambda metadata: metadata.get('source') != 'upload' or metadata.get('owner') == uid
+    await anyio.to_thread.run_sync(track_index.refresh)  # The track may have been indexed by another worker
+    metadata = track_index.get(content_hash)
+    if metadata is None or not visible(metadata):
+        raise HTTPException(status_code=404, detail="Track not found in the similar-track index")
+    
+    similar = await anyio.to_thread.run_sync(partial(
+        track_index.search, track_index.vector(content_hash), k, accept=visible, exclude=content_hash
+    ))
+    public = lambda track: {key: value for key, value in track.items() if key != 'owner'}
+    return {
+        "track": public({"id": content_hash, **metadata}),
+        "similar_tracks": [public(track) for track in similar],
+        "index": track_index.stats()
+    }
+
 @router.get("/supported-formats")
 async def get_supported_formats() -> Dict[str, Any]:
     """
@@ -143,13 +970,14 @@ async def get_supported_formats() -> Dict[str, Any]:
         List of supported file formats and additional info
     """
     try:
+        await wait_for_warm_up()
         music_classifier = get_classifier()
         
         return {
             "supported_formats": music_classifier.get_supported_formats(),
-            "max_file_size": "100MB",  # You can configure this
-            "max_segment_duration": 300,
-            "default_segment_duration": 30,
+            "max_file_size": f"{MAX_FILE_SIZE // (1024 * 1024)}MB",
+            "max_segment_duration": MAX_SEGMENT_DURATION,
+            "default_segment_duration": DEFAULT_SEGMENT_DURATION,
             "note": "Larger files will take longer to process."
         }
         
@@ -166,6 +994,7 @@ async def get_available_genres() -> Dict[str, Any]:
         List of available genres and model information
     """
     try:
+        await wait_for_warm_up()
         music_classifier = get_classifier()
         
         return {
@@ -179,76 +1008,239 @@ async def get_available_genres() -> Dict[str, Any]:
         logger.error(f"Error getting available genres: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to get genre information")
 
-@router.post("/segment")
-async def classify_audio_segment(
-    file: UploadFile = File(...),
-    start_time: int = Form(0),
-    duration: int = Form(30),
-    user_info: dict = Depends(get_current_user)
-) -> Dict[str, Any]:
+@router.get("/scheduler-stats")
+async def get_scheduler_stats() -> Dict[str, Any]:
     """
-    Classify a specific segment of an audio file.
+    Get queue depth and batch-size statistics of the inference scheduler.
+    
+    Returns:
+        Scheduler statistics, or an idle status if no classification has run yet
+    """
+    deployment = model_registry.active
+    if deployment is not None and deployment.pool is not None:
+        return {"status": "disabled", "note": f"Classification runs in {deployment.pool.workers} worker processes"}
+    if deployment is None or deployment.scheduler is None:
+        return {"status": "idle", "note": "Scheduler starts with the first classification request"}
+    
+    return {"status": "running", "model_version": deployment.version, **deployment.scheduler.get_stats()}
+
+@router.get("/cache-stats")
+async def get_cache_stats() -> Dict[str, Any]:
+    """
+    Get hit ratio and size statistics of the classification cache.
+    
+    Returns:
+        Cache statistics
+    """
+    return classification_cache.get_stats()
+
+@router.get("/models")
+async def get_model_versions(user_info: dict = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    Get the active, shadow, loading, draining and recently retired model versions.
     
     Args:
-        file: Audio file to classify
-        start_time: Start time of the segment in seconds
-        duration: Duration of the segment in seconds
         user_info: Current user information from Firebase auth
         
     Returns:
-        Classification results for the specified segment
+        This process's model registry status, including shadow agreement statistics,
+        and the deployment state every process follows
     """
-    try:
-        # Initialize classifier
-        music_classifier = get_classifier()
+    if not is_model_admin(user_info):
+        raise HTTPException(status_code=403, detail="Model management is restricted to administrators")
+    return {
+        **model_registry.status(),
+        "process_id": os.getpid(),
+        "applied_generation": _applied_state['generation'],
+        "deployment_state": await anyio.to_thread.run_sync(deployment_state.read)
+    }
+
+def start_applying(state: Dict[str, Any]):
+    """Apply a deployment state change in this process now; the other processes pick it up when they poll."""
+    task = asyncio.create_task(apply_deployment_state(state))
+    _apply_tasks.add(task)
+    task.add_done_callback(_apply_tasks.discard)
+
+@router.post("/models", status_code=202)
+async def deploy_model_version(request: ModelDeployRequest,
+                               user_info: dict = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    Load a model version in the background and activate it, or shadow the active version with it.
+    
+    The active version keeps serving while the new one loads and warms up.
+    Activation takes effect for new requests; requests in progress finish on
+    the previous version, which is then released. The deployment is recorded
+    in the shared deployment state, so every API process loads the version
+    within MODEL_SYNC_INTERVAL_SECONDS. Follow progress on GET /models.
+    
+    Args:
+        request: Model and label encoder inside the model directory, and the deployment mode
+        user_info: Current user information from Firebase auth
         
-        # Validate inputs
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="No file provided")
+    Returns:
+        What is being loaded
+    """
+    if not is_model_admin(user_info):
+        raise HTTPException(status_code=403, detail="Model management is restricted to administrators")
+    model_path = resolve_model_path(request.model)
+    encoder_path = model_path if os.path.isdir(model_path) else resolve_model_path(request.encoder)
+    sample_rate = None
+    if request.shadow:
+        sample_rate = SHADOW_SAMPLE_RATE if request.shadow_sample_rate is None else request.shadow_sample_rate
+        if not 0 < sample_rate <= 1:
+            raise HTTPException(status_code=400, detail="Shadow sample rate must be between 0 and 1")
+    
+    description = {"model_path": model_path, "encoder_path": encoder_path}
+    if model_registry.loading:
+        raise HTTPException(status_code=409, detail="Another model version is still loading")
+    state = await anyio.to_thread.run_sync(deployment_state.deploy, model_path, encoder_path, sample_rate)
+    start_applying(state)
+    logger.info(f"Loading model {request.model} for user {user_info.get('uid')}"
+                + (f" as a shadow of {sample_rate:.0%} of requests" if request.shadow else ""))
+    return {"status": "loading", "mode": "shadow" if request.shadow else "active", "generation": state['generation'],
+            **description}
+
+@router.post("/models/shadow/promote")
+async def promote_shadow_model(user_info: dict = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    Make the shadow model version the active one, draining the previous version.
+    
+    Applied in this process before returning, and by the others when they poll.
+    
+    Args:
+        user_info: Current user information from Firebase auth
         
-        if start_time < 0:
-            raise HTTPException(status_code=400, detail="Start time must be non-negative")
+    Returns:
+        The newly active version
+    """
+    if not is_model_admin(user_info):
+        raise HTTPException(status_code=403, detail="Model management is restricted to administrators")
+    try:
+        state = await anyio.to_thread.run_sync(deployment_state.promote_shadow)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    await apply_deployment_state(state)
+    deployment = model_registry.active
+    if deployment is None:
+        raise HTTPException(status_code=503, detail="No model version is active")
+    return {"status": "active", **deployment.describe()}
+
+@router.delete("/models/shadow")
+async def stop_shadow_model(user_info: dict = Depends(get_current_user)) -> Dict[str, Any]:
+    """
+    Stop shadow scoring and release the shadow model version.
+    
+    Applied in this process before returning, and by the others when they poll.
+    
+    Args:
+        user_info: Current user information from Firebase auth
         
-        if duration <= 0 or duration > 300:
-            raise HTTPException(
-                status_code=400, 
-                detail="Duration must be between 1 and 300 seconds"
-            )
+    Returns:
+        Model registry status
+    """
+    if not is_model_admin(user_info):
+        raise HTTPException(status_code=403, detail="Model management is restricted to administrators")
+    state = await anyio.to_thread.run_sync(deployment_state.stop_shadow)
+    await apply_deployment_state(state)
+    return model_registry.status()
+
+@router.get("/profiles/{request_id}", response_class=PlainTextResponse)
+async def get_request_profile(request_id: str, user_info: dict = Depends(get_current_user)) -> str:
+    """
+    Get the profile of a profiled request in the folded stack format.
+    
+    Render it with flamegraph.pl, speedscope or inferno.
+    
+    Args:
+        request_id: The X-Profile-ID header of the profiled response
+        user_info: Current user information from Firebase auth
         
-        # Check file extension
-        file_ext = Path(file.filename).suffix.lower()
-        if file_ext not in music_classifier.get_supported_formats():
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Unsupported file format. Supported formats: {music_classifier.get_supported_formats()}"
-            )
+    Returns:
+        One 'frame;frame;frame count' line per sampled stack
+    """
+    if not is_profiling_admin(user_info):
+        raise HTTPException(status_code=403, detail="Profiling is restricted to administrators")
+    path = profile_path(PROFILE_OUTPUT_DIR, request_id)
+    if not _PROFILE_ID_PATTERN.fullmatch(request_id) or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return await anyio.to_thread.run_sync(Path(path).read_text)
+
+@router.post("/segment", openapi_extra=upload_request_body(
+    start_time={"type": "integer", "default": 0}, duration={"type": "integer", "default": 30}
+))
+async def classify_audio_segment(
+    request: Request,
+    user_info: dict = Depends(get_current_user),
+    profiler: Optional[RequestProfiler] = Depends(request_profiling),
+    deployment: ModelDeployment = Depends(model_deployment)
+) -> Dict[str, Any]:
+    """
+    Classify a specific segment of an audio file.
+    
+    Args:
+        request: Request with the audio file to classify in its 'file' form field, and
+            the form fields start_time (segment start in seconds, default 0) and
+            duration (segment duration in seconds, default 30)
+        user_info: Current user information from Firebase auth
+        profiler: Active profiler when the request is profiled, see request_profiling
+        deployment: Model version the request runs on, see model_deployment
         
-        # Save uploaded file temporarily
-        content = await file.read()
+    Returns:
+        Classification results for the specified segment
+    """
+    try:
+        music_classifier = deployment.classifier
         
-        # Create temporary file
-        tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_ext)
-        tmp_file_path = tmp_file.name
-        tmp_file.close()  # Close the file handle so we can write to it with aiofiles
+        # Stream the upload to a scratch file, hashing it on the way
+        upload = await receive_audio_upload(request, music_classifier)
+        tmp_file_path = upload.path
+        content_hash = upload.content_hash
+        file_info = {
+            'filename': upload.filename,
+            'file_size': upload.size,
+            'content_hash': content_hash,
+            'user_id': user_info.get('uid')
+        }
         
         try:
-            # Write content to temporary file
-            async with aiofiles.open(tmp_file_path, 'wb') as f:
-                await f.write(content)
+            # Validate inputs
+            try:
+                start_time = int(upload.fields.get('start_time', 0))
+                duration = int(upload.fields.get('duration', 30))
+            except ValueError:
+                raise HTTPException(status_code=422, detail="start_time and duration must be integers")
+            
+            if start_time < 0:
+                raise HTTPException(status_code=400, detail="Start time must be non-negative")
+            
+            if duration <= 0 or duration > MAX_SEGMENT_DURATION:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"Duration must be between 1 and {MAX_SEGMENT_DURATION} seconds"
+                )
+            
+            # Answer repeated segment requests straight from the cache
+            result_key = classification_cache.make_key(
+                'segment', content_hash, deployment.version, start_time=start_time, duration=duration
+            )
+            result = classification_cache.get_result(result_key)
+            if result is not None:
+                result['file_info'] = file_info
+                result['cached'] = True
+                logger.info(f"Served cached segment classification of {upload.filename} for user {user_info.get('uid')}")
+                return result
             
             # Classify the specific segment
-            result = music_classifier.predict_genre_from_audio_segment(
-                tmp_file_path, start_time, duration
+            result = await run_classification(
+                deployment, 'predict_genre_from_audio_segment', tmp_file_path, start_time, duration
             )
+            classification_cache.set_result(result_key, result)
             
             # Add metadata
-            result['file_info'] = {
-                'filename': file.filename,
-                'file_size': len(content),
-                'user_id': user_info.get('uid')
-            }
+            result['file_info'] = file_info
+            result['cached'] = False
             
-            logger.info(f"Successfully classified segment of {file.filename} for user {user_info.get('uid')}")
+            logger.info(f"Successfully classified segment of {upload.filename} for user {user_info.get('uid')}")
             return result
             
         finally:
@@ -1,4 +1,10 @@
-from fastapi import APIRouter, Request
+import os
+import re
+import logging
+from urllib.parse import urlparse
+
+import anyio
+from fastapi import APIRouter, Request, Depends
 from ...services.spotify_service import (
     get_spotify_client, 
     search_track, 
@@ -6,8 +12,27 @@ from ...services.spotify_service import (
     get_all_albums, 
     get_all_tracks,
     get_spotify_user_client,
-    get_genres
+    get_genres,
+    get_preview_url
+)
+from ...services.model_registry import ModelDeployment
+from ...services.upload_storage import save_download, DownloadError, UploadTooLargeError
+from ...auth.firebase_auth import get_current_user
+from ...config.music_config import (
+    ADAPTIVE_SAMPLING,
+    DEFAULT_SEGMENT_DURATION,
+    MAX_FILE_SIZE,
+    SONG_PREVIEW_HOSTS,
+    SONG_PREVIEW_TIMEOUT_SECONDS,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_SCRATCH_DIR,
 )
+from ..music_classification import classify_stored_track, model_deployment
+
+logger = logging.getLogger(__name__)
+
+# open.spotify.com/track/<id> links (optionally localized) and spotify:track:<id> URIs
+SPOTIFY_TRACK_PATTERN = re.compile(r"^(?:https://open\.spotify\.com/(?:intl-[a-z-]+/)?track/|spotify:track:)([A-Za-z0-9]{22})")
 
 router = APIRouter(
     prefix="/songs",
@@ -103,9 +128,62 @@ def get_songs_by_genre(request: Request, genre: str):
         return {"error": str(e)}
 
 @router.get("/classify")
-def classify_music(track_url: str):
-    # This is a placeholder that returns mock data
-    return {"track": track_url, "genre": "Pop", "mood": "Happy"}
+async def classify_music(track_url: str, user_info: dict = Depends(get_current_user),
+                         deployment: ModelDeployment = Depends(model_deployment)):
+    """
+    Classify the genre and mood of a song from its 30-second preview.
+
+    Genre and mood come from the same forward pass; mood is None unless a mood
+    head is loaded (MOOD_HEAD_PATH). Previews are cached by content like uploads,
+    and indexed for /api/music/classify/similar/{content_hash} queries by every user.
+
+    Args:
+        track_url: Spotify track link or URI, or a preview URL on one of SONG_PREVIEW_HOSTS
+    """
+    match = SPOTIFY_TRACK_PATTERN.match(track_url)
+    if match:
+        preview_url = await anyio.to_thread.run_sync(get_preview_url, get_spotify_client(), match.group(1))
+        if not preview_url:
+            return {"error": "Spotify has no preview for this track"}
+    else:
+        preview_url = track_url
+
+    # Only fetch from the preview CDN, never from arbitrary hosts
+    parsed = urlparse(preview_url)
+    if parsed.scheme != "https" or parsed.hostname not in SONG_PREVIEW_HOSTS:
+        return {"error": "Expected a Spotify track link or a preview URL"}
+
+    # Spotify previews are MP3s without an extension in the URL
+    suffix = os.path.splitext(parsed.path)[1].lower() or ".mp3"
+    try:
+        download = await save_download(
+            preview_url, suffix, MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE, SONG_PREVIEW_TIMEOUT_SECONDS, UPLOAD_SCRATCH_DIR
+        )
+    except (DownloadError, UploadTooLargeError) as e:
+        return {"error": str(e)}
+
+    try:
+        result, cached = await classify_stored_track(
+            deployment, download.path, download.content_hash, DEFAULT_SEGMENT_DURATION, ADAPTIVE_SAMPLING,
+            index_metadata={'source': 'spotify', 'title': track_url, 'spotify_id': match.group(1) if match else None}
+        )
+    except Exception as e:
+        logger.error(f"Error classifying preview of {track_url}: {str(e)}")
+        return {"error": "Could not classify the track preview"}
+    finally:
+        os.unlink(download.path)
+
+    mood = result.get("mood_prediction")
+    return {
+        "track": track_url,
+        "genre": result["overall_prediction"]["predicted_genre"],
+        "genre_confidence": result["overall_prediction"]["confidence"],
+        "mood": mood["predicted_mood"] if mood else None,
+        "mood_confidence": mood["confidence"] if mood else None,
+        "model_version": result["model_version"],
+        "content_hash": download.content_hash,
+        "cached": cached
+    }
 
 @router.get("/available-genres")
 def available_genres():
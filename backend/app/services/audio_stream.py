@@ -0,0 +1,153 @@
+"""
+Audio Streaming
+Decodes long tracks in fixed-size blocks and keeps a bounded window of recent samples.
+
+librosa.load and decode_audio hold the whole track in memory, which for an
+hour-long mix is hundreds of MB per request. stream_audio yields the track as
+mono float32 blocks at SAMPLE_RATE instead: MP3, WAV, FLAC and OGG are read
+by libsndfile, downmixed by averaging the channels and resampled with a
+stateful soxr stream (the same resampler and quality as librosa.load), so the
+samples match a full decode; other formats are read from FFmpeg's output pipe.
+SampleRingBuffer holds the most recent samples, addressed by their position
+in the track, for cutting analysis windows out of the stream.
+"""
+import logging
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from ..config.music_config import SAMPLE_RATE, NATIVE_AUDIO_FORMATS
+from .ffmpeg_decoder import decode_audio_blocks, ffmpeg_available, probe_duration
+
+logger = logging.getLogger(__name__)
+
+
+class SampleRingBuffer:
+    def __init__(self, capacity: int):
+        """
+        Create an empty buffer.
+
+        Args:
+            capacity: Most samples held at once
+        """
+        self.capacity = capacity
+        self._samples = np.zeros(capacity, dtype=np.float32)
+        self.start = 0  # Track position of the oldest sample held
+        self.end = 0    # Track position after the newest sample
+
+    def __len__(self) -> int:
+        return max(0, self.end - self.start)
+
+    def append(self, samples: np.ndarray):
+        """
+        Add the next samples of the track.
+
+        Samples before the position passed to discard_until are skipped.
+
+        Raises:
+            ValueError: If the samples do not fit; discard older samples first
+        """
+        skip = min(max(0, self.start - self.end), len(samples))
+        self.end += skip
+        samples = samples[skip:]
+        if len(self) + len(samples) > self.capacity:
+            raise ValueError(f"{len(samples)} samples do not fit, {len(self)} of {self.capacity} are in use")
+
+        position = self.end % self.capacity
+        first = min(len(samples), self.capacity - position)
+        self._samples[position:position + first] = samples[:first]
+        self._samples[:len(samples) - first] = samples[first:]
+        self.end += len(samples)
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """
+        Copy the samples from track position start up to stop.
+
+        Raises:
+            ValueError: If the range is not held in the buffer
+        """
+        if start < self.start or stop > self.end or start > stop:
+            raise ValueError(f"Samples {start}-{stop} are not buffered (holding {self.start}-{self.end})")
+        first, last = start % self.capacity, stop % self.capacity
+        if first < last or start == stop:
+            return self._samples[first:last].copy()
+        return np.concatenate((self._samples[first:], self._samples[:last]))
+
+    def discard_until(self, position: int):
+        """Drop the samples before a track position; it may lie ahead of the samples added so far."""
+        self.start = max(self.start, position)
+
+
+def audio_duration(audio_path: str) -> Optional[float]:
+    """
+    Duration of an audio file from its header, without decoding it.
+
+    Args:
+        audio_path: Path to audio file
+
+    Returns:
+        Duration in seconds, or None if it cannot be read
+    """
+    if Path(audio_path).suffix.lower() in NATIVE_AUDIO_FORMATS:
+        import soundfile
+
+        try:
+            return soundfile.info(audio_path).duration
+        except Exception as e:
+            logger.warning(f"libsndfile could not read the header of {audio_path}: {str(e)}")
+    return probe_duration(audio_path)
+
+
+def _soundfile_blocks(audio_path: str, block_seconds: float) -> Iterator[np.ndarray]:
+    """Read a file with libsndfile, downmixed and resampled to SAMPLE_RATE block by block."""
+    import soundfile
+    import soxr
+
+    with soundfile.SoundFile(audio_path) as f:
+        resampler = soxr.ResampleStream(f.samplerate, SAMPLE_RATE, 1, dtype='float32') \
+            if f.samplerate != SAMPLE_RATE else None
+        block_frames = max(1, int(block_seconds * f.samplerate))
+        while True:
+            block = f.read(block_frames, dtype='float32', always_2d=True)
+            last = len(block) < block_frames
+            # Same downmix as librosa.to_mono
+            samples = block.mean(axis=1, dtype=np.float32)
+            if resampler is not None:
+                samples = resampler.resample_chunk(samples, last=last)
+            if len(samples):
+                yield samples
+            if last:
+                return
+
+
+def stream_audio(audio_path: str, block_seconds: float) -> Iterator[np.ndarray]:
+    """
+    Decode an audio file as consecutive blocks of mono samples at SAMPLE_RATE.
+
+    Args:
+        audio_path: Path to audio file
+        block_seconds: Approximate seconds of audio per block
+
+    Yields:
+        float32 arrays of mono samples at SAMPLE_RATE
+
+    Raises:
+        Exception: If the file cannot be decoded
+    """
+    if Path(audio_path).suffix.lower() in NATIVE_AUDIO_FORMATS or not ffmpeg_available():
+        blocks = _soundfile_blocks(audio_path, block_seconds)
+        try:
+            # Fall back to FFmpeg when libsndfile cannot open the file, but not halfway through it
+            first = next(blocks, None)
+        except Exception as e:
+            if not ffmpeg_available():
+                raise Exception(f"Cannot read audio file: {str(e)}")
+            logger.warning(f"libsndfile failed to stream {audio_path}: {str(e)}")
+        else:
+            if first is not None:
+                yield first
+            yield from blocks
+            return
+
+    yield from decode_audio_blocks(audio_path, max(1, int(block_seconds * SAMPLE_RATE)), SAMPLE_RATE)
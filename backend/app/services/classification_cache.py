@@ -0,0 +1,196 @@
+"""
+Classification Cache
+Content-addressed cache for classification results and segment embeddings.
+
+Keys combine the SHA-256 of the uploaded bytes with the segment parameters and
+the model (or feature extractor) version, so a cached entry can never be served
+for a different file, different segmentation or a different model. Values live
+in an in-process LRU tier bounded by total size and, when REDIS_URL is set, in a
+shared Redis tier that survives restarts and is visible to every worker.
+Embeddings are far larger than results (a (7, 7, 1280) float16 map is 125 KB
+per segment), so they get an in-process tier of their own and cannot evict
+results.
+"""
+import io
+import json
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCacheTier:
+    """In-process LRU of byte strings, evicting least recently used entries by total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return  # Larger than the whole cache, not worth evicting everything for
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "size_bytes": self._size, "max_bytes": self.max_bytes}
+
+
+class RedisCacheTier:
+    """Shared Redis tier. Connection problems are logged and treated as misses."""
+
+    def __init__(self, url: str, ttl_seconds: int):
+        import redis
+
+        self.ttl_seconds = ttl_seconds
+        self._client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._client.get(key)
+        except Exception as e:
+            logger.warning(f"Redis cache get failed: {str(e)}")
+            return None
+
+    def set(self, key: str, value: bytes):
+        try:
+            self._client.set(key, value, ex=self.ttl_seconds or None)
+        except Exception as e:
+            logger.warning(f"Redis cache set failed: {str(e)}")
+
+
+class ClassificationCache:
+    def __init__(self, max_bytes: int, redis_url: Optional[str] = None, ttl_seconds: int = 0,
+                 embeddings_max_bytes: Optional[int] = None):
+        """
+        Initialize the cache tiers.
+
+        Args:
+            max_bytes: Size limit of the in-process LRU tier
+            redis_url: Redis connection URL; no Redis tier when empty
+            ttl_seconds: Expiry of Redis entries (0 keeps them until Redis evicts them)
+            embeddings_max_bytes: Size limit of the in-process embeddings tier (default: max_bytes)
+        """
+        self.memory = LRUCacheTier(max_bytes)
+        self.embeddings_memory = LRUCacheTier(max_bytes if embeddings_max_bytes is None else embeddings_max_bytes)
+        self.redis = None
+        if redis_url:
+            try:
+                self.redis = RedisCacheTier(redis_url, ttl_seconds)
+                logger.info("Redis classification cache tier enabled")
+            except ImportError:
+                logger.warning("redis package not available, using the in-process cache only")
+
+        self._stats_lock = threading.Lock()
+        self._hits = {"memory": 0, "redis": 0}
+        self._misses = 0
+
+    @staticmethod
+    def make_key(kind: str, content_hash: str, version: str, **params: Any) -> str:
+        """
+        Build a cache key.
+
+        Args:
+            kind: Entry type, e.g. 'track', 'segment' or 'embeddings'
+            content_hash: SHA-256 hex digest of the audio file
+            version: Model version for results, extractor version for embeddings
+            **params: Segment parameters that change the output
+
+        Returns:
+            Cache key string
+        """
+        param_part = ",".join(f"{name}={params[name]}" for name in sorted(params))
+        return f"vibesync:{kind}:{version}:{content_hash}:{param_part}"
+
+    def _memory_tier(self, key: str) -> LRUCacheTier:
+        return self.embeddings_memory if key.split(":")[1] == "embeddings" else self.memory
+
+    def _get(self, key: str) -> Optional[bytes]:
+        memory = self._memory_tier(key)
+        value = memory.get(key)
+        tier = "memory"
+        if value is None and self.redis is not None:
+            value = self.redis.get(key)
+            tier = "redis"
+            if value is not None:
+                memory.set(key, value)  # Promote to the local tier
+
+        with self._stats_lock:
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits[tier] += 1
+        CACHE_LOOKUPS.labels(kind=key.split(":")[1], result=tier if value is not None else "miss").inc()
+        return value
+
+    def _set(self, key: str, value: bytes):
+        self._memory_tier(key).set(key, value)
+        if self.redis is not None:
+            self.redis.set(key, value)
+
+    def get_result(self, key: str) -> Optional[Dict]:
+        """Get a cached classification result."""
+        value = self._get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_result(self, key: str, result: Dict):
+        """Cache a JSON-serializable classification result."""
+        self._set(key, json.dumps(result).encode("utf-8"))
+
+    def get_embeddings(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Get cached segment embeddings.
+
+        Returns:
+            Dictionary of the arrays passed to set_embeddings, or None on a miss
+        """
+        value = self._get(key)
+        if value is None:
+            return None
+        with np.load(io.BytesIO(value), allow_pickle=False) as archive:
+            return {name: archive[name] for name in archive.files}
+
+    def set_embeddings(self, key: str, **arrays: np.ndarray):
+        """Cache segment embeddings together with the arrays needed to rebuild a result."""
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        self._set(key, buffer.getvalue())
+
+    def get_stats(self) -> Dict:
+        """Get hit ratio and tier statistics."""
+        with self._stats_lock:
+            hits = sum(self._hits.values())
+            lookups = hits + self._misses
+            return {
+                "lookups": lookups,
+                "hits": dict(self._hits),
+                "misses": self._misses,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory": self.memory.get_stats(),
+                "embeddings_memory": self.embeddings_memory.get_stats(),
+                "redis_enabled": self.redis is not None
+            }
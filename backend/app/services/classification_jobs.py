@@ -0,0 +1,307 @@
+"""
+Classification Jobs
+Asynchronous full-track classification with progressive per-segment results.
+
+A job is created as soon as the upload is stored and runs in the background.
+Every segment prediction is published as an event together with the running
+genre votes, so clients can follow progress over Server-Sent Events instead of
+holding a request open for the whole track. A job runs in the API process
+that accepted it. With REDIS_URL its status and events are also written to
+Redis, so every uvicorn worker can answer for it; without Redis only the
+accepting process knows the job. Jobs are dropped JOB_TTL_SECONDS after they
+finish (in Redis, after their last update).
+"""
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import anyio
+
+logger = logging.getLogger(__name__)
+
+# Interval between SSE keep-alive comments while a job is quiet
+KEEPALIVE_SECONDS = 15.0
+
+# Interval at which streams of jobs run by another process check the shared store
+POLL_SECONDS = 0.5
+
+TERMINAL_EVENTS = ("completed", "failed")
+
+
+class RedisJobStore:
+    """Job status and events in Redis. Connection problems are logged; reads then find nothing."""
+
+    def __init__(self, url: str, ttl_seconds: int):
+        import redis
+
+        self.ttl_seconds = ttl_seconds
+        self._client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"vibesync:job:{job_id}"
+
+    def save(self, job: "ClassificationJob", event: Optional[Tuple[str, Dict]] = None):
+        """Store the job's status and append an event to its log."""
+        key = self._key(job.id)
+        try:
+            pipeline = self._client.pipeline()
+            pipeline.set(key, json.dumps({**job.to_dict(), "user_id": job.user_id}), ex=self.ttl_seconds)
+            if event is not None:
+                pipeline.rpush(f"{key}:events", json.dumps(event))
+                pipeline.expire(f"{key}:events", self.ttl_seconds)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Redis job store save failed for job {job.id}: {str(e)}")
+
+    def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The stored status of a job, with its 'user_id', or None."""
+        try:
+            value = self._client.get(self._key(job_id))
+        except Exception as e:
+            logger.warning(f"Redis job store load failed for job {job_id}: {str(e)}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    def events(self, job_id: str, start: int) -> List[Tuple[str, Dict]]:
+        """The job's events from position start on."""
+        try:
+            values = self._client.lrange(f"{self._key(job_id)}:events", start, -1)
+        except Exception as e:
+            logger.warning(f"Redis job store read failed for job {job_id}: {str(e)}")
+            return []
+        return [tuple(json.loads(value)) for value in values]
+
+
+class ClassificationJob:
+    def __init__(self, genres: List[str], filename: str, user_id: Optional[str], segment_duration: int,
+                 store: Optional[RedisJobStore] = None):
+        """
+        Initialize a queued job.
+
+        Args:
+            genres: Genres the classifier can predict, used for the running vote count
+            filename: Name of the uploaded file
+            user_id: Firebase uid of the user who submitted the job
+            segment_duration: Requested segment duration in seconds
+            store: Shared store every status change is written to
+        """
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.filename = filename
+        self.user_id = user_id
+        self.segment_duration = segment_duration
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+        self.segment_predictions: List[Dict] = []
+        self.genre_votes = {genre: 0 for genre in genres}
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+
+        self.events: List[Tuple[str, Dict]] = []
+        self._changed = asyncio.Event()
+        self._store = store
+        if store is not None:
+            store.save(self)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def _publish(self, event: str, data: Dict):
+        """Append an event and wake every stream waiting on this job."""
+        self.events.append((event, data))
+        if self._store is not None:
+            self._store.save(self, (event, data))
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def mark_running(self):
+        self.status = "running"
+        self._publish("status", {"status": self.status})
+
+    def add_segment(self, segment: Dict):
+        """Record one finished segment and publish it with the running vote count."""
+        self.segment_predictions.append(segment)
+        self.genre_votes[segment['predicted_genre']] = self.genre_votes.get(segment['predicted_genre'], 0) + 1
+        self._publish("segment", {
+            "segment": segment,
+            "segments_completed": len(self.segment_predictions),
+            "genre_votes": dict(self.genre_votes)
+        })
+
+    def complete(self, result: Dict):
+        """
+        Finish the job. Segments the classifier did not report progressively,
+        e.g. on a cache hit, are published before the final result.
+        """
+        for segment in result.get('segment_predictions', [])[len(self.segment_predictions):]:
+            self.add_segment(segment)
+        self.result = result
+        self.status = "completed"
+        self.finished_at = time.time()
+        self._publish("completed", {"result": result})
+
+    def fail(self, error: str):
+        self.error = error
+        self.status = "failed"
+        self.finished_at = time.time()
+        self._publish("failed", {"error": error})
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the job status, partial results and, once finished, the final result."""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "segment_duration": self.segment_duration,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "segments_completed": len(self.segment_predictions),
+            "segment_predictions": self.segment_predictions,
+            "genre_votes": self.genre_votes,
+            "result": self.result,
+            "error": self.error
+        }
+
+    async def stream_events(self) -> AsyncIterator[str]:
+        """
+        Yield every event of the job as Server-Sent Events, starting from the first.
+
+        The stream ends after the 'completed' or 'failed' event.
+        """
+        index = 0
+        while True:
+            waiter = self._changed
+            while index < len(self.events):
+                event, data = self.events[index]
+                index += 1
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            if self.finished:
+                return
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+
+
+class SharedClassificationJob:
+    """A job run by another API process, read from the shared store."""
+
+    def __init__(self, store: RedisJobStore, snapshot: Dict[str, Any]):
+        self._store = store
+        self._snapshot = snapshot
+        self.id = snapshot["job_id"]
+        self.user_id = snapshot.get("user_id")
+        self.status = snapshot["status"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: value for name, value in self._snapshot.items() if name != "user_id"}
+
+    async def stream_events(self) -> AsyncIterator[str]:
+        """
+        Yield every event of the job as Server-Sent Events, starting from the first.
+
+        The stream ends after the 'completed' or 'failed' event, or when the job expires.
+        """
+        index = 0
+        quiet = 0.0
+        while True:
+            events = await anyio.to_thread.run_sync(self._store.events, self.id, index)
+            for event, data in events:
+                index += 1
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                if event in TERMINAL_EVENTS:
+                    return
+            if events:
+                quiet = 0.0
+                continue
+            if await anyio.to_thread.run_sync(self._store.load, self.id) is None:
+                return
+            await asyncio.sleep(POLL_SECONDS)
+            quiet += POLL_SECONDS
+            if quiet >= KEEPALIVE_SECONDS:
+                quiet = 0.0
+                yield ": keep-alive\n\n"
+
+
+class ClassificationJobManager:
+    def __init__(self, ttl_seconds: int, max_jobs: int, redis_url: Optional[str] = None):
+        """
+        Initialize the job store.
+
+        Args:
+            ttl_seconds: How long finished jobs stay retrievable
+            max_jobs: Most jobs this process keeps at once; the oldest finished jobs are dropped first
+            redis_url: Redis connection URL for sharing jobs between processes; in memory only when empty
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, ClassificationJob]" = OrderedDict()
+        self._tasks = set()
+        self.store: Optional[RedisJobStore] = None
+        if redis_url:
+            try:
+                self.store = RedisJobStore(redis_url, ttl_seconds)
+                logger.info("Classification jobs are shared through Redis")
+            except ImportError:
+                logger.warning("redis package not available, classification jobs are only known to the process running them")
+
+    def create_job(self, genres: List[str], filename: str, user_id: Optional[str],
+                   segment_duration: int) -> ClassificationJob:
+        """
+        Create and register a queued job.
+
+        Raises:
+            RuntimeError: If max_jobs jobs are still running
+        """
+        self._prune()
+        if len(self._jobs) >= self.max_jobs:
+            raise RuntimeError("Too many classification jobs in progress")
+        job = ClassificationJob(genres, filename, user_id, segment_duration, self.store)
+        self._jobs[job.id] = job
+        return job
+
+    def get_job(self, job_id: str) -> Optional[ClassificationJob]:
+        """A job this process runs, or None."""
+        self._prune()
+        return self._jobs.get(job_id)
+
+    async def find_job(self, job_id: str):
+        """
+        A job run by any API process.
+
+        Returns:
+            The ClassificationJob if this process runs it, a SharedClassificationJob
+            read from the shared store if another one does, or None
+        """
+        job = self.get_job(job_id)
+        if job is not None or self.store is None:
+            return job
+        snapshot = await anyio.to_thread.run_sync(self.store.load, job_id)
+        return SharedClassificationJob(self.store, snapshot) if snapshot is not None else None
+
+    def start(self, coro) -> asyncio.Task:
+        """Run a job coroutine in the background, keeping a reference until it is done."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _prune(self):
+        """Drop expired jobs, then the oldest finished ones while over max_jobs."""
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished_at > self.ttl_seconds]:
+            del self._jobs[job_id]
+
+        if len(self._jobs) >= self.max_jobs:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.finished]:
+                del self._jobs[job_id]
+                if len(self._jobs) < self.max_jobs:
+                    break
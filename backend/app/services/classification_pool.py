@@ -0,0 +1,280 @@
+"""
+Classification Process Pool
+Runs CPU-bound classification in worker processes that each hold a preloaded model.
+
+Decoding, spectrogram rendering and TensorFlow inference all hold the GIL for
+long stretches, so running them on the API process stalls every other endpoint.
+ClassificationPool starts a fixed number of spawned worker processes, loads a
+MusicGenreClassifier in each one at startup and exposes an awaitable run() that
+calls a classifier method in whichever worker is free.
+"""
+import os
+import asyncio
+import logging
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .metrics import REGISTRY
+from .request_profiler import current_profiler, sample_call
+
+logger = logging.getLogger(__name__)
+
+# Classifier owned by the current worker process
+_worker_classifier = None
+
+
+class _WorkerError(Exception):
+    """Carries a failed call's exception and metrics back to the parent process."""
+
+    def __init__(self, error: Exception, metrics: Dict):
+        super().__init__(error, metrics)
+        self.error = error
+        self.metrics = metrics
+
+
+async def _submit(executor: ProcessPoolExecutor, call: Callable[[], Any]) -> Any:
+    """
+    Run a worker call, merge the metrics it recorded and return its result or raise its exception.
+
+    When the current request is being profiled, the worker samples its own stacks
+    and they are added to the request's profile.
+    """
+    profiler = current_profiler.get()
+    if profiler is not None:
+        call = partial(sample_call, call, profiler.interval)
+    try:
+        value = await asyncio.get_running_loop().run_in_executor(executor, call)
+    except _WorkerError as e:
+        REGISTRY.merge_delta(e.metrics)
+        raise e.error from e.__cause__
+    if profiler is not None:
+        value, samples = value
+        profiler.merge(samples)
+    result, metrics = value
+    REGISTRY.merge_delta(metrics)
+    return result
+
+
+def _init_worker(model_path: str, encoder_path: str, intra_op_threads: int, inter_op_threads: int,
+                 warmup_batch_sizes: tuple = ()):
+    """Configure inference threading, load the model and warm it up once per worker process."""
+    global _worker_classifier
+
+    from .inference_backends import KerasBackend, backend_class
+
+    if issubclass(backend_class(model_path), KerasBackend):
+        import tensorflow as tf
+
+        # Must happen before TensorFlow runs its first op in this process
+        if intra_op_threads > 0:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads > 0:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+    from .music_classifier import MusicGenreClassifier
+
+    # TFLite and ONNX Runtime take their thread count per model instead
+    _worker_classifier = MusicGenreClassifier(model_path, encoder_path, num_threads=intra_op_threads)
+    if warmup_batch_sizes:
+        _worker_classifier.warm_up(warmup_batch_sizes)
+    logger.info(f"Classification worker {os.getpid()} ready")
+
+
+def _call_classifier(method_name: str, args: tuple, kwargs: Dict[str, Any]) -> Tuple[Any, Dict]:
+    """Call a method on this worker's classifier; returns the result and the metrics it recorded."""
+    try:
+        return getattr(_worker_classifier, method_name)(*args, **kwargs), REGISTRY.collect_delta()
+    except Exception as e:
+        raise _WorkerError(e, REGISTRY.collect_delta()) from e
+
+
+def _call_classifier_with_progress(method_name: str, args: tuple, kwargs: Dict[str, Any],
+                                   progress_queue, token: int) -> Any:
+    """Call a classifier method, forwarding each on_segment callback to the parent process."""
+    kwargs = dict(kwargs, on_segment=lambda segment: progress_queue.put((token, segment)))
+    return _call_classifier(method_name, args, kwargs)
+
+
+def _worker_ready(barrier) -> int:
+    """
+    Wait at the barrier until every worker has loaded its model.
+
+    A worker blocked here cannot take another call, so each of the pool's
+    startup calls is answered by a different worker.
+    """
+    barrier.wait()
+    return os.getpid()
+
+
+class ClassificationPool:
+    def __init__(self, model_path: str, encoder_path: str, workers: int,
+                 intra_op_threads: int = 0, inter_op_threads: int = 0, warmup_batch_sizes: tuple = ()):
+        """
+        Create the pool. Worker processes start when start() is awaited.
+
+        Args:
+            model_path: Path to the trained .h5 model or a fused export
+            encoder_path: Path to the label encoder pickle file
+            workers: Number of worker processes
+            intra_op_threads: Inference threads per worker (0 lets the runtime decide)
+            inter_op_threads: TensorFlow inter-op threads per worker (0 lets TensorFlow decide)
+            warmup_batch_sizes: Batch sizes each worker runs a dummy forward pass with before it is ready
+        """
+        self.workers = workers
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+        # TensorFlow is not fork-safe, so workers are spawned fresh
+        self._context = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=(model_path, encoder_path, intra_op_threads, inter_op_threads, tuple(warmup_batch_sizes))
+        )
+
+        # Startup barrier and progress messages from workers, created on first use
+        self._manager = None
+        self._progress_queue = None
+        self._progress_listener = None
+        self._progress_callbacks: Dict[int, tuple] = {}
+        self._progress_tokens = itertools.count()
+        self._progress_lock = threading.Lock()
+        self._dispatch_markers: Dict[int, threading.Event] = {}
+
+    async def start(self):
+        """Start every worker and wait until each one has loaded (and warmed up) its model."""
+        loop = asyncio.get_running_loop()
+        # Workers run their initializer before any call, so all of them are loaded once every call is at the barrier
+        barrier = self._ensure_manager().Barrier(self.workers)
+        pids = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, _worker_ready, barrier) for _ in range(self.workers)
+        ))
+        logger.info(f"Classification pool ready with workers {sorted(pids)}")
+
+    @property
+    def worker_pids(self) -> list:
+        """PIDs of the worker processes currently running."""
+        return sorted(self._executor._processes or {})
+
+    async def run(self, method_name: str, *args, **kwargs) -> Any:
+        """
+        Call a MusicGenreClassifier method in a worker process.
+
+        Arguments and the return value must be picklable.
+
+        Args:
+            method_name: Name of the classifier method, e.g. 'classify_full_track'
+            *args: Positional arguments for the method
+            **kwargs: Keyword arguments for the method
+
+        Returns:
+            The method's return value
+        """
+        return await _submit(self._executor, partial(_call_classifier, method_name, args, kwargs))
+
+    async def run_with_progress(self, on_segment: Callable[[Dict], None], method_name: str, *args, **kwargs) -> Any:
+        """
+        Like run(), for methods that accept on_segment.
+
+        Each segment the worker reports is passed to on_segment on the calling
+        event loop while the method is still running.
+
+        Args:
+            on_segment: Callback for each segment prediction
+            method_name: Name of the classifier method, e.g. 'classify_full_track'
+            *args: Positional arguments for the method
+            **kwargs: Keyword arguments for the method
+
+        Returns:
+            The method's return value
+        """
+        loop = asyncio.get_running_loop()
+        progress_queue = self._ensure_progress_listener()
+        token = next(self._progress_tokens)
+        self._progress_callbacks[token] = (loop, on_segment)
+        try:
+            return await _submit(self._executor, partial(
+                _call_classifier_with_progress, method_name, args, kwargs, progress_queue, token
+            ))
+        finally:
+            # The worker's messages are already queued when its result arrives;
+            # let the listener dispatch them before the callback is dropped
+            await loop.run_in_executor(None, self._wait_for_dispatch)
+            self._progress_callbacks.pop(token, None)
+
+    def _ensure_manager(self):
+        """Start the process that hosts the objects shared with the workers."""
+        with self._progress_lock:
+            if self._manager is None:
+                self._manager = self._context.Manager()
+            return self._manager
+
+    def _ensure_progress_listener(self):
+        """Start the shared progress queue and the thread that dispatches its messages."""
+        manager = self._ensure_manager()
+        with self._progress_lock:
+            if self._progress_queue is None:
+                self._progress_queue = manager.Queue()
+                self._progress_listener = threading.Thread(
+                    target=self._dispatch_progress, name="classification-progress", daemon=True
+                )
+                self._progress_listener.start()
+            return self._progress_queue
+
+    def _dispatch_progress(self):
+        """Forward progress messages to the callbacks registered for their token."""
+        while True:
+            try:
+                item = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            token, payload = item
+            if token == "dispatched":
+                self._dispatch_markers.pop(payload).set()
+                continue
+            registered = self._progress_callbacks.get(token)
+            if registered is not None:
+                loop, callback = registered
+                loop.call_soon_threadsafe(callback, payload)
+
+    def _wait_for_dispatch(self):
+        """Block until every message queued before this call has been dispatched."""
+        marker = next(self._progress_tokens)
+        dispatched = threading.Event()
+        self._dispatch_markers[marker] = dispatched
+        self._progress_queue.put(("dispatched", marker))
+        dispatched.wait(timeout=5)
+
+    def shutdown(self, wait: bool = True):
+        """Cancel queued work and stop the worker processes."""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        if self._manager is not None:
+            if self._progress_queue is not None:
+                self._progress_queue.put(None)
+            self._manager.shutdown()
+            self._manager = None
+            self._progress_queue = None
+        logger.info("Classification pool shut down")
+
+
+def default_intra_op_threads(workers: int, configured: Optional[int] = None) -> int:
+    """
+    Split the machine's cores between pool workers unless configured explicitly.
+
+    Args:
+        workers: Number of worker processes
+        configured: Explicit thread count, if any
+
+    Returns:
+        Intra-op thread count for each worker
+    """
+    if configured:
+        return configured
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
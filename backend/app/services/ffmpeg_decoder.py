@@ -0,0 +1,257 @@
+"""
+FFmpeg Decoder
+Decodes audio with FFmpeg straight into a NumPy array.
+
+FFmpeg writes mono float32 PCM at the requested sample rate to stdout
+('-f f32le -ac 1 -ar 22050 pipe:1') and the output buffer is wrapped as an
+array without copying, so formats libsndfile cannot read (m4a, aac, webm, mp4)
+no longer go through a temporary WAV that is then decoded a second time. Input
+is a file path or the encoded bytes, which are fed through stdin. Segment
+requests seek with '-ss'/'-t' so only the requested range is decoded.
+decode_audio_blocks reads the same stream a block at a time, for tracks too
+long to hold in memory.
+
+FFmpeg downmixes stereo at a different gain than librosa's channel average.
+The spectrograms are in dB relative to their maximum, so a constant gain does
+not change what the model sees.
+"""
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import logging
+from functools import lru_cache
+from typing import Iterator, Optional, Union
+
+import numpy as np
+
+from ..config.music_config import SAMPLE_RATE, FFMPEG_PATH, FFMPEG_TIMEOUT_SECONDS
+from .metrics import FFMPEG_DURATION, FFMPEG_FAILURES
+
+logger = logging.getLogger(__name__)
+
+# 'Duration: 01:02:03.45' in FFmpeg's description of the input
+DURATION_PATTERN = re.compile(r"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+
+# Common Windows install locations, checked when FFmpeg is not on PATH
+WINDOWS_FFMPEG_PATHS = [
+    r"C:\ffmpeg\bin\ffmpeg.exe",
+    r"C:\Program Files\ffmpeg\bin\ffmpeg.exe",
+    r"C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe",
+    os.path.join(os.getcwd(), "ffmpeg", "bin", "ffmpeg.exe"),
+]
+
+
+class AudioDecodeError(Exception):
+    """Raised when FFmpeg is missing or cannot decode the input."""
+
+
+@lru_cache(maxsize=1)
+def find_ffmpeg() -> Optional[str]:
+    """
+    Locate the FFmpeg executable.
+
+    Checked in order: FFMPEG_PATH, the PATH, the binary bundled with
+    imageio-ffmpeg (installed with moviepy), and common Windows locations.
+
+    Returns:
+        Path to the executable, or None if FFmpeg is not available
+    """
+    if FFMPEG_PATH:
+        return FFMPEG_PATH if os.path.exists(FFMPEG_PATH) else None
+
+    path = shutil.which("ffmpeg")
+    if path:
+        return path
+
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        pass
+
+    for path in WINDOWS_FFMPEG_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def ffmpeg_available() -> bool:
+    """Whether decode_audio can be used."""
+    return find_ffmpeg() is not None
+
+
+def decode_audio(source: Union[str, bytes], sample_rate: int = SAMPLE_RATE, offset: float = 0.0,
+                 duration: Optional[float] = None, timeout: Optional[float] = FFMPEG_TIMEOUT_SECONDS) -> np.ndarray:
+    """
+    Decode audio to mono float32 samples with FFmpeg.
+
+    Args:
+        source: Path to an audio or video file, or its encoded bytes. MP4/M4A files with
+            the index at the end (no faststart) can only be decoded from a path
+        sample_rate: Output sample rate
+        offset: Start time in seconds
+        duration: Seconds to decode from offset (default: to the end)
+        timeout: Seconds before FFmpeg is killed
+
+    Returns:
+        Read-only float32 array of mono samples at sample_rate
+
+    Raises:
+        AudioDecodeError: If FFmpeg is not available or fails
+    """
+    ffmpeg_path = find_ffmpeg()
+    if not ffmpeg_path:
+        FFMPEG_FAILURES.labels(reason="not_found").inc()
+        raise AudioDecodeError("FFmpeg not found. Install FFmpeg or set FFMPEG_PATH to decode this format")
+
+    from_stdin = isinstance(source, (bytes, bytearray, memoryview))
+    cmd = [ffmpeg_path, '-hide_banner', '-loglevel', 'error']
+    # As input options, -ss seeks before decoding and -t stops after the segment
+    if offset:
+        cmd += ['-ss', f'{offset:.3f}']
+    if duration is not None:
+        cmd += ['-t', f'{duration:.3f}']
+    cmd += [
+        '-i', 'pipe:0' if from_stdin else source,
+        '-vn',  # ignore video streams in mp4/webm
+        '-f', 'f32le',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        'pipe:1'
+    ]
+
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(
+            cmd,
+            input=bytes(source) if from_stdin else None,
+            stdin=None if from_stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        FFMPEG_DURATION.labels(outcome="timeout").observe(time.perf_counter() - start)
+        FFMPEG_FAILURES.labels(reason="timeout").inc()
+        raise AudioDecodeError(f"FFmpeg decoding timed out after {timeout} seconds")
+    except OSError as e:
+        FFMPEG_FAILURES.labels(reason="exec").inc()
+        raise AudioDecodeError(f"Could not run FFmpeg: {str(e)}")
+
+    FFMPEG_DURATION.labels(outcome="ok" if result.returncode == 0 else "error").observe(time.perf_counter() - start)
+    if result.returncode != 0:
+        FFMPEG_FAILURES.labels(reason="error").inc()
+        stderr = result.stderr.decode(errors='replace').strip()
+        raise AudioDecodeError(f"FFmpeg could not decode the audio: {stderr or f'exit code {result.returncode}'}")
+
+    # Whole float32 samples only; a killed or truncated stream can end mid-sample
+    usable = len(result.stdout) - len(result.stdout) % 4
+    return np.frombuffer(result.stdout, dtype='<f4', count=usable // 4)
+
+
+def decode_audio_blocks(path: str, block_samples: int, sample_rate: int = SAMPLE_RATE) -> Iterator[np.ndarray]:
+    """
+    Decode an audio file to mono float32 samples with FFmpeg, one block at a time.
+
+    FFmpeg is paced by the consumer: it blocks on the pipe until the next
+    block is read, so at most one block plus the pipe buffer is in memory.
+    FFMPEG_TIMEOUT_SECONDS does not apply, as the decode takes as long as
+    the consumer. Closing the generator early stops FFmpeg. Its stderr goes
+    to a temporary file rather than a pipe, which nothing would read until
+    stdout ends and which FFmpeg could fill while logging many errors.
+
+    Args:
+        path: Path to an audio or video file
+        block_samples: Samples per block; the last block may be shorter
+        sample_rate: Output sample rate
+
+    Yields:
+        float32 arrays of mono samples at sample_rate
+
+    Raises:
+        AudioDecodeError: If FFmpeg is not available or fails
+    """
+    ffmpeg_path = find_ffmpeg()
+    if not ffmpeg_path:
+        FFMPEG_FAILURES.labels(reason="not_found").inc()
+        raise AudioDecodeError("FFmpeg not found. Install FFmpeg or set FFMPEG_PATH to decode this format")
+
+    cmd = [
+        ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+        '-i', path,
+        '-vn',
+        '-f', 'f32le',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        'pipe:1'
+    ]
+
+    start = time.perf_counter()
+    stderr_file = tempfile.TemporaryFile()
+    try:
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr_file)
+    except OSError as e:
+        stderr_file.close()
+        FFMPEG_FAILURES.labels(reason="exec").inc()
+        raise AudioDecodeError(f"Could not run FFmpeg: {str(e)}")
+
+    finished = False
+    try:
+        block_bytes = block_samples * 4
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            # Whole float32 samples only; a killed or truncated stream can end mid-sample
+            usable = len(data) - len(data) % 4
+            if usable:
+                yield np.frombuffer(data, dtype='<f4', count=usable // 4)
+
+        returncode = process.wait()
+        finished = True
+        FFMPEG_DURATION.labels(outcome="ok" if returncode == 0 else "error").observe(time.perf_counter() - start)
+        if returncode != 0:
+            FFMPEG_FAILURES.labels(reason="error").inc()
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode(errors='replace').strip()
+            raise AudioDecodeError(f"FFmpeg could not decode the audio: {stderr or f'exit code {returncode}'}")
+    finally:
+        if not finished:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        stderr_file.close()
+
+
+def probe_duration(path: str) -> Optional[float]:
+    """
+    Read the duration of a media file from its header, without decoding it.
+
+    Args:
+        path: Path to an audio or video file
+
+    Returns:
+        Duration in seconds, or None if FFmpeg is not available or reports no duration
+    """
+    ffmpeg_path = find_ffmpeg()
+    if not ffmpeg_path:
+        return None
+    try:
+        # Without an output FFmpeg only describes the input (and exits with an error)
+        result = subprocess.run(
+            [ffmpeg_path, '-hide_banner', '-i', path],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            timeout=FFMPEG_TIMEOUT_SECONDS
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Could not probe the duration of {path}: {str(e)}")
+        return None
+
+    match = DURATION_PATTERN.search(result.stderr.decode(errors='replace'))
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
@@ -0,0 +1,331 @@
+"""
+Inference Backends
+Interchangeable runtimes for the EfficientNetB0 extractor and the genre head.
+
+Every backend maps a batch of (224, 224, 3) spectrogram images to genre
+probabilities and embeddings, and maps cached embeddings back to probabilities,
+so MusicGenreClassifier does not care which runtime is underneath:
+
+- KerasBackend: the .h5 head plus EfficientNetB0 built with ImageNet weights
+- BundleBackend: the same Keras models, loaded from a model bundle directory
+  (see model_bundle) without HDF5 parsing or downloading ImageNet weights
+- TFLiteBackend: a fused .tflite export with 'classify' and 'head' signatures
+- ONNXBackend: a fused .onnx export plus its '_head.onnx' companion, run with
+  ONNX Runtime, which needs neither TensorFlow nor Keras
+
+The backend is picked from the model file extension, or BundleBackend for a
+bundle directory. Fused exports are written by app.tools.export_fused_model
+together with a JSON manifest, bundles by app.tools.build_model_bundle.
+
+With SHARED_MODEL_WEIGHTS the fused backends compute straight from the
+memory-mapped model file (or ONNX external weights file) instead of packing
+their own copy of the weights, so every process serving the same model shares
+one read-only copy through the page cache. Packed weights are faster, so this
+trades some latency for memory when many workers run on one node. The Keras
+and bundle backends always copy the weights into TensorFlow variables, so
+create_backend warns when the setting is on for them.
+"""
+import json
+import os
+import threading
+import logging
+from typing import Dict, Optional, Tuple, Type
+
+import numpy as np
+
+from ..config.music_config import IMAGE_SIZE, MODEL_BUNDLE_VERIFY, SHARED_MODEL_WEIGHTS
+from .metrics import CLASSIFIER_STAGE_DURATION
+from .model_bundle import (
+    HEAD_ARCHITECTURE_NAME, assign_weights, is_bundle, map_weights, read_bundle_manifest, verify_bundle
+)
+
+logger = logging.getLogger(__name__)
+
+CLASSIFY_SIGNATURE = "classify"
+HEAD_SIGNATURE = "head"
+
+
+def manifest_path(model_path: str) -> str:
+    """Path of the JSON manifest written next to a fused export."""
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def onnx_head_path(model_path: str) -> str:
+    """Path of the head-only model that accompanies a fused ONNX export."""
+    return os.path.splitext(model_path)[0] + "_head.onnx"
+
+
+def onnx_weights_path(model_path: str) -> str:
+    """Path of the external weights file of an ONNX model exported with external weights."""
+    return model_path + ".data"
+
+
+def load_manifest(model_path: str) -> Dict:
+    """Read the manifest of a fused export, or an empty dict if there is none."""
+    path = manifest_path(model_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class InferenceBackend:
+    """Interface shared by all backends."""
+
+    name = "base"
+    supports_shared_weights = False  # honours SHARED_MODEL_WEIGHTS
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        """
+        Args:
+            model_path: Model file to load
+            num_threads: Threads for runtimes that take a per-model setting (default: runtime decides)
+        """
+        self.model_path = model_path
+        self.num_threads = num_threads or None
+        self.manifest = load_manifest(model_path)
+        self.quantization = self.manifest.get("quantization", "none")
+
+    @property
+    def version_tag(self) -> str:
+        """Suffix for the extractor version; embeddings from different runtimes must not share cache entries."""
+        return self.version_tag_for(self.manifest)
+
+    @classmethod
+    def version_tag_for(cls, manifest: Dict) -> str:
+        """The version_tag of a model with this manifest, without loading the model."""
+        return f"+{cls.name}-{manifest.get('quantization', 'none')}"
+
+    def predict(self, images: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Run the extractor and head on a batch of spectrogram images.
+
+        Args:
+            images: float32 array of shape (N, 224, 224, 3) from _spectrogram_image
+
+        Returns:
+            Tuple of genre probabilities (N, num_genres) and embeddings (N, 7, 7, 1280)
+        """
+        raise NotImplementedError
+
+    def predict_head(self, features: np.ndarray) -> np.ndarray:
+        """
+        Run only the genre head on precomputed embeddings.
+
+        Args:
+            features: Embeddings as returned by predict()
+
+        Returns:
+            Genre probabilities of shape (N, num_genres)
+        """
+        raise NotImplementedError
+
+
+class KerasBackend(InferenceBackend):
+    name = "keras"
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        super().__init__(model_path, num_threads)
+        # TensorFlow threading is process-wide and configured before the first op, see classification_pool
+        from tensorflow.keras.models import load_model
+        from tensorflow.keras.applications import EfficientNetB0
+
+        # Load the trained model (classifier only)
+        self.model = load_model(model_path)
+        logger.info(f"Model loaded successfully from {model_path}")
+
+        # Load EfficientNetB0 feature extractor (frozen)
+        self.feature_extractor = EfficientNetB0(
+            weights='imagenet', include_top=False, input_shape=(IMAGE_SIZE[0], IMAGE_SIZE[1], 3)
+        )
+        self.feature_extractor.trainable = False
+        logger.info("EfficientNetB0 feature extractor loaded successfully")
+
+    @classmethod
+    def version_tag_for(cls, manifest: Dict) -> str:
+        return ""  # The reference embeddings
+
+    def predict(self, images: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        from tensorflow.keras.applications.efficientnet import preprocess_input
+
+        with CLASSIFIER_STAGE_DURATION.labels(stage="extractor").time():
+            batch = preprocess_input(images)
+            features = self.feature_extractor.predict(batch, batch_size=len(batch), verbose=0)
+        return self.predict_head(features), features
+
+    def predict_head(self, features: np.ndarray) -> np.ndarray:
+        with CLASSIFIER_STAGE_DURATION.labels(stage="head").time():
+            return self.model.predict(features, batch_size=len(features), verbose=0)
+
+
+class BundleBackend(KerasBackend):
+    name = "bundle"
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None, verify: bool = MODEL_BUNDLE_VERIFY):
+        """
+        Args:
+            model_path: Bundle directory
+            num_threads: Unused, TensorFlow threading is process-wide
+            verify: Check the bundle files against the manifest hashes first
+        """
+        # Skip KerasBackend.__init__, there is no .h5 to load and nothing to download
+        InferenceBackend.__init__(self, model_path, num_threads)
+        import keras
+        from tensorflow.keras.applications import EfficientNetB0
+
+        self.manifest = read_bundle_manifest(model_path)
+        if verify:
+            verify_bundle(model_path, self.manifest)
+        weights = map_weights(model_path, self.manifest)
+
+        self.feature_extractor = EfficientNetB0(
+            weights=None, include_top=False, input_shape=(IMAGE_SIZE[0], IMAGE_SIZE[1], 3)
+        )
+        assign_weights(self.feature_extractor, weights["extractor"], self.manifest["weights"]["extractor"])
+        self.feature_extractor.trainable = False
+
+        with open(os.path.join(model_path, HEAD_ARCHITECTURE_NAME)) as f:
+            self.model = keras.models.model_from_json(f.read())
+        assign_weights(self.model, weights["head"], self.manifest["weights"]["head"])
+        logger.info(f"Model bundle loaded from {model_path} (model version {self.manifest['model_version']})")
+
+
+class TFLiteBackend(InferenceBackend):
+    name = "tflite"
+    supports_shared_weights = True
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None, shared_weights: bool = SHARED_MODEL_WEIGHTS):
+        """
+        Args:
+            model_path: Fused .tflite export
+            num_threads: Interpreter threads (default: runtime decides)
+            shared_weights: Run the builtin kernels on the mapped flatbuffer instead of XNNPACK's packed copy
+        """
+        super().__init__(model_path, num_threads)
+        # Prefer the standalone LiteRT runtime, fall back to the one bundled with TensorFlow
+        try:
+            from ai_edge_litert.interpreter import Interpreter, OpResolverType
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+            OpResolverType = tf.lite.experimental.OpResolverType
+
+        # XNNPACK is applied by the runtime on CPU unless the default delegates are left out
+        resolver = OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES if shared_weights else OpResolverType.AUTO
+        self._interpreter = Interpreter(
+            model_path=model_path, num_threads=self.num_threads, experimental_op_resolver_type=resolver
+        )
+        self._classify = self._interpreter.get_signature_runner(CLASSIFY_SIGNATURE)
+        self._head = self._interpreter.get_signature_runner(HEAD_SIGNATURE)
+
+        # An interpreter must not run two invocations at once
+        self._lock = threading.Lock()
+        logger.info(
+            f"TFLite model loaded from {model_path} (quantization: {self.quantization}, shared weights: {shared_weights})"
+        )
+
+    def predict(self, images: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        images = np.ascontiguousarray(images, dtype=np.float32)
+        # Extractor and head run as one graph
+        with self._lock, CLASSIFIER_STAGE_DURATION.labels(stage="extractor").time():
+            outputs = self._classify(images=images)
+        return outputs["probabilities"], outputs["features"]
+
+    def predict_head(self, features: np.ndarray) -> np.ndarray:
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        with self._lock, CLASSIFIER_STAGE_DURATION.labels(stage="head").time():
+            outputs = self._head(features=features)
+        return outputs["probabilities"]
+
+
+class ONNXBackend(InferenceBackend):
+    name = "onnx"
+    supports_shared_weights = True
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None, shared_weights: bool = SHARED_MODEL_WEIGHTS):
+        """
+        Args:
+            model_path: Fused .onnx export
+            num_threads: Intra-op threads per session (default: runtime decides)
+            shared_weights: Compute on the memory-mapped external weights instead of prepacked copies
+        """
+        super().__init__(model_path, num_threads)
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+            options.inter_op_num_threads = 1
+        providers = ["CPUExecutionProvider"]
+
+        if shared_weights:
+            # ONNX Runtime maps external weights files; prepacking would copy them into each process
+            options.add_session_config_entry("session.disable_prepacking", "1")
+            if not os.path.exists(onnx_weights_path(model_path)):
+                logger.warning(
+                    f"{model_path} embeds its weights, so every process keeps its own copy; "
+                    "export it with --external-weights to share them"
+                )
+
+        # Sessions are safe to run from several threads at once
+        self._classify = ort.InferenceSession(model_path, options, providers=providers)
+        self._head = ort.InferenceSession(onnx_head_path(model_path), options, providers=providers)
+        logger.info(
+            f"ONNX model loaded from {model_path} (quantization: {self.quantization}, shared weights: {shared_weights})"
+        )
+
+    def predict(self, images: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        images = np.ascontiguousarray(images, dtype=np.float32)
+        # Extractor and head run as one graph
+        with CLASSIFIER_STAGE_DURATION.labels(stage="extractor").time():
+            probabilities, features = self._classify.run(["probabilities", "features"], {"images": images})
+        return probabilities, features
+
+    def predict_head(self, features: np.ndarray) -> np.ndarray:
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        with CLASSIFIER_STAGE_DURATION.labels(stage="head").time():
+            return self._head.run(["probabilities"], {"features": features})[0]
+
+
+BACKENDS: Dict[str, Type[InferenceBackend]] = {
+    ".h5": KerasBackend,
+    ".keras": KerasBackend,
+    ".tflite": TFLiteBackend,
+    ".onnx": ONNXBackend,
+}
+
+
+def backend_class(model_path: str) -> Type[InferenceBackend]:
+    """
+    Get the backend for a model file from its extension, or for a bundle directory.
+
+    Raises:
+        ValueError: If no backend handles the extension
+    """
+    if is_bundle(model_path):
+        return BundleBackend
+    suffix = os.path.splitext(model_path)[1].lower()
+    if suffix not in BACKENDS:
+        raise ValueError(f"No inference backend for '{suffix}' files. Supported: {sorted(BACKENDS)}")
+    return BACKENDS[suffix]
+
+
+def create_backend(model_path: str, num_threads: Optional[int] = None) -> InferenceBackend:
+    """
+    Load a model file with the backend matching its extension.
+
+    Args:
+        model_path: .h5/.keras head, or a fused .tflite/.onnx export
+        num_threads: Threads for TFLite and ONNX Runtime (default: runtime decides)
+
+    Returns:
+        Loaded backend
+    """
+    cls = backend_class(model_path)
+    if SHARED_MODEL_WEIGHTS and not cls.supports_shared_weights:
+        logger.warning(
+            f"SHARED_MODEL_WEIGHTS has no effect on the {cls.name} backend, which copies the weights into every "
+            f"process; use a fused .tflite or .onnx model to share them"
+        )
+    return cls(model_path, num_threads)
@@ -0,0 +1,261 @@
+"""
+Inference Scheduler
+Dynamic micro-batching of segment images across concurrent classification requests.
+
+Requests hand their segment images to a shared InferenceScheduler instead of
+calling the model themselves. A single worker thread waits a few milliseconds
+for other requests to arrive, runs them through the model as one batch and
+resolves each caller's future with its own slice of the output. A request
+with more images than max_batch_size runs alone, in max_batch_size slices.
+
+predict_fn may return either a probability array or a (probabilities, features)
+tuple; every array in a tuple is split per request the same way.
+"""
+import threading
+import time
+import queue
+import logging
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingRequest:
+    """Segment images waiting for inference, plus the future to resolve."""
+
+    __slots__ = ("images", "future", "enqueued_at")
+
+    def __init__(self, images: np.ndarray):
+        self.images = images
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+_STOP = object()
+
+
+class InferenceScheduler:
+    def __init__(self, predict_fn: Callable[[np.ndarray], np.ndarray],
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        """
+        Initialize the scheduler and start its worker thread.
+
+        Args:
+            predict_fn: Function mapping an (N, 224, 224, 3) image batch to (N, num_genres)
+                probabilities, or to a (probabilities, features) tuple
+            max_batch_size: Most images to run in a single forward pass
+            max_wait_ms: Longest time to hold a batch open waiting for more requests
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._carry: Optional[_PendingRequest] = None
+        self._closed = False
+        # Makes the closed check and the enqueue atomic with close(), so nothing is queued behind _STOP
+        self._submit_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._images = 0
+        self._max_batch = 0
+        self._batch_size_counts: Dict[int, int] = {}
+        self._total_wait = 0.0
+        self._total_inference = 0.0
+
+        self._worker = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._worker.start()
+
+    @property
+    def worker_ident(self) -> Optional[int]:
+        """Thread identifier of the worker thread that runs the model."""
+        return self._worker.ident
+
+    def submit(self, images: np.ndarray) -> Future:
+        """
+        Queue segment images for batched inference.
+
+        Args:
+            images: float32 array of shape (N, 224, 224, 3)
+
+        Returns:
+            Future resolving to this request's slice of the predict_fn output
+        """
+        request = _PendingRequest(np.ascontiguousarray(images))
+        if len(request.images) == 0:
+            raise ValueError("No images to run inference on")
+
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("Inference scheduler is closed")
+            self._queue.put(request)
+        return request.future
+
+    def predict(self, images: np.ndarray, max_batch_size: Optional[int] = None,
+                return_features: bool = False):
+        """
+        Blocking drop-in for MusicGenreClassifier.predict_images.
+
+        Args:
+            images: float32 array of shape (N, 224, 224, 3)
+            max_batch_size: Ignored; batching is controlled by the scheduler
+            return_features: Return a (probabilities, features) tuple; predict_fn must produce features
+
+        Returns:
+            Genre probabilities of shape (N, num_genres), or a (probabilities, features) tuple
+        """
+        output = self.submit(images).result()
+        if return_features:
+            if not isinstance(output, tuple):
+                raise RuntimeError("Scheduler predict_fn does not return features")
+            return output
+        return output[0] if isinstance(output, tuple) else output
+
+    def get_stats(self) -> Dict:
+        """Get queue depth and batching statistics."""
+        with self._stats_lock:
+            batches = self._batches
+            return {
+                "queue_depth": self._queue.qsize() + (1 if self._carry is not None else 0),
+                "batches": batches,
+                "requests": self._requests,
+                "images": self._images,
+                "average_batch_size": self._images / batches if batches else 0.0,
+                "max_batch_size_seen": self._max_batch,
+                "batch_size_histogram": dict(sorted(self._batch_size_counts.items())),
+                "average_queue_wait_ms": 1000 * self._total_wait / self._requests if self._requests else 0.0,
+                "average_inference_ms": 1000 * self._total_inference / batches if batches else 0.0,
+                "config": {
+                    "max_batch_size": self.max_batch_size,
+                    "max_wait_ms": self.max_wait * 1000,
+                }
+            }
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Stop accepting work, finish queued requests and stop the worker thread.
+
+        Args:
+            timeout: Seconds to wait for the worker to finish
+        """
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._worker.join(timeout)
+
+    def _collect_batch(self) -> Optional[List[_PendingRequest]]:
+        """
+        Block for the first request, then gather more until the batch is full or the wait expires.
+
+        Returns:
+            Requests for the next batch, or None once the scheduler is stopping
+        """
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        else:
+            first = self._queue.get()
+            if first is _STOP:
+                return None
+
+        batch = [first]
+        size = len(first.images)
+        deadline = time.perf_counter() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is _STOP:
+                # Run what we have, then stop on the next pass
+                self._queue.put(_STOP)
+                break
+            if size + len(request.images) > self.max_batch_size:
+                # Does not fit, it leads the next batch instead
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request.images)
+
+        return batch
+
+    def _run(self):
+        """Worker loop: collect a batch, run it, resolve the futures."""
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                self._fail_pending()
+                return
+
+            started = time.perf_counter()
+            try:
+                images = batch[0].images if len(batch) == 1 else np.concatenate([r.images for r in batch])
+                output, passes = self._predict(images)
+            except Exception as e:
+                logger.error(f"Batched inference failed for {len(batch)} requests: {str(e)}")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            offset = 0
+            for request in batch:
+                count = len(request.images)
+                if isinstance(output, tuple):
+                    request.future.set_result(tuple(part[offset:offset + count] for part in output))
+                else:
+                    request.future.set_result(output[offset:offset + count])
+                offset += count
+
+            self._record_batch(batch, passes, started, finished)
+
+    def _predict(self, images: np.ndarray):
+        """
+        Run predict_fn on at most max_batch_size images at a time.
+
+        Returns:
+            Tuple of the predict_fn output for all images and the size of each forward pass
+        """
+        if len(images) <= self.max_batch_size:
+            return self.predict_fn(images), [len(images)]
+        # Only a single request can be this large; it is split and its outputs joined again
+        slices = [images[start:start + self.max_batch_size] for start in range(0, len(images), self.max_batch_size)]
+        outputs = [self.predict_fn(part) for part in slices]
+        passes = [len(part) for part in slices]
+        if isinstance(outputs[0], tuple):
+            return tuple(np.concatenate(parts) for parts in zip(*outputs)), passes
+        return np.concatenate(outputs), passes
+
+    def _fail_pending(self):
+        """Fail whatever is still queued when the worker stops, so no caller waits forever."""
+        pending = [self._carry] if self._carry is not None else []
+        self._carry = None
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not _STOP:
+                pending.append(request)
+        for request in pending:
+            request.future.set_exception(RuntimeError("Inference scheduler is closed"))
+
+    def _record_batch(self, batch: List[_PendingRequest], passes: List[int], started: float, finished: float):
+        """Update batching statistics for a completed batch, run in forward passes of the given sizes."""
+        with self._stats_lock:
+            self._batches += len(passes)
+            self._requests += len(batch)
+            self._images += sum(passes)
+            for size in passes:
+                self._max_batch = max(self._max_batch, size)
+                self._batch_size_counts[size] = self._batch_size_counts.get(size, 0) + 1
+            self._total_wait += sum(started - r.enqueued_at for r in batch)
+            self._total_inference += finished - started
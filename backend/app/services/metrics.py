@@ -0,0 +1,481 @@
+"""
+Metrics
+In-process counters, gauges and histograms exposed in the Prometheus text format.
+
+Metrics are registered in a module-level registry and rendered by the
+/metrics endpoint, so any Prometheus-compatible scraper can collect them
+without a client library. Histograms use fixed buckets; quantiles such as p99
+are computed by the scraper with histogram_quantile().
+
+Classification worker processes have registries of their own. After every
+call the worker sends back what it recorded since the previous call
+(collect_delta) and the parent adds it to its registry (merge_delta), so stage
+timings look the same with and without a process pool.
+
+uvicorn workers (--workers N) share one port, so each scrape reaches one of
+them. With share(), every API process writes its values to a shared
+directory every few seconds and the process that answers the scrape renders
+all of them: counters and histograms summed over the processes, including
+ones that have exited, and gauges per live process with a 'pid' label.
+"""
+import json
+import logging
+import math
+import os
+import threading
+from bisect import bisect_left
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers fast API routes as well as full-track classifications
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Shared label handling; values are kept per tuple of label values."""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["MetricsRegistry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def labels(self, **labels: str) -> "_Child":
+        """The metric for one combination of label values."""
+        return _Child(self, self._key(labels))
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def _snapshot(self) -> Dict[Tuple[str, ...], object]:
+        """A copy of the current values."""
+        with self._lock:
+            return dict(self._values)
+
+    def _render(self, values: Dict[Tuple[str, ...], object], labelnames: Optional[Sequence[str]] = None) -> List[str]:
+        """Text lines for the values of a snapshot."""
+        labelnames = self.labelnames if labelnames is None else labelnames
+        lines = self._header()
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return lines
+
+    def collect(self) -> List[str]:
+        return self._render(self._snapshot())
+
+
+class _Child:
+    """A labelled metric, as returned by labels()."""
+
+    __slots__ = ("_metric", "_key")
+
+    def __init__(self, metric: _Metric, key: Tuple[str, ...]):
+        self._metric = metric
+        self._key = key
+
+    def inc(self, amount: float = 1.0):
+        self._metric._inc(self._key, amount)
+
+    def dec(self, amount: float = 1.0):
+        self._metric._inc(self._key, -amount)
+
+    def set(self, value: float):
+        self._metric._set(self._key, value)
+
+    def observe(self, value: float):
+        self._metric._observe(self._key, value)
+
+    def time(self):
+        return self._metric._time(self._key)
+
+    def track_inprogress(self):
+        return self._metric._track_inprogress(self._key)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. requests served."""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0):
+        self._inc((), amount)
+
+    def _inc(self, key: Tuple[str, ...], amount: float):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect_delta(self) -> Dict:
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge_delta(self, delta: Dict):
+        for key, amount in delta.items():
+            self._inc(key, amount)
+
+    @staticmethod
+    def _combine(value: Optional[float], other: float) -> float:
+        return other if value is None else value + other
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. classifications in flight."""
+
+    type_name = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0):
+        self._inc((), amount)
+
+    def dec(self, amount: float = 1.0):
+        self._inc((), -amount)
+
+    def set(self, value: float):
+        self._set((), value)
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from function at collection time instead of storing it."""
+        self._function = function
+
+    def track_inprogress(self):
+        return self._track_inprogress(())
+
+    def _inc(self, key: Tuple[str, ...], amount: float):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _set(self, key: Tuple[str, ...], value: float):
+        with self._lock:
+            self._values[key] = float(value)
+
+    @contextmanager
+    def _track_inprogress(self, key: Tuple[str, ...]) -> Iterator[None]:
+        self._inc(key, 1)
+        try:
+            yield
+        finally:
+            self._inc(key, -1)
+
+    def _snapshot(self) -> Dict[Tuple[str, ...], object]:
+        values = super()._snapshot()
+        if self._function is not None:
+            try:
+                values[()] = float(self._function())
+            except Exception:
+                values = {}
+        return values
+
+
+class Histogram(_Metric):
+    """Distribution of observations in fixed buckets, e.g. latencies in seconds."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["MetricsRegistry"] = None, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float):
+        self._observe((), value)
+
+    def time(self):
+        return self._time(())
+
+    def _observe(self, key: Tuple[str, ...], value: float):
+        # First bucket the value fits in; buckets are cumulated on collection
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def _time(self, key: Tuple[str, ...]) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe(key, time.perf_counter() - start)
+
+    def _snapshot(self) -> Dict[Tuple[str, ...], object]:
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+    def _render(self, values: Dict[Tuple[str, ...], object], labelnames: Optional[Sequence[str]] = None) -> List[str]:
+        labelnames = self.labelnames if labelnames is None else labelnames
+        lines = self._header()
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(labelnames, key, le)} {cumulative}")
+            labels = _format_labels(labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def collect_delta(self) -> Dict:
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge_delta(self, delta: Dict):
+        with self._lock:
+            for key, (counts, total) in delta.items():
+                current, current_total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+                self._values[key] = ([a + b for a, b in zip(current, counts)], current_total + total)
+
+    @staticmethod
+    def _combine(value: Optional[Tuple[List[int], float]], other: Tuple[List[int], float]) -> Tuple[List[int], float]:
+        if value is None:
+            return list(other[0]), other[1]
+        return [a + b for a, b in zip(value[0], other[0])], value[1] + other[1]
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._shared_dir: Optional[str] = None
+        self._writer: Optional[threading.Thread] = None
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format, of every sharing process after share()."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        if self._shared_dir is None:
+            lines = []
+            for metric in metrics:
+                lines.extend(metric.collect())
+            return "\n".join(lines) + "\n"
+
+        processes = self._read_shared()
+        processes[os.getpid()] = self._write_shared()
+        lines = []
+        for metric in metrics:
+            if isinstance(metric, Gauge):
+                # Gauges describe a process; the processes are told apart instead of summed
+                values = {
+                    key + (str(pid),): value for pid, snapshot in sorted(processes.items())
+                    if pid == os.getpid() or _process_alive(pid)
+                    for key, value in snapshot.get(metric.name, {}).items()
+                }
+                lines.extend(metric._render(values, metric.labelnames + ("pid",)))
+            else:
+                values = {}
+                for snapshot in processes.values():
+                    for key, value in snapshot.get(metric.name, {}).items():
+                        values[key] = metric._combine(values.get(key), value)
+                lines.extend(metric._render(values))
+        return "\n".join(lines) + "\n"
+
+    def share(self, directory: str, interval: float = 5.0):
+        """
+        Share this process's metrics with the other API processes through a directory.
+
+        Every process writes its values to <directory>/<pid>.json every interval
+        seconds, and render() includes every process's values. The directory
+        must be emptied when the service starts, not while it runs.
+
+        Args:
+            directory: Directory shared by all API processes of the service
+            interval: Seconds between writes; a scrape sees other processes this much behind
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._shared_dir = directory
+        self._write_shared()
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_periodically, args=(interval,),
+                                            name="metrics-writer", daemon=True)
+            self._writer.start()
+
+    def _write_periodically(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self._write_shared()
+            except Exception as e:
+                logger.warning(f"Could not write shared metrics: {str(e)}")
+
+    def _write_shared(self) -> Dict[str, Dict[Tuple[str, ...], object]]:
+        """Write this process's values to the shared directory and return them."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshot = {metric.name: metric._snapshot() for metric in metrics}
+        path = os.path.join(self._shared_dir, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({name: [[list(key), value] for key, value in values.items()]
+                       for name, values in snapshot.items()}, f)
+        os.replace(path + ".tmp", path)
+        return snapshot
+
+    def _read_shared(self) -> Dict[int, Dict[str, Dict[Tuple[str, ...], object]]]:
+        """The values the other processes last wrote, by PID."""
+        processes = {}
+        for name in os.listdir(self._shared_dir):
+            pid = name[:-len(".json")]
+            if not name.endswith(".json") or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(self._shared_dir, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            processes[int(pid)] = {
+                metric: {tuple(key): value for key, value in values} for metric, values in data.items()
+            }
+        return processes
+
+    def collect_delta(self) -> Dict[str, Dict]:
+        """
+        Take the counter and histogram values recorded since the last call, resetting them.
+
+        Gauges describe the current process and are not included.
+
+        Returns:
+            Picklable {metric name: values} for merge_delta
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        delta = {}
+        for metric in metrics:
+            if isinstance(metric, (Counter, Histogram)):
+                values = metric.collect_delta()
+                if values:
+                    delta[metric.name] = values
+        return delta
+
+    def merge_delta(self, delta: Dict[str, Dict]):
+        """Add values taken with collect_delta in another process."""
+        for name, values in delta.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.merge_delta(values)
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = Counter(
+    "vibesync_http_requests_total", "HTTP requests by route and status code",
+    ("method", "route", "status"), REGISTRY
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "vibesync_http_request_duration_seconds", "HTTP request latency by route",
+    ("method", "route"), REGISTRY
+)
+CLASSIFIER_STAGE_DURATION = Histogram(
+    "vibesync_classifier_stage_duration_seconds",
+    "Time spent per classifier stage call: decode, spectrogram, extractor (fused backends include the head), head",
+    ("stage",), REGISTRY
+)
+FFMPEG_DURATION = Histogram(
+    "vibesync_ffmpeg_duration_seconds", "FFmpeg decode subprocess duration by outcome",
+    ("outcome",), REGISTRY
+)
+FFMPEG_FAILURES = Counter(
+    "vibesync_ffmpeg_failures_total", "FFmpeg decodes that failed, by reason: not_found, timeout, exec or error",
+    ("reason",), REGISTRY
+)
+CLASSIFICATIONS_IN_FLIGHT = Gauge(
+    "vibesync_classifications_in_flight", "Classifier calls currently running or waiting for a worker",
+    registry=REGISTRY
+)
+CACHE_LOOKUPS = Counter(
+    "vibesync_cache_lookups_total", "Classification cache lookups by entry kind and result: memory, redis or miss",
+    ("kind", "result"), REGISTRY
+)
+CACHE_HIT_RATIO = Gauge(
+    "vibesync_cache_hit_ratio", "Share of classification cache lookups served from either tier since startup",
+    registry=REGISTRY
+)
+SPOTIFY_REQUEST_DURATION = Histogram(
+    "vibesync_spotify_request_duration_seconds", "Spotify Web API call latency by endpoint and outcome",
+    ("endpoint", "outcome"), REGISTRY
+)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware that counts HTTP requests and times them per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The matched route's template keeps job IDs and the like out of the labels
+            route = scope.get("route")
+            route_label = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.labels(method=method, route=route_label, status=str(status)).inc()
+            HTTP_REQUEST_DURATION.labels(method=method, route=route_label).observe(time.perf_counter() - start)
@@ -0,0 +1,169 @@
+"""
+Model Bundle
+Self-contained model directory that loads from local disk without downloads.
+
+A bundle holds everything the Keras backend needs:
+
+    manifest.json   format version, genres, model version, file hashes and the weight index
+    head.json       architecture of the genre head (Keras JSON)
+    weights.bin     every extractor and head weight as raw little-endian arrays,
+                    each starting on a 64-byte boundary
+
+The EfficientNetB0 architecture is rebuilt without weights and both models are
+filled from weights.bin, which is memory-mapped, so loading parses no HDF5 and
+never fetches the ImageNet weights. Processes mapping the same file share its
+page cache. Bundles are written and validated by app.tools.build_model_bundle.
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+HEAD_ARCHITECTURE_NAME = "head.json"
+WEIGHTS_NAME = "weights.bin"
+
+# Arrays start on this boundary in weights.bin, so every view is aligned for SIMD loads
+WEIGHT_ALIGNMENT = 64
+
+
+class ModelBundleError(Exception):
+    """Raised when a bundle is missing files, corrupt or of an unsupported format."""
+
+
+def is_bundle(path: str) -> bool:
+    """Whether path is a model bundle directory."""
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_NAME))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_bundle_manifest(bundle_dir: str) -> Dict:
+    """
+    Read and check the manifest of a bundle.
+
+    Raises:
+        ModelBundleError: If the manifest is missing or of an unsupported format version
+    """
+    path = os.path.join(bundle_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        raise ModelBundleError(f"No {MANIFEST_NAME} in {bundle_dir}")
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ModelBundleError(
+            f"Bundle format version {manifest.get('format_version')} is not supported (expected {BUNDLE_FORMAT_VERSION})"
+        )
+    return manifest
+
+
+def verify_bundle(bundle_dir: str, manifest: Optional[Dict] = None):
+    """
+    Check that every file of a bundle matches the hash recorded in its manifest.
+
+    Raises:
+        ModelBundleError: If a file is missing or was modified
+    """
+    manifest = manifest or read_bundle_manifest(bundle_dir)
+    for name, expected in manifest["files"].items():
+        path = os.path.join(bundle_dir, name)
+        if not os.path.exists(path):
+            raise ModelBundleError(f"Bundle file missing: {path}")
+        if file_sha256(path) != expected["sha256"]:
+            raise ModelBundleError(f"Bundle file does not match its manifest hash: {path}")
+
+
+def map_weights(bundle_dir: str, manifest: Dict) -> Dict[str, List[np.ndarray]]:
+    """
+    Memory-map weights.bin and cut it into the arrays of each model.
+
+    Returns:
+        {model name: read-only arrays in the order of the model's weights}
+    """
+    buffer = np.memmap(os.path.join(bundle_dir, WEIGHTS_NAME), dtype=np.uint8, mode="r")
+    weights = {}
+    for model_name, entries in manifest["weights"].items():
+        arrays = []
+        for entry in entries:
+            dtype = np.dtype(entry["dtype"])
+            count = int(np.prod(entry["shape"], dtype=np.int64))
+            start = entry["offset"]
+            arrays.append(buffer[start:start + count * dtype.itemsize].view(dtype).reshape(entry["shape"]))
+        weights[model_name] = arrays
+    return weights
+
+
+def _layer_path(path: str) -> str:
+    """
+    Layer and variable name of a variable path, comparable between builds.
+
+    Drops the model name prefix and the '_1', '_2' suffixes Keras adds depending
+    on how many layers were built before in the process.
+    """
+    return "/".join(re.sub(r"_\d+$", "", part) for part in path.split("/")[-2:])
+
+
+def assign_weights(model, arrays: List[np.ndarray], entries: List[Dict]):
+    """
+    Load arrays into a model's variables, checking they line up with the manifest entries.
+
+    Raises:
+        ModelBundleError: If the model's variables do not match the bundle
+    """
+    variables = model.weights
+    if len(variables) != len(entries):
+        raise ModelBundleError(f"{model.name} has {len(variables)} weights, the bundle has {len(entries)}")
+    for variable, array, entry in zip(variables, arrays, entries):
+        if tuple(variable.shape) != tuple(entry["shape"]) or _layer_path(variable.path) != _layer_path(entry["path"]):
+            raise ModelBundleError(
+                f"Bundle weight {entry['path']} {tuple(entry['shape'])} does not match "
+                f"{variable.path} {tuple(variable.shape)}"
+            )
+        variable.assign(array)
+
+
+def write_weights(path: str, models: Dict[str, object]) -> Dict[str, List[Dict]]:
+    """
+    Write the weights of Keras models into one aligned binary file.
+
+    Args:
+        path: Where to write weights.bin
+        models: {model name: Keras model}
+
+    Returns:
+        The weight index for the manifest: {model name: [{'path', 'dtype', 'shape', 'offset'}]}
+    """
+    index = {}
+    offset = 0
+    with open(path, "wb") as f:
+        for model_name, model in models.items():
+            entries = []
+            for variable in model.weights:
+                array = np.array(variable.numpy(), order="C")  # ascontiguousarray would turn scalars into 1-d
+                array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+                padding = -offset % WEIGHT_ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                entries.append({
+                    "path": variable.path,
+                    "dtype": array.dtype.str,
+                    "shape": list(array.shape),
+                    "offset": offset,
+                })
+                f.write(array.tobytes())
+                offset += array.nbytes
+            index[model_name] = entries
+    return index
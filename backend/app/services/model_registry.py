@@ -0,0 +1,517 @@
+"""
+Model Registry
+Serves one model version at a time and replaces it without downtime.
+
+Every loaded model version is a ModelDeployment: the classifier plus its own
+inference scheduler (in-process) or worker pool. Requests lease the active
+deployment when they start and return it when they finish, so all batches of a
+request run on one version, and its results and cache keys carry that version.
+
+A new version is loaded and warmed up in the background while the current one
+keeps serving. Activating it swaps the active deployment in one step; requests
+already holding the previous version finish on it, after which it is closed
+and its memory released (draining). A version can instead be deployed as a
+shadow: a sample of requests is scored again with it in the background and
+compared with the active version's results, without affecting responses.
+
+Each uvicorn worker process has its own registry. DeploymentState is the
+version every process should serve, kept in a JSON file: the admin endpoints
+change the file, and every process polls it and loads, promotes or stops
+versions until its registry matches.
+"""
+import gc
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker
+    fcntl = None
+
+from .inference_backends import backend_class
+from .inference_scheduler import InferenceScheduler
+from .metrics import REGISTRY, Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+SHADOW_COMPARISONS = Counter(
+    "vibesync_shadow_comparisons_total",
+    "Shadow model scorings by outcome: match or mismatch of the overall genre, or error",
+    ("outcome",), REGISTRY
+)
+SHADOW_DISTRIBUTION_DIFF = Histogram(
+    "vibesync_shadow_distribution_diff",
+    "Largest difference in genre vote share between the active and the shadow model, per scored track",
+    registry=REGISTRY, buckets=(0.0, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0)
+)
+
+
+class ModelDeployment:
+    def __init__(self, classifier, pool=None, max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        """
+        Wrap a loaded classifier.
+
+        Args:
+            classifier: Loaded MusicGenreClassifier
+            pool: Started ClassificationPool running this version, or None to run in-process
+            max_batch_size: Batch size of the in-process inference scheduler
+            max_wait_ms: Longest time the scheduler holds a batch open
+        """
+        self.classifier = classifier
+        self.pool = pool
+        self.version = classifier.model_version
+        self.model_path = classifier.model_path
+        self.state = "loaded"  # loaded, active, shadow, draining or retired
+        self.loaded_at = time.time()
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.leases = 0
+
+        self._scheduler: Optional[InferenceScheduler] = None
+        self._lock = threading.Lock()
+
+    @property
+    def scheduler(self) -> Optional[InferenceScheduler]:
+        """The in-process inference scheduler, if one has been started."""
+        return self._scheduler
+
+    def get_scheduler(self) -> InferenceScheduler:
+        """Get or start the inference scheduler shared by all requests on this version."""
+        with self._lock:
+            if self._scheduler is None:
+                self._scheduler = InferenceScheduler(
+                    partial(self.classifier.predict_images, return_features=True),
+                    max_batch_size=self.max_batch_size,
+                    max_wait_ms=self.max_wait_ms
+                )
+                logger.info(f"Inference scheduler started for model {self.version}")
+            return self._scheduler
+
+    def close(self):
+        """Stop the scheduler or worker pool and drop the model."""
+        with self._lock:
+            scheduler, self._scheduler = self._scheduler, None
+        if scheduler is not None:
+            scheduler.close(timeout=10)
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.classifier = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "state": self.state,
+            "model_path": self.model_path,
+            "backend": (backend_class(self.model_path).name if self.pool is not None
+                        else getattr(getattr(self.classifier, "backend", None), "name", None)),
+            "workers": self.pool.workers if self.pool is not None else 0,
+            "loaded_at": self.loaded_at,
+            "leases": self.leases,
+        }
+
+
+def compare_results(primary: Dict, shadow: Dict) -> Dict[str, Any]:
+    """
+    Compare the full-track results of the active and the shadow model.
+
+    Args:
+        primary: Result of the active version
+        shadow: Result of the shadow version for the same track and parameters
+
+    Returns:
+        Dictionary with 'agree' (same overall genre), 'distribution_diff' (largest
+        difference in vote share) and 'segment_agreement' (share of segments at the
+        same start time with the same genre, None if none line up)
+    """
+    primary_distribution = primary['overall_prediction']['genre_distribution']
+    shadow_distribution = shadow['overall_prediction']['genre_distribution']
+    # Versions may predict different genre sets
+    genres = set(primary_distribution) | set(shadow_distribution)
+    distribution_diff = max(
+        abs(primary_distribution.get(genre, 0.0) - shadow_distribution.get(genre, 0.0)) for genre in genres
+    )
+
+    shadow_segments = {s['start_time']: s['predicted_genre'] for s in shadow['segment_predictions']}
+    matched = [
+        s['predicted_genre'] == shadow_segments[s['start_time']]
+        for s in primary['segment_predictions'] if s['start_time'] in shadow_segments
+    ]
+    return {
+        "agree": primary['overall_prediction']['predicted_genre'] == shadow['overall_prediction']['predicted_genre'],
+        "distribution_diff": distribution_diff,
+        "segment_agreement": sum(matched) / len(matched) if matched else None,
+    }
+
+
+class ModelRegistry:
+    def __init__(self, max_shadow_in_flight: int = 2, history_size: int = 10):
+        """
+        Initialize an empty registry.
+
+        Args:
+            max_shadow_in_flight: Most shadow scorings running at once; further samples are skipped
+            history_size: Retired versions kept in the status
+        """
+        self.max_shadow_in_flight = max_shadow_in_flight
+        self.shadow_sample_rate = 0.0
+
+        self._active: Optional[ModelDeployment] = None
+        self._shadow: Optional[ModelDeployment] = None
+        self._draining: List[ModelDeployment] = []
+        self._retired = deque(maxlen=history_size)
+        self._loading: Optional[Dict[str, Any]] = None
+        self._load_task: Optional[asyncio.Task] = None
+        self._last_error: Optional[str] = None
+        self._shadow_in_flight = 0
+        self._shadow_stats = {"scored": 0, "agreed": 0, "errors": 0, "skipped": 0, "distribution_diff_sum": 0.0}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> Optional[ModelDeployment]:
+        return self._active
+
+    @property
+    def shadow(self) -> Optional[ModelDeployment]:
+        return self._shadow
+
+    @property
+    def loading(self) -> bool:
+        return self._loading is not None
+
+    def acquire(self, deployment: Optional[ModelDeployment] = None) -> ModelDeployment:
+        """
+        Lease a deployment so it is not closed while in use.
+
+        Args:
+            deployment: Deployment to lease (default: the active one)
+
+        Returns:
+            The leased deployment; give it back with release()
+
+        Raises:
+            RuntimeError: If no version is active or the deployment was already closed
+        """
+        with self._lock:
+            deployment = deployment or self._active
+            if deployment is None:
+                raise RuntimeError("No model version is active")
+            if deployment.state == "retired":
+                raise RuntimeError(f"Model version {deployment.version} was retired")
+            deployment.leases += 1
+            return deployment
+
+    def release(self, deployment: ModelDeployment):
+        """Return a lease; the last lease on a draining version closes it."""
+        with self._lock:
+            deployment.leases -= 1
+            drained = deployment.state == "draining" and deployment.leases == 0
+        if drained:
+            self._close_in_background(deployment)
+
+    @contextmanager
+    def lease(self, deployment: Optional[ModelDeployment] = None) -> Iterator[ModelDeployment]:
+        """Context manager around acquire() and release()."""
+        deployment = self.acquire(deployment)
+        try:
+            yield deployment
+        finally:
+            self.release(deployment)
+
+    def activate(self, deployment: ModelDeployment):
+        """
+        Make a loaded deployment the active one, draining the previous version.
+
+        New requests get the new version immediately; requests holding the
+        previous one finish on it.
+        """
+        with self._lock:
+            previous, self._active = self._active, deployment
+            if self._shadow is deployment:
+                self._shadow = None
+            deployment.state = "active"
+        logger.info(f"Model version {deployment.version} is active"
+                    + (f", draining {previous.version}" if previous is not None else ""))
+        if previous is not None and previous is not deployment:
+            self._retire(previous)
+
+    def set_shadow(self, deployment: ModelDeployment, sample_rate: float):
+        """Score sample_rate of the requests with deployment as well, replacing the current shadow."""
+        with self._lock:
+            previous, self._shadow = self._shadow, deployment
+            self.shadow_sample_rate = sample_rate
+            deployment.state = "shadow"
+            self._shadow_stats = dict.fromkeys(self._shadow_stats, 0)
+            self._shadow_stats["distribution_diff_sum"] = 0.0
+        logger.info(f"Model version {deployment.version} is shadowing {sample_rate:.0%} of requests")
+        if previous is not None:
+            self._retire(previous)
+
+    def promote_shadow(self) -> ModelDeployment:
+        """
+        Activate the shadow version.
+
+        Raises:
+            RuntimeError: If there is no shadow version
+        """
+        shadow = self._shadow
+        if shadow is None:
+            raise RuntimeError("No shadow model version")
+        self.activate(shadow)
+        return shadow
+
+    def stop_shadow(self):
+        """Stop shadow scoring and drain the shadow version."""
+        with self._lock:
+            shadow, self._shadow = self._shadow, None
+        if shadow is not None:
+            logger.info(f"Stopped shadowing with model version {shadow.version}")
+            self._retire(shadow)
+
+    def deploy(self, load: Callable[[], Awaitable[ModelDeployment]], description: Dict[str, Any],
+               shadow_sample_rate: Optional[float] = None):
+        """
+        Load and warm up a version in the background, then activate it or start shadowing with it.
+
+        Must be called on the event loop. The active version keeps serving while
+        the new one loads; if loading fails it stays active and the error is
+        reported in status().
+
+        Args:
+            load: Coroutine function returning the loaded and warmed-up deployment
+            description: What is being loaded, for status(), e.g. the model path
+            shadow_sample_rate: Deploy as a shadow scoring this share of requests instead of activating
+
+        Raises:
+            RuntimeError: If another version is still loading
+        """
+        with self._lock:
+            if self._loading is not None:
+                raise RuntimeError("Another model version is still loading")
+            self._loading = dict(description, started_at=time.time(),
+                                 mode="shadow" if shadow_sample_rate is not None else "active")
+        self._load_task = asyncio.create_task(self._deploy(load, shadow_sample_rate))
+
+    async def _deploy(self, load: Callable[[], Awaitable[ModelDeployment]], shadow_sample_rate: Optional[float]):
+        try:
+            deployment = await load()
+            active = self._active
+            if active is not None and deployment.version == active.version:
+                logger.info(f"Model version {deployment.version} is already active")
+                await asyncio.get_running_loop().run_in_executor(None, deployment.close)
+            elif shadow_sample_rate is not None:
+                self.set_shadow(deployment, shadow_sample_rate)
+            else:
+                self.activate(deployment)
+            self._last_error = None
+        except Exception as e:
+            self._last_error = f"{self._loading.get('model_path')}: {str(e)}"
+            logger.error(f"Loading model version failed: {self._last_error}")
+        finally:
+            self._loading = None
+
+    async def wait_for_load(self):
+        """Wait for a background load started with deploy() to finish."""
+        if self._load_task is not None and not self._load_task.done():
+            await asyncio.shield(self._load_task)
+
+    def sample_shadow(self) -> Optional[ModelDeployment]:
+        """
+        Decide whether to score the current request with the shadow version.
+
+        Returns:
+            The leased shadow deployment (release it when done), or None
+        """
+        with self._lock:
+            shadow = self._shadow
+            if shadow is None or random.random() >= self.shadow_sample_rate:
+                return None
+            if self._shadow_in_flight >= self.max_shadow_in_flight:
+                self._shadow_stats["skipped"] += 1
+                return None
+            self._shadow_in_flight += 1
+            shadow.leases += 1
+            return shadow
+
+    def finish_shadow(self, shadow: ModelDeployment, primary: Dict, result: Optional[Dict]):
+        """
+        Record a shadow scoring and release the shadow lease.
+
+        Args:
+            shadow: Deployment returned by sample_shadow()
+            primary: Result of the active version
+            result: Result of the shadow version, or None if it failed
+        """
+        comparison = compare_results(primary, result) if result is not None else None
+        with self._lock:
+            self._shadow_in_flight -= 1
+            if shadow is self._shadow:
+                if comparison is None:
+                    self._shadow_stats["errors"] += 1
+                else:
+                    self._shadow_stats["scored"] += 1
+                    self._shadow_stats["agreed"] += int(comparison["agree"])
+                    self._shadow_stats["distribution_diff_sum"] += comparison["distribution_diff"]
+
+        if comparison is None:
+            SHADOW_COMPARISONS.labels(outcome="error").inc()
+        else:
+            SHADOW_COMPARISONS.labels(outcome="match" if comparison["agree"] else "mismatch").inc()
+            SHADOW_DISTRIBUTION_DIFF.observe(comparison["distribution_diff"])
+            if not comparison["agree"]:
+                logger.info(
+                    f"Shadow model {shadow.version} predicted {result['overall_prediction']['predicted_genre']}, "
+                    f"active model {primary.get('model_version')} {primary['overall_prediction']['predicted_genre']}"
+                )
+        self.release(shadow)
+
+    def status(self) -> Dict[str, Any]:
+        """Get the active, shadow, loading, draining and recently retired versions."""
+        with self._lock:
+            stats = dict(self._shadow_stats)
+            shadow = None
+            if self._shadow is not None:
+                scored = stats.pop("scored")
+                diff_sum = stats.pop("distribution_diff_sum")
+                shadow = dict(
+                    self._shadow.describe(),
+                    sample_rate=self.shadow_sample_rate,
+                    in_flight=self._shadow_in_flight,
+                    scored=scored,
+                    agreement=stats.pop("agreed") / scored if scored else None,
+                    mean_distribution_diff=diff_sum / scored if scored else None,
+                    **stats
+                )
+            return {
+                "active": self._active.describe() if self._active is not None else None,
+                "shadow": shadow,
+                "loading": self._loading,
+                "draining": [deployment.describe() for deployment in self._draining],
+                "retired": list(self._retired),
+                "last_error": self._last_error,
+            }
+
+    def close(self):
+        """Close every deployment, e.g. on shutdown."""
+        with self._lock:
+            deployments = [d for d in (self._active, self._shadow, *self._draining) if d is not None]
+            self._active = self._shadow = None
+            self._draining = []
+        for deployment in deployments:
+            deployment.close()
+            deployment.state = "retired"
+
+    def _retire(self, deployment: ModelDeployment):
+        """Stop handing out a deployment and close it once its last lease is returned."""
+        with self._lock:
+            deployment.state = "draining"
+            self._draining.append(deployment)
+            drained = deployment.leases == 0
+        if drained:
+            self._close_in_background(deployment)
+
+    def _close_in_background(self, deployment: ModelDeployment):
+        # Shutting down a worker pool blocks, keep it off the event loop
+        threading.Thread(target=self._close, args=(deployment,), name="model-drain", daemon=True).start()
+
+    def _close(self, deployment: ModelDeployment):
+        with self._lock:
+            if deployment.state != "draining":
+                return
+            deployment.state = "retired"
+            if deployment in self._draining:
+                self._draining.remove(deployment)
+        description = deployment.describe()
+        deployment.close()
+        # Models are large object graphs; release them now rather than at the next collection
+        gc.collect()
+        self._retired.append(dict(description, retired_at=time.time()))
+        logger.info(f"Model version {deployment.version} drained and released")
+
+
+class DeploymentState:
+    def __init__(self, path: str, model_path: str, encoder_path: str):
+        """
+        Shared record of the model versions every API process should serve.
+
+        The record holds a generation counter, the active version and the
+        shadow version (or None). It is tied to the configured model: after
+        the configured model changes, a record written for the previous one
+        is ignored and every process serves the configured model again.
+
+        Args:
+            path: JSON file shared by the processes
+            model_path: Configured model, active until the first deployment
+            encoder_path: Label encoder of the configured model
+        """
+        self.path = path
+        self.model_path = model_path
+        self.encoder_path = encoder_path
+
+    def initial(self) -> Dict[str, Any]:
+        """The state before any deployment: the configured model, no shadow."""
+        return {
+            "generation": 0,
+            "configured_model_path": self.model_path,
+            "active": {"model_path": self.model_path, "encoder_path": self.encoder_path},
+            "shadow": None,
+        }
+
+    def read(self) -> Dict[str, Any]:
+        """The current state; the initial one if none has been written for the configured model."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return self.initial()
+        if state.get("configured_model_path") != self.model_path:
+            return self.initial()
+        return state
+
+    def deploy(self, model_path: str, encoder_path: str, shadow_sample_rate: Optional[float] = None) -> Dict[str, Any]:
+        """Make a version the active one, or the shadow scoring shadow_sample_rate of requests."""
+        version = {"model_path": model_path, "encoder_path": encoder_path}
+        if shadow_sample_rate is None:
+            return self._update(lambda state: dict(state, active=version))
+        return self._update(lambda state: dict(state, shadow=dict(version, sample_rate=shadow_sample_rate)))
+
+    def promote_shadow(self) -> Dict[str, Any]:
+        """
+        Make the shadow version the active one.
+
+        Raises:
+            RuntimeError: If there is no shadow version
+        """
+        def promote(state):
+            if state["shadow"] is None:
+                raise RuntimeError("No shadow model version")
+            shadow = state["shadow"]
+            return dict(state, active={"model_path": shadow["model_path"], "encoder_path": shadow["encoder_path"]},
+                        shadow=None)
+        return self._update(promote)
+
+    def stop_shadow(self) -> Dict[str, Any]:
+        """Stop shadowing."""
+        return self._update(lambda state: dict(state, shadow=None))
+
+    def _update(self, change: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        """Apply change to the state under the file lock and write it atomically with the next generation."""
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            state = change(self.read())
+            state["generation"] += 1
+            state["updated_at"] = time.time()
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(self.path + ".tmp", self.path)
+        return state
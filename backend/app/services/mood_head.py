@@ -0,0 +1,115 @@
+"""
+Mood Head
+Predicts the mood of segments from the EfficientNetB0 embeddings the genre head already uses.
+
+The head is a standardized linear softmax over the embeddings averaged over
+their 7x7 grid, trained with app.tools.train_mood_head. It runs in NumPy on
+the features returned with the genre probabilities, so every inference
+backend gets mood from the same forward pass at the cost of one small matrix
+product per batch, and cached embeddings can be re-scored without the
+extractor.
+
+The head is stored as an .npz file with the arrays 'moods', 'mean', 'scale',
+'weights' and 'bias', plus a JSON 'metadata' string written by the trainer.
+"""
+import json
+import hashlib
+import logging
+from typing import Dict, List
+
+import numpy as np
+
+from .metrics import CLASSIFIER_STAGE_DURATION
+
+logger = logging.getLogger(__name__)
+
+
+def pool_embeddings(features: np.ndarray) -> np.ndarray:
+    """
+    Average embeddings over their spatial grid.
+
+    Args:
+        features: Embeddings of shape (N, 7, 7, 1280), or already pooled (N, 1280)
+
+    Returns:
+        float32 array of shape (N, 1280)
+    """
+    features = np.asarray(features, dtype=np.float32)
+    if features.ndim > 2:
+        return features.reshape(len(features), -1, features.shape[-1]).mean(axis=1)
+    return features
+
+
+class MoodHead:
+    def __init__(self, path: str):
+        """
+        Load a trained mood head.
+
+        Args:
+            path: .npz file written by app.tools.train_mood_head
+
+        Raises:
+            ValueError: If the file is missing arrays or their shapes do not match
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self.version = hashlib.sha256(f.read()).hexdigest()[:12]
+
+        with np.load(path, allow_pickle=False) as data:
+            missing = {'moods', 'mean', 'scale', 'weights', 'bias'} - set(data.files)
+            if missing:
+                raise ValueError(f"Mood head {path} is missing {sorted(missing)}")
+            self.moods: List[str] = [str(mood) for mood in data['moods']]
+            self.mean = data['mean'].astype(np.float32)
+            self.scale = data['scale'].astype(np.float32)
+            self.weights = data['weights'].astype(np.float32)
+            self.bias = data['bias'].astype(np.float32)
+            self.metadata: Dict = json.loads(str(data['metadata'])) if 'metadata' in data.files else {}
+
+        if self.weights.shape != (len(self.mean), len(self.moods)) or len(self.bias) != len(self.moods):
+            raise ValueError(
+                f"Mood head {path} has weights {self.weights.shape} for {len(self.mean)} features "
+                f"and {len(self.moods)} moods"
+            )
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """
+        Mood probabilities of a batch of segments.
+
+        Args:
+            features: Embeddings as returned by predict_images(..., return_features=True)
+
+        Returns:
+            float32 probabilities of shape (N, num_moods)
+        """
+        with CLASSIFIER_STAGE_DURATION.labels(stage='mood_head').time():
+            logits = ((pool_embeddings(features) - self.mean) / self.scale) @ self.weights + self.bias
+            logits -= logits.max(axis=1, keepdims=True)
+            probabilities = np.exp(logits)
+            return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+
+def save_mood_head(path: str, moods: List[str], mean: np.ndarray, scale: np.ndarray,
+                   weights: np.ndarray, bias: np.ndarray, metadata: Dict):
+    """
+    Write a mood head in the format MoodHead loads.
+
+    Args:
+        path: Output .npz file
+        moods: Mood names, in the order of the weight columns
+        mean: Per-feature mean of the pooled training embeddings
+        scale: Per-feature standard deviation of the pooled training embeddings
+        weights: Weights of shape (num_features, num_moods)
+        bias: Bias of shape (num_moods,)
+        metadata: Training details stored alongside, e.g. the validation accuracy
+    """
+    with open(path, 'wb') as f:
+        np.savez(
+            f,
+            moods=np.array(moods, dtype=str),
+            mean=np.asarray(mean, dtype=np.float32),
+            scale=np.asarray(scale, dtype=np.float32),
+            weights=np.asarray(weights, dtype=np.float32),
+            bias=np.asarray(bias, dtype=np.float32),
+            metadata=np.array(json.dumps(metadata))
+        )
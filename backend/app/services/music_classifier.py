@@ -5,435 +5,680 @@ Handles music genre prediction using the trained EfficientNetB0 model.
 import os
 import pickle
 import numpy as np
-import cv2
 import librosa
-import matplotlib.pyplot as plt
-from pydub import AudioSegment
-from pydub.utils import which
-from tensorflow.keras.models import load_model
-from tensorflow.keras.applications.efficientnet import preprocess_input
-from tensorflow.keras.applications import EfficientNetB0
-from typing import List, Dict, Optional, Tuple
-import tempfile
+from typing import Callable, List, Dict, Optional, Tuple
+import hashlib
+import itertools
 import logging
+import time
+from functools import partial
 from pathlib import Path
-import subprocess
-import shutil
+
+from ..config.music_config import (
+    IMAGE_SIZE, N_MELS, FMAX, SAMPLE_RATE, MAX_INFERENCE_BATCH_SIZE, NATIVE_AUDIO_FORMATS,
+    MAX_SEGMENTS_PER_TRACK, ADAPTIVE_MIN_SEGMENTS, ADAPTIVE_CONFIDENCE, N_FFT, HOP_LENGTH,
+    STREAMING_MIN_DURATION, STREAMING_BLOCK_SECONDS, MOOD_HEAD_PATH
+)
+from .spectrogram_renderer import render_spectrogram
+from .track_spectrogram import TrackMelSpectrogram
+from .inference_backends import InferenceBackend, backend_class, create_backend, load_manifest
+from .model_bundle import is_bundle, read_bundle_manifest
+from .mood_head import MoodHead
+from .ffmpeg_decoder import decode_audio, ffmpeg_available, find_ffmpeg
+from .audio_stream import SampleRingBuffer, audio_duration, stream_audio
+from .metrics import CLASSIFIER_STAGE_DURATION
 
 logger = logging.getLogger(__name__)
 
+# Same contract as MusicGenreClassifier.predict_images: maps an (N, 224, 224, 3)
+# image batch to (N, num_genres) probabilities, or to a (probabilities, features)
+# tuple when called with return_features=True
+PredictFn = Callable[..., np.ndarray]
+
+# Identifies the frozen feature extractor; cached embeddings are keyed on it
+EXTRACTOR_VERSION = "efficientnetb0-imagenet"
+
 class MusicGenreClassifier:
-    def __init__(self, model_path: str, label_encoder_path: str):
+    def __init__(self, model_path: str, label_encoder_path: str, num_threads: Optional[int] = None,
+                 preprocessing_only: bool = False, mood_head_path: Optional[str] = MOOD_HEAD_PATH,
+                 metadata_only: bool = False):
         """
         Initialize the music genre classifier.
         
         Args:
-            model_path: Path to the trained .h5 model
-            label_encoder_path: Path to the label encoder pickle file
+            model_path: Path to the trained .h5 model, a fused .tflite/.onnx export or a
+                model bundle directory; the extension selects the inference backend
+            label_encoder_path: Path to the label encoder pickle file (unused for bundles)
+            num_threads: Inference threads for the TFLite and ONNX backends (default: runtime decides)
+            preprocessing_only: Skip loading the model and encoder; only decoding and
+                prepare_track can be used, e.g. in decode worker processes
+            mood_head_path: Mood head trained on the embeddings, see app.services.mood_head;
+                results carry mood only when it exists (None: genre only)
+            metadata_only: Read the genres and the model and extractor versions from the
+                model's files without loading the model, e.g. in an API process whose
+                inference runs in a worker pool; no inference method can be used
         """
         self.model_path = model_path
         self.label_encoder_path = label_encoder_path
-        self.model = None
+        self.mood_head_path = mood_head_path
+        self.num_threads = num_threads
+        self.backend: Optional[InferenceBackend] = None  # Runs the extractor and head
         self.label_encoder = None
         self.genres = None
-        self.feature_extractor = None  # EfficientNetB0 feature extractor
+        self.extractor_version = EXTRACTOR_VERSION
+        self.model_version = None  # Content hash of the model file and label encoder
+        self.mood_head: Optional[MoodHead] = None  # Scores mood on the same embeddings
+        self.moods = None
         
         # Check for FFmpeg dependency
         self._check_ffmpeg()
         
         # Load model and encoder
-        self._load_model_and_encoder()
+        if not preprocessing_only:
+            self._load_model_and_encoder(load_backend=not metadata_only)
     
     def _check_ffmpeg(self):
         """Check if FFmpeg is available on the system."""
+        ffmpeg_path = find_ffmpeg()
+        if ffmpeg_path:
+            logger.info(f"FFmpeg found at: {ffmpeg_path}")
+        else:
+            # If FFmpeg not found, warn but don't fail - librosa still reads the native formats
+            logger.warning(
+                "FFmpeg not found. Formats other than MP3, WAV, FLAC and OGG will not be supported. "
+                "Please install FFmpeg and add it to your PATH (or set FFMPEG_PATH) for full format support. "
+                "Download from: https://ffmpeg.org/download.html"
+            )
+    
+    def _load_model_and_encoder(self, load_backend: bool = True):
+        """
+        Load the trained model and label encoder.
+        
+        Args:
+            load_backend: Load the model itself; without it only the genres and versions are read
+        """
         try:
-            # Check for ffmpeg and ffprobe
-            ffmpeg_path = which("ffmpeg") or shutil.which("ffmpeg")
-            ffprobe_path = which("ffprobe") or shutil.which("ffprobe")
-            
-            if not ffmpeg_path or not ffprobe_path:
-                logger.warning("FFmpeg not found in PATH. Attempting to set AudioSegment converter paths.")
-                
-                # Try common Windows FFmpeg locations
-                possible_paths = [
-                    r"C:\ffmpeg\bin\ffmpeg.exe",
-                    r"C:\Program Files\ffmpeg\bin\ffmpeg.exe",
-                    r"C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe",
-                    os.path.join(os.getcwd(), "ffmpeg", "bin", "ffmpeg.exe"),
-                ]
-                
-                for path in possible_paths:
-                    if os.path.exists(path):
-                        ffmpeg_dir = os.path.dirname(path)
-                        AudioSegment.converter = os.path.join(ffmpeg_dir, "ffmpeg.exe")
-                        AudioSegment.ffmpeg = os.path.join(ffmpeg_dir, "ffmpeg.exe") 
-                        AudioSegment.ffprobe = os.path.join(ffmpeg_dir, "ffprobe.exe")
-                        logger.info(f"Found FFmpeg at: {ffmpeg_dir}")
-                        return
-                
-                # If FFmpeg not found, warn but don't fail - try to continue
-                logger.warning(
-                    "FFmpeg not found. Some audio formats may not be supported. "
-                    "Please install FFmpeg and add it to your PATH for full format support. "
-                    "Download from: https://ffmpeg.org/download.html"
-                )
+            if load_backend:
+                # Keras, TFLite or ONNX Runtime, depending on the model file
+                self.backend = create_backend(self.model_path, self.num_threads)
+                manifest = self.backend.manifest
+                self.extractor_version = EXTRACTOR_VERSION + self.backend.version_tag
+                logger.info(f"Inference backend: {self.backend.name}")
+            else:
+                manifest = read_bundle_manifest(self.model_path) if is_bundle(self.model_path) else load_manifest(self.model_path)
+                self.extractor_version = EXTRACTOR_VERSION + backend_class(self.model_path).version_tag_for(manifest)
+            
+            if is_bundle(self.model_path):
+                # Bundles carry the genres and the version of the model they were built from
+                self.genres = list(manifest['genres'])
+                self.model_version = manifest['model_version']
+                logger.info(f"Genres from model bundle: {self.genres}")
             else:
-                logger.info("FFmpeg found in system PATH")
+                # Load label encoder
+                with open(self.label_encoder_path, 'rb') as f:
+                    self.label_encoder = pickle.load(f)
                 
-        except Exception as e:
-            logger.warning(f"FFmpeg check failed: {str(e)}")
-    
-    def _load_model_and_encoder(self):
-        """Load the trained model and label encoder."""
-        try:
-            # Load the trained model (classifier only)
-            self.model = load_model(self.model_path)
-            logger.info(f"Model loaded successfully from {self.model_path}")
-            
-            # Load EfficientNetB0 feature extractor (frozen)
-            self.feature_extractor = EfficientNetB0(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
-            self.feature_extractor.trainable = False
-            logger.info("EfficientNetB0 feature extractor loaded successfully")
-            
-            # Load label encoder
-            with open(self.label_encoder_path, 'rb') as f:
-                self.label_encoder = pickle.load(f)
-            
-            self.genres = self.label_encoder.classes_.tolist()
-            logger.info(f"Label encoder loaded. Genres: {self.genres}")
+                self.genres = self.label_encoder.classes_.tolist()
+                logger.info(f"Label encoder loaded. Genres: {self.genres}")
+                
+                self.model_version = self._compute_model_version()
+            
+            if self.mood_head_path and os.path.exists(self.mood_head_path):
+                self.mood_head = MoodHead(self.mood_head_path)
+                self.moods = self.mood_head.moods
+                # Results now depend on the mood head too, so cached ones from another head must not match
+                self.model_version = f"{self.model_version}+mood-{self.mood_head.version}"
+                logger.info(f"Mood head loaded. Moods: {self.moods}")
+                trained_on = self.mood_head.metadata.get('extractor_version')
+                if trained_on and trained_on != EXTRACTOR_VERSION:
+                    logger.warning(f"Mood head was trained on {trained_on} embeddings, not {EXTRACTOR_VERSION}")
+            logger.info(f"Model version: {self.model_version}")
             
         except Exception as e:
             logger.error(f"Error loading model or encoder: {str(e)}")
             raise
     
-    def _convert_audio_with_ffmpeg(self, input_path: str, output_path: str) -> bool:
+    def _compute_model_version(self) -> str:
         """
-        Convert audio using FFmpeg directly.
+        Derive a short version identifier from the model and encoder file contents.
+        
+        Returns:
+            First 12 hex digits of a SHA-256 over both files
+        """
+        digest = hashlib.sha256()
+        for path in (self.model_path, self.label_encoder_path):
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        return digest.hexdigest()[:12]
+    
+    def _spectrogram_image(self, y: np.ndarray, sr: int) -> np.ndarray:
+        """
+        Convert audio samples to a mel spectrogram image for the model.
         
         Args:
-            input_path: Path to input audio file
-            output_path: Path to output WAV file
+            y: Mono audio samples
+            sr: Sample rate of the samples
             
         Returns:
-            True if successful, False otherwise
+            float32 image of shape (224, 224, 3) in the layout the model was trained on
         """
-        try:
-            # Check if FFmpeg is available
-            ffmpeg_path = which("ffmpeg") or shutil.which("ffmpeg")
-            if not ffmpeg_path:
-                # Try Windows-specific paths
-                possible_paths = [
-                    r"C:\ffmpeg\bin\ffmpeg.exe",
-                    r"C:\Program Files\ffmpeg\bin\ffmpeg.exe",
-                    r"C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe",
-                ]
-                for path in possible_paths:
-                    if os.path.exists(path):
-                        ffmpeg_path = path
-                        break
-                else:
-                    logger.warning("FFmpeg not found, cannot convert audio directly")
-                    return False
-            
-            # Use FFmpeg to convert to WAV
-            cmd = [
-                ffmpeg_path,
-                '-i', input_path,
-                '-acodec', 'pcm_s16le',
-                '-ar', '22050',
-                '-ac', '1',  # mono
-                '-y',  # overwrite output file
-                output_path
-            ]
-            
-            logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-            
-            if result.returncode == 0:
-                logger.info("FFmpeg conversion successful")
-                return True
-            else:
-                logger.error(f"FFmpeg conversion failed: {result.stderr}")
-                return False
-                
-        except subprocess.TimeoutExpired:
-            logger.error("FFmpeg conversion timed out")
-            return False
-        except Exception as e:
-            logger.error(f"FFmpeg conversion error: {str(e)}")
-            return False
+        with CLASSIFIER_STAGE_DURATION.labels(stage='spectrogram').time():
+            mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=N_MELS, fmax=FMAX, n_fft=N_FFT, hop_length=HOP_LENGTH)
+            return self._mel_image(mel_spec)
+    
+    def _mel_image(self, mel_spec: np.ndarray) -> np.ndarray:
+        """
+        Convert a mel power spectrogram to an image, in dB relative to its own maximum.
+        
+        Args:
+            mel_spec: Mel power spectrogram of shape (n_mels, frames)
+            
+        Returns:
+            float32 image of shape (224, 224, 3)
+        """
+        mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
+        return render_spectrogram(mel_spec_db, IMAGE_SIZE)
     
-    def _try_moviepy_conversion(self, input_path: str, output_path: str) -> bool:
+    def audio_to_melspectrogram(self, audio_path: str, duration: int = 30) -> np.ndarray:
         """
-        Try to convert audio using moviepy.
+        Convert audio file to mel spectrogram and extract features.
         
         Args:
-            input_path: Path to input file
-            output_path: Path to output WAV file
+            audio_path: Path to audio file
+            duration: Duration in seconds to analyze
             
         Returns:
-            True if successful, False otherwise
+            Extracted features from EfficientNetB0 as numpy array
         """
         try:
-            import moviepy.editor as mp
-            logger.info("Using moviepy for audio conversion...")
+            # Load audio file
+            y = self.load_audio(audio_path, duration=duration)
             
-            # Determine if it's a video or audio file
-            file_ext = os.path.splitext(input_path)[1].lower()
+            # Render mel spectrogram image and extract features using EfficientNetB0
+            _, features = self.predict_images(self._spectrogram_image(y, SAMPLE_RATE)[np.newaxis], return_features=True)
             
-            if file_ext in ['.mp4', '.webm', '.avi', '.mkv', '.mov']:
-                # Video file
-                video = mp.VideoFileClip(input_path)
-                audio = video.audio
-                
-                if audio is None:
-                    video.close()
-                    logger.error("No audio stream found in video file")
-                    return False
+            return features
                 
-                # Write audio to WAV
-                audio.write_audiofile(output_path, verbose=False, logger=None)
-                audio.close()
-                video.close()
-                
-            else:
-                # Audio file
-                audio = mp.AudioFileClip(input_path)
-                audio.write_audiofile(output_path, verbose=False, logger=None)
-                audio.close()
-            
-            logger.info("moviepy conversion successful")
-            return True
-            
-        except ImportError:
-            logger.warning("moviepy not available")
-            return False
         except Exception as e:
-            logger.error(f"moviepy conversion failed: {str(e)}")
-            return False
+            logger.error(f"Error creating mel spectrogram: {str(e)}")
+            raise
     
-    def _try_pydub_conversion(self, input_path: str, output_path: str) -> bool:
+    def predict_images(self, images: np.ndarray, max_batch_size: Optional[int] = None,
+                       return_features: bool = False):
         """
-        Try to convert audio using pydub.
+        Run the feature extractor and classifier head on a stack of images.
+        
+        Images are processed in chunks of at most max_batch_size, with one
+        extractor call and one head call per chunk, which keeps Keras call
+        overhead per track constant instead of per segment. With a fused
+        export each chunk is a single runtime call.
         
         Args:
-            input_path: Path to input file
-            output_path: Path to output WAV file
+            images: float32 array of shape (N, 224, 224, 3) from _spectrogram_image
+            max_batch_size: Largest chunk to run at once (default: MAX_INFERENCE_BATCH_SIZE)
+            return_features: Also return the EfficientNetB0 embeddings
             
         Returns:
-            True if successful, False otherwise
+            Genre probabilities of shape (N, num_genres), or a (probabilities, features)
+            tuple when return_features is set
         """
-        try:
-            from pydub import AudioSegment
-            logger.info("Using pydub for audio conversion...")
-            
-            # Try to load the audio file
-            audio_segment = AudioSegment.from_file(input_path)
-            
-            # Export to WAV
-            audio_segment.export(output_path, format='wav')
-            
-            logger.info("pydub conversion successful")
-            return True
-            
-        except Exception as e:
-            logger.error(f"pydub conversion failed: {str(e)}")
-            return False
+        batch_size = max(1, max_batch_size or MAX_INFERENCE_BATCH_SIZE)
+        probabilities = []
+        all_features = []
+        for start in range(0, len(images), batch_size):
+            batch_probabilities, features = self.backend.predict(images[start:start + batch_size])
+            probabilities.append(batch_probabilities)
+            if return_features:
+                all_features.append(features)
+        
+        probabilities = np.concatenate(probabilities, axis=0)
+        if return_features:
+            return probabilities, np.concatenate(all_features, axis=0)
+        return probabilities
     
-    def _convert_to_wav(self, input_path: str) -> str:
+    def predict_from_features(self, features: np.ndarray, max_batch_size: Optional[int] = None) -> np.ndarray:
         """
-        Convert audio file to WAV format using multiple methods.
+        Run only the classifier head on precomputed EfficientNetB0 embeddings.
         
         Args:
-            input_path: Path to input audio file
+            features: Embeddings as returned by predict_images(..., return_features=True)
+            max_batch_size: Largest chunk to run at once (default: MAX_INFERENCE_BATCH_SIZE)
             
         Returns:
-            Path to converted WAV file
-        """
-        # Create temporary WAV file
-        temp_wav = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
-        output_path = temp_wav.name
-        temp_wav.close()
-        
-        # Try multiple conversion methods
-        conversion_methods = [
-            ("FFmpeg", self._convert_audio_with_ffmpeg),
-            ("moviepy", self._try_moviepy_conversion),
-            ("pydub", self._try_pydub_conversion),
+            Genre probabilities of shape (N, num_genres)
+        """
+        batch_size = max(1, max_batch_size or MAX_INFERENCE_BATCH_SIZE)
+        probabilities = [
+            self.backend.predict_head(features[start:start + batch_size])
+            for start in range(0, len(features), batch_size)
         ]
+        return np.concatenate(probabilities, axis=0)
+    
+    def warm_up(self, batch_sizes: Tuple[int, ...] = (1,)) -> float:
+        """
+        Run a dummy segment through the whole pipeline once.
         
-        for method_name, method_func in conversion_methods:
-            logger.info(f"Attempting conversion with {method_name}...")
-            try:
-                if method_func(input_path, output_path):
-                    # Verify the output file exists and is valid
-                    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                        logger.info(f"Successfully converted audio using {method_name}")
-                        return output_path
-                    else:
-                        logger.warning(f"{method_name} produced empty or invalid output")
-            except Exception as e:
-                logger.error(f"{method_name} conversion failed with exception: {str(e)}")
+        The first call pays for librosa's JIT compilation and for tracing the
+        Keras predict functions; doing it here keeps that out of real requests.
         
-        # If all methods failed, clean up and raise exception
-        try:
-            os.unlink(output_path)
-        except:
-            pass
+        Args:
+            batch_sizes: Batch sizes to run through the extractor and head
+            
+        Returns:
+            Time taken in seconds
+        """
+        started = time.perf_counter()
         
-        raise Exception("All audio conversion methods failed")
+        # Quiet noise rather than silence, so power_to_db has a real reference level
+        y = (np.random.default_rng(0).standard_normal(SAMPLE_RATE) * 0.01).astype(np.float32)
+        image = self._spectrogram_image(y, SAMPLE_RATE)
+        for batch_size in sorted(set(batch_sizes)):
+            images = np.repeat(image[np.newaxis], batch_size, axis=0)
+            _, features = self.predict_images(images, max_batch_size=batch_size, return_features=True)
+            if self.mood_head is not None:
+                # Also checks that the head was trained on embeddings of this shape
+                self.mood_head.predict(features)
+        
+        elapsed = time.perf_counter() - started
+        logger.info(f"Classifier warmed up in {elapsed:.2f}s (batch sizes {sorted(set(batch_sizes))})")
+        return elapsed
     
-    def audio_to_melspectrogram(self, audio_path: str, duration: int = 30) -> np.ndarray:
+    def _segment_result(self, probabilities: np.ndarray, start_time: float, duration: float,
+                        mood_probabilities: Optional[np.ndarray] = None) -> Dict:
         """
-        Convert audio file to mel spectrogram and extract features.
+        Build the prediction dictionary for one segment.
         
         Args:
-            audio_path: Path to audio file
-            duration: Duration in seconds to analyze
+            probabilities: Genre probabilities for the segment
+            start_time: Start time of the segment in seconds
+            duration: Duration of the segment in seconds
+            mood_probabilities: Mood probabilities for the segment, if a mood head is loaded
             
         Returns:
-            Extracted features from EfficientNetB0 as numpy array
+            Dictionary with prediction results
         """
-        try:
-            # Load audio file
-            y, sr = librosa.load(audio_path, duration=duration, sr=22050)
-            
-            # Generate mel spectrogram
-            mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=128, fmax=8000)
-            mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
+        predicted_class = int(np.argmax(probabilities))
+        
+        result = {
+            'predicted_genre': self.genres[predicted_class],
+            'confidence': float(probabilities[predicted_class]),
+            'start_time': start_time,
+            'duration': duration,
+            'genre_probabilities': {
+                genre: float(prob) for genre, prob in zip(self.genres, probabilities)
+            }
+        }
+        if mood_probabilities is not None:
+            predicted_mood = int(np.argmax(mood_probabilities))
+            result['predicted_mood'] = self.moods[predicted_mood]
+            result['mood_confidence'] = float(mood_probabilities[predicted_mood])
+            result['mood_probabilities'] = {
+                mood: float(prob) for mood, prob in zip(self.moods, mood_probabilities)
+            }
+        return result
+    
+    def _predict_segments(self, predict: PredictFn, images: np.ndarray, return_embeddings: bool = False):
+        """
+        Run a batch of segment images through the model, scoring mood on the same embeddings.
+        
+        Args:
+            predict: predict_images or a function with the same contract
+            images: float32 array of shape (N, 224, 224, 3)
+            return_embeddings: Return the embeddings even without a mood head
             
-            # Create image from spectrogram
-            fig = plt.figure(figsize=(10, 4))
-            plt.imshow(mel_spec_db, aspect='auto', origin='lower', cmap='viridis')
-            plt.axis('off')
-            plt.tight_layout()
+        Returns:
+            Tuple of genre probabilities, mood probabilities (None without a mood head)
+            and embeddings (None unless needed)
+        """
+        if self.mood_head is None and not return_embeddings:
+            return predict(images), None, None
+        probabilities, features = predict(images, return_features=True)
+        mood_probabilities = self.mood_head.predict(features) if self.mood_head is not None else None
+        return probabilities, mood_probabilities, features
+    
+    def load_audio(self, audio_path: str, offset: float = 0.0, duration: Optional[float] = None) -> np.ndarray:
+        """
+        Decode an audio file once into mono samples at the model sample rate.
+        
+        MP3, WAV, FLAC and OGG are read by librosa. Other formats, and files
+        librosa fails on, are decoded by FFmpeg straight into memory.
+        
+        Args:
+            audio_path: Path to audio file
+            offset: Start time in seconds
+            duration: Seconds to decode from offset (default: to the end)
             
-            # Save to temporary file and read as image
-            tmp_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-            tmp_file_path = tmp_file.name
-            tmp_file.close()  # Close the file handle immediately
+        Returns:
+            float32 mono samples at SAMPLE_RATE
+        """
+        with CLASSIFIER_STAGE_DURATION.labels(stage='decode').time():
+            librosa_error = None
+            if Path(audio_path).suffix.lower() in NATIVE_AUDIO_FORMATS or not ffmpeg_available():
+                try:
+                    y, _ = librosa.load(audio_path, sr=SAMPLE_RATE, mono=True, offset=offset, duration=duration)
+                    if len(y) == 0:
+                        raise Exception("Audio file appears to be empty or corrupted")
+                    logger.info(f"Successfully loaded audio with librosa: {len(y) / SAMPLE_RATE:.2f} seconds")
+                    return y
+                except Exception as e:
+                    logger.warning(f"Librosa failed to load {audio_path}: {str(e)}")
+                    librosa_error = e
             
             try:
-                plt.savefig(tmp_file_path, bbox_inches='tight', pad_inches=0, dpi=100)
-                plt.close(fig)  # Explicitly close the figure
-                
-                # Load image and resize
-                img = cv2.imread(tmp_file_path)
-                if img is None:
-                    raise Exception("Failed to load generated spectrogram image")
-                img = cv2.resize(img, (224, 224))
-                
-                # Preprocess for EfficientNetB0
-                img_array = np.array([img.astype('float32')])
-                img_array = preprocess_input(img_array)
-                
-                # Extract features using EfficientNetB0
-                features = self.feature_extractor.predict(img_array, verbose=0)
-                
-                return features
-                
-            finally:
-                # Clean up - now safe to delete on Windows
-                try:
-                    os.unlink(tmp_file_path)
-                except OSError:
-                    pass  # Ignore if file doesn't exist or can't be deleted
-                
-        except Exception as e:
-            logger.error(f"Error creating mel spectrogram: {str(e)}")
-            raise
+                y = decode_audio(audio_path, SAMPLE_RATE, offset, duration)
+                if len(y) == 0:
+                    raise Exception("Decoded audio appears to be empty")
+                logger.info(f"Successfully decoded audio with FFmpeg: {len(y) / SAMPLE_RATE:.2f} seconds")
+                return y
+            except Exception as ffmpeg_error:
+                logger.error(f"FFmpeg decoding failed: {str(ffmpeg_error)}")
+                if librosa_error is None:
+                    raise Exception(f"Cannot read audio file: {str(ffmpeg_error)}")
+                raise Exception(f"Cannot read audio file. Librosa error: {str(librosa_error)}, FFmpeg error: {str(ffmpeg_error)}")
     
-    def predict_genre_from_audio_segment(self, audio_path: str, start_time: int = 0, duration: int = 30) -> Dict:
+    def predict_genre_from_samples(self, y: np.ndarray, start_time: float = 0, duration: float = 30,
+                                   predict_fn: Optional[PredictFn] = None) -> Dict:
+        """
+        Predict genre from already decoded audio samples.
+        
+        Args:
+            y: Mono samples at SAMPLE_RATE
+            start_time: Start time of the samples within the track, in seconds
+            duration: Duration reported for the segment, in seconds
+            predict_fn: Inference function to use instead of predict_images, e.g. InferenceScheduler.predict
+            
+        Returns:
+            Dictionary with prediction results
+        """
+        if len(y) == 0:
+            raise Exception("Could not load audio segment - segment appears to be empty")
+        
+        image = self._spectrogram_image(y, SAMPLE_RATE)
+        probabilities, mood_probabilities, _ = self._predict_segments(predict_fn or self.predict_images, image[np.newaxis])
+        result = self._segment_result(
+            probabilities[0], start_time, duration, mood_probabilities[0] if mood_probabilities is not None else None
+        )
+        result['model_version'] = self.model_version
+        return result
+    
+    def predict_genre_from_audio_segment(self, audio_path: str, start_time: int = 0, duration: int = 30,
+                                         predict_fn: Optional[PredictFn] = None) -> Dict:
         """
         Predict genre from a specific audio segment.
         
+        Only the requested range is decoded, so this is the cheapest way to
+        classify a single segment. Use classify_full_track for whole tracks.
+        
         Args:
             audio_path: Path to audio file
             start_time: Start time in seconds
             duration: Duration in seconds
+            predict_fn: Inference function to use instead of predict_images
             
         Returns:
             Dictionary with prediction results
         """
         try:
-            # Use librosa to load audio segment directly (more reliable than pydub)
+            # Decode only the requested range
             try:
-                y, sr = librosa.load(audio_path, sr=22050, offset=start_time, duration=duration)
-                if len(y) == 0:
-                    raise Exception("Could not load audio segment - segment appears to be empty")
+                y = self.load_audio(audio_path, offset=start_time, duration=duration)
             except Exception as e:
                 logger.error(f"Failed to load audio segment from {audio_path}: {str(e)}")
                 raise Exception(f"Cannot read audio segment. The file might be corrupted or in an unsupported format: {str(e)}")
             
-            # Create mel spectrogram directly from the audio data
-            mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=128, fmax=8000)
-            mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
-            
-            # Create image from spectrogram
-            fig = plt.figure(figsize=(10, 4))
-            plt.imshow(mel_spec_db, aspect='auto', origin='lower', cmap='viridis')
-            plt.axis('off')
-            plt.tight_layout()
-            
-            # Save to temporary file and read as image
-            tmp_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-            tmp_file_path = tmp_file.name
-            tmp_file.close()  # Close the file handle immediately
-            
-            try:
-                plt.savefig(tmp_file_path, bbox_inches='tight', pad_inches=0, dpi=100)
-                plt.close(fig)  # Explicitly close the figure
-                
-                # Load image and resize
-                img = cv2.imread(tmp_file_path)
-                if img is None:
-                    raise Exception("Failed to load generated spectrogram image")
-                img = cv2.resize(img, (224, 224))
-                
-                # Preprocess for EfficientNetB0
-                img_array = np.array([img.astype('float32')])
-                img_array = preprocess_input(img_array)
-                
-                # Extract features using EfficientNetB0
-                features = self.feature_extractor.predict(img_array, verbose=0)
-                
-                # Predict using the trained classifier
-                predictions = self.model.predict(features, verbose=0)
-                predicted_class = np.argmax(predictions[0])
-                confidence = float(predictions[0][predicted_class])
-                predicted_genre = self.genres[predicted_class]
-                
-                # Get all probabilities
-                genre_probabilities = {
-                    genre: float(prob) for genre, prob in zip(self.genres, predictions[0])
-                }
-                
-                return {
-                    'predicted_genre': predicted_genre,
-                    'confidence': confidence,
-                    'start_time': start_time,
-                    'duration': duration,
-                    'genre_probabilities': genre_probabilities
-                }
-                
-            finally:
-                # Clean up - now safe to delete on Windows
-                try:
-                    os.unlink(tmp_file_path)
-                except OSError:
-                    pass  # Ignore if file doesn't exist or can't be deleted
+            return self.predict_genre_from_samples(y, start_time, duration, predict_fn)
                 
         except Exception as e:
             logger.error(f"Error predicting genre from segment: {str(e)}")
             raise
     
-    def classify_full_track(self, audio_path: str, segment_duration: int = 30) -> Dict:
+    def _segment_start_times(self, total_duration: float, segment_duration: int,
+                             max_segments: Optional[int] = None,
+                             segment_hop: Optional[float] = None) -> Tuple[List[float], int]:
+        """
+        Work out which segments of a track to analyze.
+        
+        Args:
+            total_duration: Track duration in seconds
+            segment_duration: Requested segment duration in seconds
+            max_segments: Keep at most this many segments, evenly spaced over the track (0 or None: no cap)
+            segment_hop: Seconds between segment starts; shorter than segment_duration for overlapping
+                windows (default: segment_duration)
+            
+        Returns:
+            Tuple of (segment start times, effective segment duration)
+        """
+        # Calculate number of segments
+        num_segments = max(1, int(total_duration // segment_duration))
+        
+        # If track is shorter than segment_duration, use the whole track
+        if total_duration < segment_duration:
+            segment_duration = int(total_duration)
+            num_segments = 1
+        
+        start_times = []
+        if segment_hop and segment_hop < segment_duration and total_duration >= segment_duration:
+            # Overlapping windows, the last one ending at or before the end of the track
+            num_segments = int((total_duration - segment_duration) // segment_hop) + 1
+            start_times = [round(i * segment_hop, 3) for i in range(num_segments)]
+        else:
+            for i in range(num_segments):
+                start_time = i * segment_duration
+                
+                # Ensure we don't go beyond track duration
+                if start_time + segment_duration > total_duration:
+                    start_time = max(0, total_duration - segment_duration)
+                start_times.append(start_time)
+        
+        if max_segments and len(start_times) > max_segments:
+            keep = np.unique(np.linspace(0, len(start_times) - 1, max_segments).round().astype(int))
+            start_times = [start_times[i] for i in keep]
+        
+        return start_times, segment_duration
+    
+    def _shared_melspectrogram(self, y: np.ndarray, num_segments: int, segment_duration: int,
+                               segment_hop: Optional[float]) -> Optional[TrackMelSpectrogram]:
+        """Overlapping windows share STFT frames, so compute them once for the track; None without overlap."""
+        if segment_hop and segment_hop < segment_duration and num_segments > 1:
+            return TrackMelSpectrogram(y, SAMPLE_RATE)
+        return None
+    
+    def _segment_image(self, y: np.ndarray, start_time: float, segment_duration: int,
+                       track_mel: Optional[TrackMelSpectrogram] = None) -> np.ndarray:
+        """
+        Render the image of one segment of a decoded track.
+        
+        Args:
+            y: Mono samples of the whole track at SAMPLE_RATE
+            start_time: Segment start in seconds
+            segment_duration: Segment duration in seconds; 0 uses the whole track
+            track_mel: Shared spectrogram to cut the segment from, see _shared_melspectrogram
+            
+        Returns:
+            float32 image of shape (224, 224, 3)
+        """
+        # Slice a view of the decoded track, no copy or re-decode
+        start_sample = int(round(start_time * SAMPLE_RATE))
+        end_sample = start_sample + int(segment_duration * SAMPLE_RATE)
+        segment = y[start_sample:end_sample] if segment_duration > 0 else y
+        if track_mel is not None:
+            with CLASSIFIER_STAGE_DURATION.labels(stage='spectrogram').time():
+                return self._mel_image(track_mel.window(start_sample, len(segment)))
+        return self._spectrogram_image(segment, SAMPLE_RATE)
+    
+    def _spread_order(self, count: int) -> List[int]:
+        """
+        Order segment indices so that every prefix is spread over the whole track.
+        
+        Positions are visited as 1/2, 1/4, 3/4, 1/8, 3/8, ... of the track, so the
+        first few segments already sample its start, middle and end.
+        
+        Args:
+            count: Number of segments
+            
+        Returns:
+            Permutation of range(count)
+        """
+        order = []
+        seen = set()
+        denominator = 1
+        while len(order) < count:
+            denominator *= 2
+            for numerator in range(1, denominator, 2):
+                index = min(count - 1, int(numerator * count / denominator))
+                if index not in seen:
+                    seen.add(index)
+                    order.append(index)
+        return order
+    
+    def _outcome_decided(self, probabilities: np.ndarray, remaining: int,
+                         min_segments: int = ADAPTIVE_MIN_SEGMENTS,
+                         confidence: float = ADAPTIVE_CONFIDENCE) -> bool:
+        """
+        Check whether the segments classified so far decide the track's genre.
+        
+        The leader is decided when the remaining segments cannot overturn its
+        vote lead, or, after min_segments, when either its vote lead over the
+        runner-up passes a one-sided sign test or the lower confidence bound of
+        its mean probability margin over the runner-up (Student's t) is above 0.
+        
+        Args:
+            probabilities: Genre probabilities of the segments classified so far, shape (k, num_genres)
+            remaining: Segments not classified yet
+            min_segments: Segments needed before the statistical tests apply
+            confidence: One-sided confidence level of the tests
+            
+        Returns:
+            True if classifying more segments is not expected to change the outcome
+        """
+        num_classified = len(probabilities)
+        votes = np.bincount(probabilities.argmax(axis=1), minlength=probabilities.shape[1])
+        # Rank by votes, then by mean probability, so the runner-up is meaningful even without votes
+        leader, runner_up = np.lexsort((-probabilities.mean(axis=0), -votes))[:2]
+        
+        if votes[leader] > votes[runner_up] + remaining:
+            return True
+        if num_classified < max(2, min_segments) or votes[leader] == votes[runner_up]:
+            return False
+        
+        # Imported here, scipy.stats alone takes about a second to import
+        from scipy.stats import binom, t as student_t
+        
+        # Sign test: how likely is this lead if both genres were equally likely per segment
+        lead_votes = int(votes[leader] + votes[runner_up])
+        if binom.sf(votes[leader] - 1, lead_votes, 0.5) <= 1 - confidence:
+            return True
+        
+        margins = probabilities[:, leader] - probabilities[:, runner_up]
+        standard_error = margins.std(ddof=1) / np.sqrt(num_classified)
+        lower_bound = margins.mean() - student_t.ppf(confidence, num_classified - 1) * standard_error
+        return bool(lower_bound > 0)
+    
+    def _build_track_result(self, segment_predictions: List[Dict], total_duration: float,
+                            segment_duration: int, num_candidate_segments: Optional[int] = None) -> Dict:
+        """
+        Combine segment predictions into the full track result by majority vote.
+        
+        Args:
+            segment_predictions: Results of _segment_result, in track order
+            total_duration: Track duration in seconds
+            segment_duration: Effective segment duration in seconds
+            num_candidate_segments: Segments that could have been analyzed (default: all were)
+            
+        Returns:
+            Dictionary with overall prediction and segment details
+        """
+        num_segments = len(segment_predictions)
+        genre_votes = {genre: 0 for genre in self.genres}
+        total_confidence = 0
+        for segment_result in segment_predictions:
+            genre_votes[segment_result['predicted_genre']] += 1
+            total_confidence += segment_result['confidence']
+        
+        # Determine overall genre by majority vote
+        predicted_genre = max(genre_votes, key=genre_votes.get)
+        average_confidence = total_confidence / num_segments
+        
+        # Calculate genre distribution
+        genre_distribution = {
+            genre: votes / num_segments for genre, votes in genre_votes.items()
+        }
+        
+        result = {
+            'overall_prediction': {
+                'predicted_genre': predicted_genre,
+                'confidence': average_confidence,
+                'genre_distribution': genre_distribution
+            },
+            'track_info': {
+                'duration': total_duration,
+                'num_segments_analyzed': num_segments,
+                'num_segments_total': num_candidate_segments or num_segments,
+                'early_exit': num_segments < (num_candidate_segments or num_segments),
+                'segment_duration': segment_duration
+            },
+            'segment_predictions': segment_predictions,
+            'genre_votes': genre_votes,
+            'model_version': self.model_version
+        }
+        
+        # Mood by the same majority vote, over the same segments
+        if segment_predictions and 'predicted_mood' in segment_predictions[0]:
+            mood_votes = {mood: 0 for mood in self.moods}
+            for segment_result in segment_predictions:
+                mood_votes[segment_result['predicted_mood']] += 1
+            result['mood_prediction'] = {
+                'predicted_mood': max(mood_votes, key=mood_votes.get),
+                'confidence': sum(segment_result['mood_confidence'] for segment_result in segment_predictions) / num_segments,
+                'mood_distribution': {mood: votes / num_segments for mood, votes in mood_votes.items()}
+            }
+            result['mood_votes'] = mood_votes
+        return result
+    
+    def classify_full_track(self, audio_path: str, segment_duration: int = 30,
+                            max_batch_size: Optional[int] = None,
+                            predict_fn: Optional[PredictFn] = None,
+                            return_embeddings: bool = False,
+                            on_segment: Optional[Callable[[Dict], None]] = None,
+                            adaptive: bool = False,
+                            max_segments: Optional[int] = None,
+                            segment_hop: Optional[float] = None,
+                            streaming: Optional[bool] = None) -> Dict:
         """
         Classify genre of full track by analyzing multiple segments.
         
+        The file is decoded once and every segment is a view into that buffer.
+        Segment images are run through the model in batches of up to
+        max_batch_size, which also bounds memory on very long tracks.
+        
+        In adaptive mode segments are classified in an order spread over the
+        whole track, starting with ADAPTIVE_MIN_SEGMENTS of them, and analysis
+        stops as soon as _outcome_decided says the remaining segments would not
+        change the genre. track_info reports how many segments were used.
+        
+        With a segment_hop shorter than segment_duration the windows overlap.
+        The mel spectrogram is then computed once for the track and every
+        window is cut from its frames; each window is still normalized to its
+        own maximum, as when it is computed alone.
+        
+        Tracks of at least STREAMING_MIN_DURATION seconds are not decoded
+        whole: classify_track_streaming decodes them block by block, and in
+        adaptive mode each visited segment is decoded on its own, so memory
+        does not grow with the track length.
+        
         Args:
             audio_path: Path to audio file
             segment_duration: Duration of each segment in seconds
+            max_batch_size: Segments per forward pass (default: MAX_INFERENCE_BATCH_SIZE)
+            predict_fn: Inference function to use instead of predict_images, e.g. InferenceScheduler.predict
+            return_embeddings: Add the per-segment EfficientNetB0 embeddings under 'segment_embeddings'
+            on_segment: Called with each segment prediction as soon as its batch finishes
+            adaptive: Stop early once the genre is statistically decided
+            max_segments: Hard cap on analyzed segments (default: MAX_SEGMENTS_PER_TRACK, 0: no cap)
+            segment_hop: Seconds between segment starts (default: segment_duration, no overlap)
+            streaming: Decode in blocks instead of all at once (default: for tracks of at
+                least STREAMING_MIN_DURATION seconds)
             
         Returns:
             Dictionary with overall prediction and segment details
@@ -443,100 +688,324 @@ class MusicGenreClassifier:
             if not os.path.exists(audio_path):
                 raise Exception(f"Audio file not found: {audio_path}")
             
-            temp_wav_cleanup = None  # Track if we need to cleanup a temp WAV file
-            
-            # Get audio duration using librosa with better error handling
-            try:
-                # Try loading with librosa first
-                y, sr = librosa.load(audio_path, sr=None)
-                if len(y) == 0:
-                    raise Exception("Audio file appears to be empty or corrupted")
-                total_duration = len(y) / sr  # Convert to seconds
-                logger.info(f"Successfully loaded audio with librosa: {total_duration:.2f} seconds")
-            except Exception as librosa_error:
-                logger.warning(f"Librosa failed to load {audio_path}: {str(librosa_error)}")
-                
-                # If librosa fails, try converting to WAV first
-                try:
-                    logger.info("Converting audio to WAV format...")
-                    temp_wav_path = self._convert_to_wav(audio_path)
-                    temp_wav_cleanup = temp_wav_path
-                    audio_path = temp_wav_path
-                    
-                    # Now try librosa again
-                    y, sr = librosa.load(audio_path, sr=None)
-                    total_duration = len(y) / sr
-                    logger.info(f"Successfully loaded converted audio: {total_duration:.2f} seconds")
-                    
-                except Exception as conversion_error:
-                    logger.error(f"Audio conversion failed: {str(conversion_error)}")
-                    raise Exception(f"Cannot read audio file. Librosa error: {str(librosa_error)}, conversion error: {str(conversion_error)}")
+            y = None
+            total_duration = audio_duration(audio_path) if streaming or streaming is None else None
+            if streaming is None:
+                streaming = 0 < STREAMING_MIN_DURATION <= (total_duration or 0)
+            if streaming and (not adaptive or total_duration is None):
+                return self.classify_track_streaming(
+                    audio_path, segment_duration, max_batch_size=max_batch_size, predict_fn=predict_fn,
+                    return_embeddings=return_embeddings, on_segment=on_segment, max_segments=max_segments,
+                    segment_hop=segment_hop, total_duration=total_duration
+                )
+            if not streaming:
+                y = self.load_audio(audio_path)
+                total_duration = len(y) / SAMPLE_RATE  # Convert to seconds
             
             logger.info(f"Analyzing track with duration: {total_duration:.2f} seconds")
             
-            # Calculate number of segments
-            num_segments = max(1, int(total_duration // segment_duration))
-            
-            # If track is shorter than segment_duration, use the whole track
-            if total_duration < segment_duration:
-                segment_duration = int(total_duration)
-                num_segments = 1
-            
-            segment_predictions = []
-            genre_votes = {genre: 0 for genre in self.genres}
-            total_confidence = 0
-            
-            # Analyze each segment
-            for i in range(num_segments):
-                start_time = i * segment_duration
+            if max_segments is None:
+                max_segments = MAX_SEGMENTS_PER_TRACK
+            start_times, segment_duration = self._segment_start_times(
+                total_duration, segment_duration, max_segments, segment_hop
+            )
+            num_segments = len(start_times)
+            
+            # Without y, adaptive analysis of a long track decodes only the segments it visits
+            track_mel = self._shared_melspectrogram(y, num_segments, segment_duration, segment_hop) if y is not None else None
+            
+            segment_predictions = {}
+            segment_embeddings = {}
+            segment_probabilities = []
+            
+            # Analyze segments one batch at a time
+            batch_size = max(1, max_batch_size or MAX_INFERENCE_BATCH_SIZE)
+            predict = predict_fn or partial(self.predict_images, max_batch_size=batch_size)
+            images = np.empty((min(batch_size, num_segments), *IMAGE_SIZE, 3), dtype=np.float32)
+            order = self._spread_order(num_segments) if adaptive else list(range(num_segments))
+            position = 0
+            while position < num_segments:
+                if adaptive:
+                    # Start with a few segments, then grow the batches by half of what has been seen
+                    step = max(ADAPTIVE_MIN_SEGMENTS, 1) if position == 0 else max(1, position // 2)
+                    batch_indices = order[position:position + min(step, batch_size)]
+                else:
+                    batch_indices = order[position:position + batch_size]
+                position += len(batch_indices)
                 
-                # Ensure we don't go beyond track duration
-                if start_time + segment_duration > total_duration:
-                    start_time = max(0, total_duration - segment_duration)
+                for j, index in enumerate(batch_indices):
+                    if y is None:
+                        segment = self.load_audio(audio_path, offset=start_times[index], duration=segment_duration)
+                        images[j] = self._segment_image(segment, 0, segment_duration)
+                    else:
+                        images[j] = self._segment_image(y, start_times[index], segment_duration, track_mel)
                 
-                segment_result = self.predict_genre_from_audio_segment(
-                    audio_path, start_time, segment_duration
+                probabilities, mood_probabilities, features = self._predict_segments(
+                    predict, images[:len(batch_indices)], return_embeddings
                 )
+                if return_embeddings:
+                    segment_embeddings.update(zip(batch_indices, features))
+                segment_probabilities.extend(probabilities)
+                if mood_probabilities is None:
+                    mood_probabilities = [None] * len(batch_indices)
+                
+                for index, probs, mood_probs in zip(batch_indices, probabilities, mood_probabilities):
+                    segment_result = self._segment_result(probs, start_times[index], segment_duration, mood_probs)
+                    segment_predictions[index] = segment_result
+                    if on_segment is not None:
+                        on_segment(segment_result)
                 
-                segment_predictions.append(segment_result)
-                genre_votes[segment_result['predicted_genre']] += 1
-                total_confidence += segment_result['confidence']
+                if adaptive and position < num_segments and self._outcome_decided(
+                        np.stack(segment_probabilities), num_segments - position):
+                    logger.info(f"Genre decided after {position} of {num_segments} segments")
+                    break
+            
+            # Report the analyzed segments in track order
+            analyzed = sorted(segment_predictions)
+            result = self._build_track_result(
+                [segment_predictions[i] for i in analyzed], total_duration, segment_duration, num_segments
+            )
+            if return_embeddings:
+                result['segment_embeddings'] = np.stack([segment_embeddings[i] for i in analyzed])
+            return result
             
-            # Determine overall genre by majority vote
-            predicted_genre = max(genre_votes, key=genre_votes.get)
-            average_confidence = total_confidence / num_segments
+        except Exception as e:
+            logger.error(f"Error classifying full track: {str(e)}")
+            raise
+    
+    def classify_track_streaming(self, audio_path: str, segment_duration: int = 30,
+                                 max_batch_size: Optional[int] = None,
+                                 predict_fn: Optional[PredictFn] = None,
+                                 return_embeddings: bool = False,
+                                 on_segment: Optional[Callable[[Dict], None]] = None,
+                                 max_segments: Optional[int] = None,
+                                 segment_hop: Optional[float] = None,
+                                 block_seconds: Optional[float] = None,
+                                 total_duration: Optional[float] = None) -> Dict:
+        """
+        Classify a track while decoding it, holding only one segment of audio at a time.
+        
+        The track is decoded in blocks of block_seconds into a ring buffer of
+        one segment plus one block. A segment is rendered as soon as the buffer
+        covers it and is classified with the next full batch, so
+        segment_predictions arrive through on_segment while the rest of the
+        track is still being decoded. Samples before the next segment start are
+        dropped, and decoding stops after the last segment. Memory stays the
+        same whatever the track length.
+        
+        The segment start times are those of classify_full_track, worked out
+        from the duration in the file header. When the header has no duration,
+        every window of the track is analyzed (max_segments does not apply).
+        Overlapping windows each get their own spectrogram.
+        
+        Args:
+            audio_path: Path to audio file
+            segment_duration: Duration of each segment in seconds
+            max_batch_size: Segments per forward pass (default: MAX_INFERENCE_BATCH_SIZE)
+            predict_fn: Inference function to use instead of predict_images, e.g. InferenceScheduler.predict
+            return_embeddings: Add the per-segment EfficientNetB0 embeddings under 'segment_embeddings'
+            on_segment: Called with each segment prediction as soon as its batch finishes
+            max_segments: Hard cap on analyzed segments (default: MAX_SEGMENTS_PER_TRACK, 0: no cap)
+            segment_hop: Seconds between segment starts (default: segment_duration, no overlap)
+            block_seconds: Audio decoded at a time (default: STREAMING_BLOCK_SECONDS)
+            total_duration: Track duration if already known (default: read from the file header)
             
-            # Calculate genre distribution
-            genre_distribution = {
-                genre: votes / num_segments for genre, votes in genre_votes.items()
-            }
+        Returns:
+            Same dictionary as classify_full_track
+        """
+        try:
+            if not os.path.exists(audio_path):
+                raise Exception(f"Audio file not found: {audio_path}")
             
-            return {
-                'overall_prediction': {
-                    'predicted_genre': predicted_genre,
-                    'confidence': average_confidence,
-                    'genre_distribution': genre_distribution
-                },
-                'track_info': {
-                    'duration': total_duration,
-                    'num_segments_analyzed': num_segments,
-                    'segment_duration': segment_duration
-                },
-                'segment_predictions': segment_predictions,
-                'genre_votes': genre_votes
-            }
+            if total_duration is None:
+                total_duration = audio_duration(audio_path)
+            if max_segments is None:
+                max_segments = MAX_SEGMENTS_PER_TRACK
+            if total_duration is not None:
+                logger.info(f"Streaming track with duration: {total_duration:.2f} seconds")
+                start_times, segment_duration = self._segment_start_times(
+                    total_duration, segment_duration, max_segments, segment_hop
+                )
+                pending = iter(start_times)
+                num_candidates = len(start_times)
+            else:
+                logger.warning(f"No duration in the header of {audio_path}; analyzing every window")
+                step = segment_hop if segment_hop and segment_hop < segment_duration else segment_duration
+                pending = (round(i * step, 3) for i in itertools.count())
+                num_candidates = None
+            
+            block_seconds = block_seconds or STREAMING_BLOCK_SECONDS
+            window = int(segment_duration * SAMPLE_RATE)
+            # One segment plus one block, and a second of slack for resampler output that runs over a block
+            buffer = SampleRingBuffer(max(window, SAMPLE_RATE) + int((block_seconds + 1) * SAMPLE_RATE))
+            
+            batch_size = max(1, max_batch_size or MAX_INFERENCE_BATCH_SIZE)
+            predict = predict_fn or partial(self.predict_images, max_batch_size=batch_size)
+            images = np.empty((batch_size, *IMAGE_SIZE, 3), dtype=np.float32)
+            batch_starts = []
+            segment_predictions = []
+            segment_embeddings = []
+            
+            def classify_batch():
+                probabilities, mood_probabilities, features = self._predict_segments(
+                    predict, images[:len(batch_starts)], return_embeddings
+                )
+                if return_embeddings:
+                    segment_embeddings.extend(features)
+                if mood_probabilities is None:
+                    mood_probabilities = [None] * len(batch_starts)
+                for start_time, probs, mood_probs in zip(batch_starts, probabilities, mood_probabilities):
+                    segment_result = self._segment_result(probs, start_time, segment_duration, mood_probs)
+                    segment_predictions.append(segment_result)
+                    if on_segment is not None:
+                        on_segment(segment_result)
+                batch_starts.clear()
+            
+            def add_segment(start_time: float, start_sample: int, end_sample: int):
+                images[len(batch_starts)] = self._spectrogram_image(buffer.read(start_sample, end_sample), SAMPLE_RATE)
+                batch_starts.append(start_time)
+                if len(batch_starts) == batch_size:
+                    classify_batch()
+            
+            next_start = next(pending, None)
+            decode_seconds = 0.0
+            blocks = stream_audio(audio_path, block_seconds)
+            try:
+                while next_start is not None:
+                    started = time.perf_counter()
+                    block = next(blocks, None)
+                    decode_seconds += time.perf_counter() - started
+                    if block is None:
+                        break
+                    buffer.append(block)
+                    
+                    # Render every segment the buffer now covers, then drop the samples before the next one
+                    while next_start is not None and window:
+                        start_sample = int(round(next_start * SAMPLE_RATE))
+                        if buffer.end < start_sample + window:
+                            break
+                        add_segment(next_start, start_sample, start_sample + window)
+                        next_start = next(pending, None)
+                        if next_start is not None:
+                            buffer.discard_until(int(round(next_start * SAMPLE_RATE)))
+            finally:
+                blocks.close()
+                CLASSIFIER_STAGE_DURATION.labels(stage='decode').observe(decode_seconds)
+            
+            if buffer.end == 0:
+                raise Exception("Audio file appears to be empty or corrupted")
+            if total_duration is None:
+                total_duration = buffer.end / SAMPLE_RATE
+                if not segment_predictions and not batch_starts:
+                    # Shorter than one segment: the whole track is the segment, as in _segment_start_times
+                    segment_duration = int(total_duration)
+                    add_segment(0, 0, int(segment_duration * SAMPLE_RATE) or buffer.end)
+            else:
+                # Segments the header promised but the stream ended within, cut short like in _segment_image
+                while next_start is not None:
+                    start_sample = int(round(next_start * SAMPLE_RATE))
+                    if start_sample < buffer.end:
+                        add_segment(next_start, start_sample, min(buffer.end, start_sample + window) if window else buffer.end)
+                    next_start = next(pending, None)
+            if batch_starts:
+                classify_batch()
+            if not segment_predictions:
+                raise Exception("Audio file appears to be empty or corrupted")
+            
+            result = self._build_track_result(segment_predictions, total_duration, segment_duration, num_candidates)
+            if return_embeddings:
+                result['segment_embeddings'] = np.stack(segment_embeddings)
+            return result
             
         except Exception as e:
-            logger.error(f"Error classifying full track: {str(e)}")
+            logger.error(f"Error streaming track: {str(e)}")
             raise
-        finally:
-            # Cleanup temporary WAV file if we created one
-            if temp_wav_cleanup and os.path.exists(temp_wav_cleanup):
-                try:
-                    os.unlink(temp_wav_cleanup)
-                    logger.info("Cleaned up temporary WAV file")
-                except:
-                    pass
+    
+    def prepare_track(self, audio_path: str, segment_duration: int = 30, max_segments: Optional[int] = None,
+                      segment_hop: Optional[float] = None) -> Dict:
+        """
+        Decode a track and render the images of all its segments, without running the model.
+        
+        Splits preprocessing from inference, so the two can run in different
+        processes; see app.tools.bulk_classify. Pass the probabilities of the
+        images to result_from_probabilities.
+        
+        Args:
+            audio_path: Path to audio file
+            segment_duration: Duration of each segment in seconds
+            max_segments: Hard cap on segments (default: MAX_SEGMENTS_PER_TRACK, 0: no cap)
+            segment_hop: Seconds between segment starts (default: segment_duration, no overlap)
+            
+        Returns:
+            Dictionary with 'images' (N, 224, 224, 3), 'start_times', 'segment_duration' and 'total_duration'
+        """
+        y = self.load_audio(audio_path)
+        total_duration = len(y) / SAMPLE_RATE
+        if max_segments is None:
+            max_segments = MAX_SEGMENTS_PER_TRACK
+        start_times, segment_duration = self._segment_start_times(
+            total_duration, segment_duration, max_segments, segment_hop
+        )
+        
+        track_mel = self._shared_melspectrogram(y, len(start_times), segment_duration, segment_hop)
+        images = np.empty((len(start_times), *IMAGE_SIZE, 3), dtype=np.float32)
+        for i, start_time in enumerate(start_times):
+            images[i] = self._segment_image(y, start_time, segment_duration, track_mel)
+        
+        return {
+            'images': images,
+            'start_times': start_times,
+            'segment_duration': segment_duration,
+            'total_duration': total_duration
+        }
+    
+    def result_from_probabilities(self, probabilities: np.ndarray, start_times: List[float],
+                                  segment_duration: int, total_duration: float,
+                                  num_candidate_segments: Optional[int] = None,
+                                  mood_probabilities: Optional[np.ndarray] = None) -> Dict:
+        """
+        Build the full track result from per-segment genre probabilities.
+        
+        Args:
+            probabilities: Genre probabilities of each segment, shape (N, num_genres)
+            start_times: Start time of each segment in seconds
+            segment_duration: Effective segment duration in seconds
+            total_duration: Track duration in seconds
+            num_candidate_segments: Segments that could have been analyzed (default: all were)
+            mood_probabilities: Mood probabilities of each segment, shape (N, num_moods) (default: no mood)
+            
+        Returns:
+            Same dictionary as classify_full_track
+        """
+        if mood_probabilities is None:
+            mood_probabilities = [None] * len(probabilities)
+        segment_predictions = [
+            self._segment_result(segment_probabilities, start_time, segment_duration, segment_moods)
+            for start_time, segment_probabilities, segment_moods in zip(start_times, probabilities, mood_probabilities)
+        ]
+        return self._build_track_result(segment_predictions, total_duration, segment_duration, num_candidate_segments)
+    
+    def classify_from_embeddings(self, embeddings: np.ndarray, start_times: List[float],
+                                 segment_duration: int, total_duration: float,
+                                 num_candidate_segments: Optional[int] = None) -> Dict:
+        """
+        Classify a track from cached segment embeddings, running only the classifier and mood heads.
+        
+        Args:
+            embeddings: Per-segment embeddings from classify_full_track(..., return_embeddings=True)
+            start_times: Start time of each segment in seconds
+            segment_duration: Effective segment duration in seconds
+            total_duration: Track duration in seconds
+            num_candidate_segments: track_info['num_segments_total'] of the original result
+            
+        Returns:
+            Same dictionary as classify_full_track
+        """
+        probabilities = self.predict_from_features(embeddings)
+        mood_probabilities = self.mood_head.predict(embeddings) if self.mood_head is not None else None
+        return self.result_from_probabilities(
+            probabilities, start_times, segment_duration, total_duration, num_candidate_segments, mood_probabilities
+        )
     
     def get_supported_formats(self) -> List[str]:
         """Get list of supported audio formats."""
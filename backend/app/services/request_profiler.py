@@ -0,0 +1,195 @@
+"""
+Request Profiler
+Sampling profiler for single classification requests, writing flamegraph-ready folded stacks.
+
+A RequestProfiler samples the stacks of the threads a request runs on with
+sys._current_frames() every few milliseconds: the event loop thread, the worker
+thread running the classifier method and the shared inference scheduler
+thread. Worker processes sample themselves and send their stacks back with the
+result. Stacks are written in the folded format ('root;caller;callee count'
+per line) that flamegraph.pl, speedscope and inferno read.
+
+Nothing is sampled unless a profiler is active: the only cost for an
+unprofiled request is looking up current_profiler.
+
+The event loop and the scheduler are shared, so their samples also include
+work done for other requests running at the same time.
+"""
+import os
+import sys
+import time
+import threading
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Profiler of the request being handled, if it is being profiled
+current_profiler: ContextVar[Optional["RequestProfiler"]] = ContextVar("current_profiler", default=None)
+
+MAX_STACK_DEPTH = 200
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    path = code.co_filename.replace("\\", "/").split("/")
+    # ';' separates frames in the folded format
+    return f"{name} ({'/'.join(path[-2:])}:{code.co_firstlineno})".replace(";", ":")
+
+
+def folded_stack(frame) -> str:
+    """A frame and its callers, root first, joined with ';'."""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """Samples the stacks of registered threads on a background thread."""
+
+    def __init__(self, interval: float):
+        """
+        Args:
+            interval: Seconds between samples
+        """
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_thread(self, ident: int, label: str):
+        """Start sampling a thread; its stacks are prefixed with label."""
+        with self._lock:
+            self._threads[ident] = label
+
+    def remove_thread(self, ident: int):
+        with self._lock:
+            self._threads.pop(ident, None)
+
+    @contextmanager
+    def sampling_current_thread(self, label: str) -> Iterator[None]:
+        """Sample the calling thread while the block runs."""
+        ident = threading.get_ident()
+        self.add_thread(ident, label)
+        try:
+            yield
+        finally:
+            self.remove_thread(ident)
+
+    def call_sampled(self, label: str, function: Callable[[], Any]) -> Any:
+        """Call function, sampling the calling thread while it runs."""
+        with self.sampling_current_thread(label):
+            return function()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                threads = dict(self._threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident, label in threads.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.samples[f"{label};{folded_stack(frame)}"] += 1
+            del frames
+
+
+class RequestProfiler(StackSampler):
+    def __init__(self, request_id: str, interval: float, output_dir: str):
+        """
+        Prepare a profile; sampling starts with activate().
+
+        Args:
+            request_id: Identifies the request; the profile is written to <output_dir>/<request_id>.folded
+            interval: Seconds between samples
+            output_dir: Where profiles are written
+        """
+        super().__init__(interval)
+        self.request_id = request_id
+        self.output_dir = output_dir
+        self.started_at = None
+        self.duration = None
+
+    @contextmanager
+    def activate(self, label: str = "router") -> Iterator["RequestProfiler"]:
+        """Make this the current profiler and sample the calling thread until the block exits."""
+        token = current_profiler.set(self)
+        self.started_at = time.time()
+        self.start()
+        try:
+            with self.sampling_current_thread(label):
+                yield self
+        finally:
+            self.stop()
+            self.duration = time.time() - self.started_at
+            current_profiler.reset(token)
+
+    def merge(self, samples: Dict[str, int]):
+        """Add samples taken elsewhere, e.g. in a worker process."""
+        self.samples.update(samples)
+
+    def folded(self) -> str:
+        """The profile in the folded stack format, most sampled stacks first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def save(self) -> str:
+        """
+        Write the folded stacks; an existing profile of the same request ID is never overwritten.
+
+        Returns:
+            Path of the written profile
+
+        Raises:
+            FileExistsError: If a profile with this request ID exists
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = profile_path(self.output_dir, self.request_id)
+        with open(path, "x") as f:
+            f.write(self.folded())
+        logger.info(
+            f"Profiled request {self.request_id}: {sum(self.samples.values())} samples "
+            f"over {self.duration:.2f}s, written to {path}"
+        )
+        return path
+
+
+def profile_path(output_dir: str, request_id: str) -> str:
+    """Where the profile of a request is stored."""
+    return os.path.join(output_dir, f"{request_id}.folded")
+
+
+def sample_call(function, interval: float, *args):
+    """
+    Call function(*args) while sampling the calling thread.
+
+    Used in worker processes, which cannot be sampled from the API process.
+
+    Returns:
+        Tuple of the function's return value and the samples
+    """
+    sampler = StackSampler(interval)
+    sampler.start()
+    try:
+        value = sampler.call_sampled("worker-process", partial(function, *args))
+    finally:
+        sampler.stop()
+    return value, dict(sampler.samples)
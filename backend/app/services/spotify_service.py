@@ -1,6 +1,31 @@
+import time
+
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
 from ..config.settings import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_REDIRECT_URI
+from .metrics import SPOTIFY_REQUEST_DURATION
+
+
+class InstrumentedSpotify(spotipy.Spotify):
+    """
+    Spotify client that records the latency of every Web API call.
+    """
+
+    def _internal_call(self, method, url, payload, params):
+        # 'artists/{id}/albums' -> 'artists/albums', so IDs stay out of the labels
+        path = url[len(self.prefix):] if url.startswith(self.prefix) else url
+        parts = path.split("?")[0].strip("/").split("/")
+        endpoint = "/".join(parts[0:3:2])
+
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = super()._internal_call(method, url, payload, params)
+            outcome = "ok"
+            return response
+        finally:
+            SPOTIFY_REQUEST_DURATION.labels(endpoint=endpoint, outcome=outcome).observe(time.perf_counter() - start)
+
 
 # Create Spotify client with client credentials flow (app-level access)
 def get_spotify_client():
@@ -11,7 +36,7 @@ def get_spotify_client():
         client_id=SPOTIFY_CLIENT_ID, 
         client_secret=SPOTIFY_CLIENT_SECRET
     )
-    return spotipy.Spotify(auth_manager=auth_manager)
+    return InstrumentedSpotify(auth_manager=auth_manager)
 
 # Get OAuth2 instance for user-level authentication
 def get_spotify_oauth():
@@ -31,7 +56,7 @@ def get_spotify_user_client(access_token):
     """
     Returns a Spotify client authenticated with a user's access token
     """
-    return spotipy.Spotify(auth=access_token)
+    return InstrumentedSpotify(auth=access_token)
 
 
 # Spotify data retrieval functions
@@ -46,6 +71,13 @@ def search_track(spotify_client, title, artist="", limit=1):
         return results['tracks']['items']
     return None
 
+def get_preview_url(spotify_client, track_id):
+    """
+    Get the 30-second preview URL of a track, or None if it has none
+    """
+    track = spotify_client.track(track_id)
+    return track.get('preview_url')
+
 def get_artist_id(spotify_client, artist_name):
     """
     Get Spotify ID for an artist by name
@@ -0,0 +1,638 @@
+"""
+Track Index
+Persists one embedding per classified track and finds the tracks most similar to a given one.
+
+A track's vector is the mean of its segment embeddings, each averaged over its
+7x7 grid (see mood_head.pool_embeddings), scaled to unit length, so the inner
+product of two vectors is their cosine similarity. Search is exact, a single
+vectorized matrix product over the catalog, until the catalog reaches
+ann_min_tracks and an IVF structure has been built with build(). From then on
+only the nprobe inverted lists whose k-means centroids are closest to the
+query are scored.
+
+Vectors are held in memory as float32, as float16 (half the memory, scored in
+float32 chunks), or as product-quantized codes (pq; one byte per subvector,
+64 bytes per track by default) of their residual from their list's centroid,
+scored with lookup tables. PQ candidates are re-ranked with the exact vectors
+read from disk. Tracks added after build()
+are assigned to the existing lists and encoded with the existing codebooks.
+
+On disk the index is a directory: tracks.jsonl and vectors.f32 are appended
+to on every add, meta.json records the embedding's extractor version, and
+ann.npz holds what build() trained. Every uvicorn worker opens the same
+directory. Appends hold an flock on its lock file, so tracks from different
+processes never interleave. Before each add and search, a process reads the
+tracks the others have appended since it last looked; a stat of tracks.jsonl
+tells it whether there are any. A new ann.npz is only loaded on restart.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker
+    fcntl = None
+
+import numpy as np
+
+from .mood_head import pool_embeddings
+
+logger = logging.getLogger(__name__)
+
+STORAGE_MODES = ("float32", "float16", "pq")
+
+# Rows scored per matrix product; bounds the float32 copy of float16 vectors, whose conversion dominates
+SCORE_CHUNK_ROWS = 4096
+
+
+def track_vector(segment_embeddings: np.ndarray) -> np.ndarray:
+    """
+    One unit-length vector for a track from the embeddings of its segments.
+
+    Args:
+        segment_embeddings: Embeddings of shape (segments, 7, 7, 1280) or (segments, 1280)
+
+    Returns:
+        float32 vector of shape (1280,)
+    """
+    vector = pool_embeddings(segment_embeddings).mean(axis=0)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def _as_float32(rows: np.ndarray) -> np.ndarray:
+    return rows if rows.dtype == np.float32 else rows.astype(np.float32)
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Index of the nearest centroid (Euclidean) of every vector.
+
+    Returns:
+        int32 array of shape (N,)
+    """
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SCORE_CHUNK_ROWS):
+        chunk = _as_float32(vectors[start:start + SCORE_CHUNK_ROWS])
+        labels[start:start + len(chunk)] = np.argmin(centroid_norms - 2 * chunk @ centroids.T, axis=1)
+    return labels
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    Lloyd's k-means; empty clusters are restarted on random vectors.
+
+    Args:
+        vectors: Training vectors of shape (N, D), N >= k
+        k: Number of centroids
+        iterations: Assignment and update rounds
+
+    Returns:
+        float32 centroids of shape (k, D)
+    """
+    from scipy.sparse import csr_matrix
+
+    rng = np.random.default_rng(seed)
+    vectors = _as_float32(vectors)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(vectors, centroids)
+        # Sum of each cluster's vectors as one sparse product
+        membership = csr_matrix((np.ones(len(labels), dtype=np.float32), (labels, np.arange(len(labels)))),
+                                shape=(k, len(labels)))
+        counts = np.bincount(labels, minlength=k)
+        sums = membership @ vectors
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+        centroids[~filled] = vectors[rng.choice(len(vectors), int((~filled).sum()), replace=False)]
+    return centroids
+
+
+class ProductQuantizer:
+    def __init__(self, codebooks: np.ndarray):
+        """
+        Args:
+            codebooks: float32 array of shape (subvectors, 256, dim // subvectors)
+        """
+        self.codebooks = codebooks.astype(np.float32)
+        self.subvectors, self.centroids, self.subvector_dim = codebooks.shape
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, subvectors: int, iterations: int = 10, seed: int = 0) -> "ProductQuantizer":
+        """
+        Train one 256-centroid codebook per subvector.
+
+        Args:
+            vectors: Training vectors of shape (N, D); D must be divisible by subvectors and N >= 256
+            subvectors: Number of subvectors, i.e. bytes per code
+        """
+        dim = vectors.shape[1]
+        if dim % subvectors:
+            raise ValueError(f"{dim} dimensions cannot be split into {subvectors} subvectors")
+        width = dim // subvectors
+        vectors = _as_float32(vectors)
+        codebooks = np.stack([
+            kmeans(vectors[:, m * width:(m + 1) * width], 256, iterations, seed + m) for m in range(subvectors)
+        ])
+        return cls(codebooks)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Nearest codebook entry of every subvector.
+
+        Returns:
+            uint8 codes of shape (N, subvectors)
+        """
+        codes = np.empty((len(vectors), self.subvectors), dtype=np.uint8)
+        width = self.subvector_dim
+        for m in range(self.subvectors):
+            codes[:, m] = assign(vectors[:, m * width:(m + 1) * width], self.codebooks[m])
+        return codes
+
+    def inner_product_table(self, query: np.ndarray) -> np.ndarray:
+        """
+        Inner product of each query subvector with each codebook entry.
+
+        Returns:
+            float32 table of shape (subvectors, 256)
+        """
+        return np.einsum('mkd,md->mk', self.codebooks, query.reshape(self.subvectors, self.subvector_dim))
+
+    def scores(self, codes: np.ndarray, table: np.ndarray) -> np.ndarray:
+        """Approximate inner products of the query with the encoded vectors."""
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for m in range(self.subvectors):
+            scores += table[m][codes[:, m]]
+        return scores
+
+
+def encode_residuals(quantizer: ProductQuantizer, centroids: np.ndarray, vectors: np.ndarray,
+                     assignments: np.ndarray) -> np.ndarray:
+    """
+    PQ codes of the difference between each vector and the centroid of its list.
+
+    Residuals vary much less than the vectors themselves, so the same code
+    size loses far less precision; the centroid's part of the inner product
+    is computed exactly at query time.
+    """
+    codes = np.empty((len(vectors), quantizer.subvectors), dtype=np.uint8)
+    for start in range(0, len(vectors), SCORE_CHUNK_ROWS):
+        stop = min(len(vectors), start + SCORE_CHUNK_ROWS)
+        codes[start:stop] = quantizer.encode(_as_float32(vectors[start:stop]) - centroids[assignments[start:stop]])
+    return codes
+
+
+@contextmanager
+def _no_lock() -> Iterator[None]:
+    yield
+
+
+class TrackIndex:
+    def __init__(self, path: Optional[str] = None, dim: int = 1280, storage: str = "float32", nprobe: int = 16,
+                 ann_min_tracks: int = 50000, rerank: int = 50, extractor_version: Optional[str] = None):
+        """
+        Open an index, loading the tracks already stored at path.
+
+        Args:
+            path: Directory the index is kept in (None: in memory only)
+            dim: Embedding dimensions
+            storage: How vectors are held in memory: 'float32', 'float16' or 'pq'
+                ('pq' holds float16 vectors until build() has trained the quantizer)
+            nprobe: Inverted lists scored per query once IVF search is in use
+            ann_min_tracks: Catalog size from which the IVF structure is used
+            rerank: With PQ codes, candidates re-scored with the exact vectors, per track returned
+            extractor_version: Version of the extractor the embeddings come from;
+                taken from the stored index if it has one
+        """
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Storage must be one of {STORAGE_MODES}, not {storage}")
+        self.path = path
+        self.dim = dim
+        self.storage = storage
+        self.nprobe = nprobe
+        self.ann_min_tracks = ann_min_tracks
+        self.rerank = rerank
+        self.extractor_version = extractor_version
+
+        self.ids: List[str] = []
+        self.metadata: List[Dict] = []
+        self._positions: Dict[str, int] = {}
+        self._vectors: Optional[np.ndarray] = None  # Rows beyond len(self) are spare capacity
+        self._codes: Optional[np.ndarray] = None
+        self.quantizer: Optional[ProductQuantizer] = None
+        self.centroids: Optional[np.ndarray] = None
+        self._assignments: Optional[np.ndarray] = None
+        self._lists: Optional[Tuple[np.ndarray, np.ndarray]] = None  # positions ordered by list, list offsets
+        self._listed = 0  # Tracks covered by _lists
+        self._raw: Optional[np.ndarray] = None  # Exact vectors on disk, set once PQ codes replace _vectors
+        self._tracks_bytes = 0  # Length of tracks.jsonl this process has read or written
+        self._lock = threading.Lock()
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+            with self._file_lock():
+                self._load()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, track_id: str) -> bool:
+        return track_id in self._positions
+
+    @property
+    def mode(self) -> str:
+        """'ivf' when queries only score the nearest inverted lists, otherwise 'exact'."""
+        return "ivf" if self.centroids is not None and len(self) >= self.ann_min_tracks else "exact"
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """Hold the index directory's lock, which every process takes to write or truncate its files."""
+        if fcntl is None:
+            yield
+            return
+        with open(self._file("lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        """Read the tracks, vectors and trained structures from disk; call with the file lock held."""
+        meta_path = self._file("meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.extractor_version = meta.get("extractor_version") or self.extractor_version
+
+        lines = []
+        if os.path.exists(self._file("tracks.jsonl")):
+            with open(self._file("tracks.jsonl")) as f:
+                lines = f.readlines()
+        tracks = [json.loads(line) for line in lines if line.endswith("\n")]
+        vector_bytes = os.path.getsize(self._file("vectors.f32")) if os.path.exists(self._file("vectors.f32")) else 0
+        count = min(len(tracks), vector_bytes // (4 * self.dim))
+        if count < len(lines) or vector_bytes != count * 4 * self.dim:
+            # An add was interrupted; drop the partial track so later ones line up
+            logger.warning(f"Track index at {self.path} has an incomplete track; keeping the first {count}")
+            self._truncate(count)
+        self._tracks_bytes = sum(len(line.encode("utf-8")) for line in lines[:count])
+        for track in tracks[:count]:
+            track_id = track.pop("id")
+            self._positions[track_id] = len(self.ids)
+            self.ids.append(track_id)
+            self.metadata.append(track)
+
+        raw = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode="r", shape=(count, self.dim)) if count else None
+        if os.path.exists(self._file("ann.npz")):
+            with np.load(self._file("ann.npz")) as ann:
+                self.centroids = ann["centroids"]
+                built = min(int(ann["count"]), count)
+                self._assignments = ann["assignments"][:built]
+                if "codebooks" in ann.files and self.storage == "pq":
+                    self.quantizer = ProductQuantizer(ann["codebooks"])
+                    self._codes = ann["codes"][:built]
+            if count > built:
+                # Tracks added since the last build
+                self._assignments = np.concatenate([self._assignments, assign(raw[built:], self.centroids)])
+                if self._codes is not None:
+                    self._codes = np.concatenate([
+                        self._codes, encode_residuals(self.quantizer, self.centroids, raw[built:], self._assignments[built:])
+                    ])
+
+        if self.storage == "pq" and self.quantizer is not None:
+            self._raw = raw
+        elif count:
+            self._vectors = self._empty_vectors(count)
+            for start in range(0, count, SCORE_CHUNK_ROWS):
+                stop = min(count, start + SCORE_CHUNK_ROWS)
+                self._vectors[start:stop] = raw[start:stop]
+        if count:
+            logger.info(f"Loaded {count} tracks from {self.path} ({self.storage}, {self.mode} search)")
+
+    def _truncate(self, count: int):
+        """Cut both files back to their first count tracks."""
+        lines = []
+        if os.path.exists(self._file("tracks.jsonl")):
+            with open(self._file("tracks.jsonl")) as f:
+                lines = f.readlines()[:count]
+        with open(self._file("tracks.jsonl"), "w") as f:
+            f.writelines(lines)
+        with open(self._file("vectors.f32"), "ab") as f:
+            f.truncate(count * 4 * self.dim)
+
+    def _empty_vectors(self, capacity: int) -> np.ndarray:
+        return np.empty((max(capacity, 1024), self.dim), dtype=np.float32 if self.storage == "float32" else np.float16)
+
+    def add(self, track_id: str, vector: np.ndarray, metadata: Optional[Dict] = None,
+            extractor_version: Optional[str] = None) -> bool:
+        """
+        Add a track; a track already in the index is left as it is.
+
+        Args:
+            track_id: Identifier of the track, e.g. its content hash
+            vector: Track vector from track_vector
+            metadata: JSON-serializable details returned with search results
+            extractor_version: Extractor the vector comes from; vectors of another
+                extractor than the index's are not comparable and are rejected
+
+        Returns:
+            True if the track was added
+        """
+        return self.add_many([track_id], np.asarray(vector)[np.newaxis], [metadata], extractor_version) == 1
+
+    def add_many(self, track_ids: List[str], vectors: np.ndarray, metadata: Optional[List[Optional[Dict]]] = None,
+                 extractor_version: Optional[str] = None) -> int:
+        """
+        Add a batch of tracks with one write per file; tracks already in the index are skipped.
+
+        Args:
+            track_ids: Identifiers of the tracks
+            vectors: Track vectors of shape (len(track_ids), dim)
+            metadata: Details of each track (default: none)
+            extractor_version: Extractor the vectors come from, see add
+
+        Returns:
+            Number of tracks added
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(track_ids), self.dim)
+        metadata = metadata or [None] * len(track_ids)
+        with self._lock, (self._file_lock() if self.path else _no_lock()):
+            # Tracks other processes added first, so duplicates are seen and positions line up
+            self._read_appended()
+            if extractor_version and self.extractor_version and extractor_version != self.extractor_version:
+                logger.warning(
+                    f"Not indexing {len(track_ids)} track(s): embedded by {extractor_version}, "
+                    f"index holds {self.extractor_version}"
+                )
+                return 0
+            if self.extractor_version is None:
+                self.extractor_version = extractor_version
+
+            new = {}
+            for i, track_id in enumerate(track_ids):
+                if track_id not in self._positions and track_id not in new:
+                    new[track_id] = i
+            if not new:
+                return 0
+            ids = list(new)
+            vectors = vectors[list(new.values())]
+            metadata = [dict(metadata[i] or {}) for i in new.values()]
+
+            if self.path:
+                self._append_to_disk(ids, vectors, metadata)
+            self._extend(ids, vectors, metadata)
+            return len(ids)
+
+    def _extend(self, ids: List[str], vectors: np.ndarray, metadata: List[Dict]):
+        """Add tracks that are already on disk to the in-memory structures; call with self._lock held."""
+        position = len(self.ids)
+        if self.centroids is not None:
+            assignments = assign(vectors, self.centroids)
+            self._assignments = np.concatenate([self._assignments, assignments])
+            if self.quantizer is not None:
+                self._codes = np.concatenate([
+                    self._codes, encode_residuals(self.quantizer, self.centroids, vectors, assignments)
+                ])
+        if self._raw is None:
+            if self._vectors is None:
+                self._vectors = self._empty_vectors(len(ids))
+            elif position + len(ids) > len(self._vectors):
+                # Grow by doubling; readers hold on to the old array until they finish
+                grown = self._empty_vectors(max(2 * position, position + len(ids)))
+                grown[:position] = self._vectors[:position]
+                self._vectors = grown
+            self._vectors[position:position + len(ids)] = vectors
+        else:
+            self._raw = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode="r",
+                                  shape=(position + len(ids), self.dim))
+
+        for offset, track_id in enumerate(ids):
+            self._positions[track_id] = position + offset
+        self.ids.extend(ids)
+        self.metadata.extend(metadata)
+
+    def _append_to_disk(self, track_ids: List[str], vectors: np.ndarray, metadata: List[Dict]):
+        """Append tracks to the files; call with both locks held."""
+        if not os.path.exists(self._file("meta.json")):
+            with open(self._file("meta.json"), "w") as f:
+                json.dump({"dim": self.dim, "extractor_version": self.extractor_version}, f)
+        vector_bytes = os.path.getsize(self._file("vectors.f32")) if os.path.exists(self._file("vectors.f32")) else 0
+        tracks_bytes = os.path.getsize(self._file("tracks.jsonl")) if os.path.exists(self._file("tracks.jsonl")) else 0
+        if vector_bytes != len(self) * 4 * self.dim or tracks_bytes != self._tracks_bytes:
+            # A process died mid-append; drop its partial track so this one lines up
+            logger.warning(f"Track index at {self.path} has an incomplete track; keeping the first {len(self)}")
+            self._truncate(len(self))
+        lines = "".join(json.dumps({"id": track_id, **track}) + "\n" for track_id, track in zip(track_ids, metadata))
+        with open(self._file("vectors.f32"), "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self._file("tracks.jsonl"), "ab") as f:
+            f.write(lines.encode("utf-8"))
+        self._tracks_bytes += len(lines.encode("utf-8"))
+
+    def _read_appended(self):
+        """Load the tracks other processes appended since this one last read the files; call with both locks held."""
+        if not self.path or not os.path.exists(self._file("tracks.jsonl")):
+            return
+        with open(self._file("tracks.jsonl"), "rb") as f:
+            f.seek(self._tracks_bytes)
+            data = f.read()
+        data = data[:data.rfind(b"\n") + 1]  # Whole lines only; a dead writer's partial one is cut by the next add
+        if not data:
+            return
+        tracks = [json.loads(line) for line in data.splitlines()]
+        with open(self._file("vectors.f32"), "rb") as f:
+            f.seek(len(self) * 4 * self.dim)
+            vectors = np.frombuffer(f.read(len(tracks) * 4 * self.dim), dtype=np.float32).reshape(len(tracks), self.dim)
+        if self.extractor_version is None:
+            with open(self._file("meta.json")) as f:
+                self.extractor_version = json.load(f).get("extractor_version")
+        self._tracks_bytes += len(data)
+        self._extend([track.pop("id") for track in tracks], vectors, tracks)
+
+    def refresh(self):
+        """Pick up tracks added by other processes; costs one stat when there are none."""
+        if not self.path:
+            return
+        with self._lock:
+            try:
+                if os.path.getsize(self._file("tracks.jsonl")) == self._tracks_bytes:
+                    return
+            except OSError:
+                return
+            with self._file_lock():
+                self._read_appended()
+
+    def get(self, track_id: str) -> Optional[Dict]:
+        """The metadata a track was added with, or None if it is not in the index."""
+        position = self._positions.get(track_id)
+        return dict(self.metadata[position]) if position is not None else None
+
+    def vector(self, track_id: str) -> Optional[np.ndarray]:
+        """The stored vector of a track, or None if it is not in the index."""
+        position = self._positions.get(track_id)
+        if position is None:
+            return None
+        if self._raw is not None:
+            return np.array(self._raw[position])
+        return self._vectors[position].astype(np.float32)
+
+    def build(self, lists: Optional[int] = None, pq_subvectors: int = 0, sample_size: int = 100000,
+              iterations: int = 10, seed: int = 0):
+        """
+        Train the IVF centroids (and product quantizer) on the tracks in the index and save them.
+
+        Args:
+            lists: Number of inverted lists (default: 4 * sqrt(tracks))
+            pq_subvectors: Bytes per product-quantized code (0: no quantizer); the vectors
+                are only replaced by codes in memory with storage='pq'
+            sample_size: Tracks the k-means runs are trained on
+            iterations: k-means rounds
+            seed: Random seed for sampling and initialization
+        """
+        with self._lock:
+            count = len(self)
+            vectors = self._raw if self._raw is not None else self._vectors[:count]
+        lists = lists or max(1, int(4 * np.sqrt(count)))
+        if count < max(lists, 256 if pq_subvectors else 1):
+            raise ValueError(f"{count} tracks are too few to train {lists} lists" +
+                             (" and a product quantizer" if pq_subvectors else ""))
+
+        started = time.perf_counter()
+        rng = np.random.default_rng(seed)
+        sample = _as_float32(vectors[np.sort(rng.choice(count, min(sample_size, count), replace=False))])
+        centroids = kmeans(sample, lists, iterations, seed)
+        assignments = assign(vectors, centroids)
+        quantizer, codes = None, None
+        if pq_subvectors:
+            residuals = sample - centroids[assign(sample, centroids)]
+            quantizer = ProductQuantizer.train(residuals, pq_subvectors, iterations, seed)
+            codes = encode_residuals(quantizer, centroids, vectors, assignments)
+        logger.info(f"Built {lists} lists{f' and {pq_subvectors}-byte codes' if pq_subvectors else ''} "
+                    f"for {count} tracks in {time.perf_counter() - started:.1f}s")
+
+        with self._lock:
+            # Tracks added while training
+            if len(self) > count:
+                tail = np.stack([self.vector(track_id) for track_id in self.ids[count:]])
+                tail_assignments = assign(tail, centroids)
+                assignments = np.concatenate([assignments, tail_assignments])
+                if quantizer is not None:
+                    codes = np.concatenate([codes, encode_residuals(quantizer, centroids, tail, tail_assignments)])
+            self.centroids, self._assignments, self._lists, self._listed = centroids, assignments, None, 0
+            self.quantizer, self._codes = quantizer, codes
+            if self.path:
+                arrays = {"centroids": centroids, "assignments": assignments, "count": np.array(len(assignments))}
+                if quantizer is not None:
+                    arrays.update(codebooks=quantizer.codebooks, codes=codes)
+                with open(self._file("ann.npz.tmp"), "wb") as f:
+                    np.savez(f, **arrays)
+                os.replace(self._file("ann.npz.tmp"), self._file("ann.npz"))
+            if self.storage == "pq" and quantizer is not None and self.path:
+                # Codes replace the vectors; exact ones are re-read from disk for re-ranking
+                self._raw = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode="r", shape=(len(self), self.dim))
+                self._vectors = None
+
+    def _candidates(self, query: np.ndarray, count: int) -> np.ndarray:
+        """Positions in the nprobe inverted lists nearest to the query."""
+        with self._lock:
+            if self._lists is None or self._listed < 0.9 * count:
+                # Rebuilt once the tracks added since the last rebuild pass 10%
+                order = np.argsort(self._assignments[:count], kind="stable").astype(np.int32)
+                offsets = np.searchsorted(self._assignments[:count][order], np.arange(len(self.centroids) + 1))
+                self._lists, self._listed = (order, offsets), count
+            (order, offsets), listed = self._lists, self._listed
+            tail_assignments = self._assignments[listed:count]
+
+        probes = np.argsort(-(self.centroids @ query))[:self.nprobe]
+        candidates = [order[offsets[probe]:offsets[probe + 1]] for probe in probes]
+        candidates.append(listed + np.flatnonzero(np.isin(tail_assignments, probes)).astype(np.int32))
+        return np.concatenate(candidates)
+
+    def _scores(self, query: np.ndarray, positions: Optional[np.ndarray], count: int) -> np.ndarray:
+        """Inner products of the query with the given tracks (None: the first count tracks)."""
+        if self._raw is not None:
+            selected = slice(0, count) if positions is None else positions
+            residual_scores = self.quantizer.scores(self._codes[selected], self.quantizer.inner_product_table(query))
+            return (self.centroids @ query)[self._assignments[selected]] + residual_scores
+        vectors = self._vectors
+        if positions is None:
+            scores = np.empty(count, dtype=np.float32)
+            for start in range(0, count, SCORE_CHUNK_ROWS):
+                stop = min(count, start + SCORE_CHUNK_ROWS)
+                scores[start:stop] = _as_float32(vectors[start:stop]) @ query
+            return scores
+        return _as_float32(vectors[positions]) @ query
+
+    def search(self, vector: np.ndarray, k: int = 10, accept: Optional[Callable[[Dict], bool]] = None,
+               exclude: Optional[str] = None) -> List[Dict]:
+        """
+        Find the tracks most similar to a vector.
+
+        Args:
+            vector: Query vector from track_vector
+            k: Number of tracks to return
+            accept: Only return tracks whose metadata this returns True for
+            exclude: Track ID to leave out, e.g. the query track itself
+
+        Returns:
+            Up to k dictionaries with 'id', 'score' (cosine similarity) and the track's metadata,
+            most similar first
+        """
+        query = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        self.refresh()
+        count = len(self)
+        if count == 0 or k <= 0:
+            return []
+
+        positions = self._candidates(query, count) if self.mode == "ivf" else None
+        scores = self._scores(query, positions, count)
+        approximate = self._raw is not None
+
+        results = []
+        take = min(len(scores), (k * self.rerank if approximate else k) + 8)
+        while True:
+            best = np.argpartition(-scores, take - 1)[:take] if take < len(scores) else np.arange(len(scores))
+            best_positions = best if positions is None else positions[best]
+            best_scores = scores[best]
+            if approximate:
+                best_scores = np.asarray(self._raw[np.sort(best_positions)] @ query)
+                best_positions = np.sort(best_positions)
+            results = []
+            for i in np.argsort(-best_scores, kind="stable"):
+                position = int(best_positions[i])
+                track_id = self.ids[position]
+                if track_id == exclude or (accept is not None and not accept(self.metadata[position])):
+                    continue
+                results.append({"id": track_id, "score": float(best_scores[i]), **self.metadata[position]})
+                if len(results) == k:
+                    return results
+            if take >= len(scores):
+                return results
+            # Too many candidates were filtered out; look further down the ranking
+            take = min(len(scores), take * 4)
+
+    def stats(self) -> Dict:
+        """Size, mode and memory of the index."""
+        memory = sum(array.nbytes for array in (self._codes, self._assignments) if array is not None)
+        if self._vectors is not None:
+            memory += len(self) * self._vectors.itemsize * self.dim
+        return {
+            "tracks": len(self),
+            "mode": self.mode,
+            "storage": "pq" if self._raw is not None else "float32" if self.storage == "float32" else "float16",
+            "lists": len(self.centroids) if self.centroids is not None else 0,
+            "nprobe": self.nprobe,
+            "vector_memory_bytes": int(memory),
+            "extractor_version": self.extractor_version,
+        }
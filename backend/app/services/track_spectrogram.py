@@ -0,0 +1,98 @@
+"""
+Track Spectrogram
+Mel spectrogram of a whole track that analysis windows are cut from.
+
+Overlapping windows share most of their STFT frames, so the frames are
+computed once for the track and every window is a view into the frame matrix.
+Frames are computed in blocks the first time a window touches them, which
+keeps a short or capped analysis of a long track from transforming audio it
+never looks at, and keeps the complex STFT of at most one block in memory.
+
+The frames are those of librosa.feature.melspectrogram on the whole track
+(centered, zero-padded). A window starting at sample s covers the frames from
+round(s / hop_length). Its image matches the one computed on the slice that
+starts at that frame, apart from the zero padding at the slice edges, so the
+start moves by at most half a hop (12 ms).
+"""
+import threading
+from typing import Tuple
+
+import numpy as np
+import librosa
+
+from ..config.music_config import SAMPLE_RATE, N_MELS, FMAX, N_FFT, HOP_LENGTH
+
+
+class TrackMelSpectrogram:
+    def __init__(self, y: np.ndarray, sr: int = SAMPLE_RATE, n_mels: int = N_MELS, fmax: float = FMAX,
+                 n_fft: int = N_FFT, hop_length: int = HOP_LENGTH, block_frames: int = 2048):
+        """
+        Prepare the frame matrix of a track; nothing is transformed yet.
+
+        Args:
+            y: Mono samples of the whole track
+            sr: Sample rate of the samples
+            n_mels: Mel bands
+            fmax: Highest mel band frequency
+            n_fft: FFT size
+            hop_length: Samples between frames
+            block_frames: Frames transformed at a time
+        """
+        self.y = y
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.block_frames = block_frames
+        self.num_frames = 1 + len(y) // hop_length
+        self.mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels, fmax=fmax).astype(np.float32)
+        self.frames = np.empty((n_mels, self.num_frames), dtype=np.float32)
+        self._computed = np.zeros((self.num_frames + block_frames - 1) // block_frames, dtype=bool)
+        self._lock = threading.Lock()
+
+    def frame_range(self, start_sample: int, num_samples: int) -> Tuple[int, int]:
+        """
+        Frames covering a window, as librosa would compute them for the slice alone.
+
+        Returns:
+            Tuple of (first frame, end frame), end exclusive
+        """
+        start_frame = min(int(round(start_sample / self.hop_length)), self.num_frames - 1)
+        return start_frame, min(start_frame + 1 + num_samples // self.hop_length, self.num_frames)
+
+    def _compute_block(self, block: int):
+        """Transform one block of frames into the frame matrix."""
+        first = block * self.block_frames
+        last = min(first + self.block_frames, self.num_frames)
+
+        # Samples under frames first..last-1 of the centered, zero-padded track
+        pad = self.n_fft // 2
+        start = first * self.hop_length - pad
+        stop = (last - 1) * self.hop_length + self.n_fft - pad
+        if start >= 0 and stop <= len(self.y):
+            samples = self.y[start:stop]
+        else:
+            samples = np.zeros(stop - start, dtype=np.float32)
+            samples[max(0, -start):min(stop, len(self.y)) - start] = self.y[max(0, start):min(stop, len(self.y))]
+
+        stft = librosa.stft(samples, n_fft=self.n_fft, hop_length=self.hop_length, center=False)
+        self.frames[:, first:last] = self.mel_basis @ (np.abs(stft) ** 2)
+
+    def window(self, start_sample: int, num_samples: int) -> np.ndarray:
+        """
+        Mel power spectrogram of a window of the track.
+
+        Args:
+            start_sample: First sample of the window
+            num_samples: Window length in samples
+
+        Returns:
+            Read-only (n_mels, frames) view into the frame matrix
+        """
+        start_frame, end_frame = self.frame_range(start_sample, num_samples)
+        with self._lock:
+            for block in range(start_frame // self.block_frames, (end_frame - 1) // self.block_frames + 1):
+                if not self._computed[block]:
+                    self._compute_block(block)
+                    self._computed[block] = True
+        view = self.frames[:, start_frame:end_frame]
+        view.flags.writeable = False
+        return view
@@ -0,0 +1,330 @@
+"""
+Upload Storage
+Streams classification uploads to scratch files with a size limit.
+
+receive_upload parses the multipart request body as it arrives and writes the
+file part straight to a scratch file while the SHA-256 and size are computed
+on the fly, so an upload is written to disk once and never held in memory.
+Uploads over the limit, with an unsupported extension or without a file are
+rejected as soon as that is known, before the rest of the body is read.
+UploadSizeLimitMiddleware rejects bodies over the limit before the endpoint
+runs, using Content-Length when the client sends it and a running byte count
+otherwise. save_download does the same for audio fetched from a URL.
+"""
+import os
+import hashlib
+import tempfile
+import logging
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+import anyio
+from fastapi import HTTPException, Request
+
+logger = logging.getLogger(__name__)
+
+# Multipart boundaries and form fields on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit."""
+
+    def __init__(self, max_size: int):
+        super().__init__(f"File exceeds the maximum upload size of {max_size // (1024 * 1024)} MB")
+        self.max_size = max_size
+
+
+class InvalidUploadError(Exception):
+    """Raised when a multipart upload is malformed, has no file or has an unsupported extension."""
+
+
+class DownloadError(Exception):
+    """Raised when audio cannot be fetched from a URL."""
+
+
+class StoredUpload(NamedTuple):
+    path: str
+    size: int
+    content_hash: str
+
+
+class ReceivedUpload(NamedTuple):
+    filename: str
+    path: str
+    size: int
+    content_hash: str
+    fields: Dict[str, str]
+
+
+def _copy_chunks(chunks: Iterable[bytes], destination_path: str, max_size: int) -> StoredUpload:
+    """Write chunks to disk, hashing and enforcing max_size as it goes."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(destination_path, 'wb') as destination:
+        for chunk in chunks:
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLargeError(max_size)
+            digest.update(chunk)
+            destination.write(chunk)
+    return StoredUpload(destination_path, size, digest.hexdigest())
+
+
+class _MultipartUploadReader:
+    """python-multipart callbacks that write one file part to disk and keep the small form fields."""
+
+    def __init__(self, file_field: str, suffixes: List[str], max_size: int, scratch_dir: Optional[str]):
+        self.file_field = file_field
+        self.suffixes = suffixes
+        self.max_size = max_size
+        self.scratch_dir = scratch_dir
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.path: Optional[str] = None
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self._field_bytes = 0
+        self._file = None
+        self._header_name = b''
+        self._header_value = b''
+        self._disposition = b''
+        self._part_name = ''
+        self._part_data: Optional[bytearray] = None
+
+    def callbacks(self) -> Dict[str, Callable]:
+        return {
+            'on_part_begin': self.on_part_begin,
+            'on_part_data': self.on_part_data,
+            'on_part_end': self.on_part_end,
+            'on_header_field': self.on_header_field,
+            'on_header_value': self.on_header_value,
+            'on_header_end': self.on_header_end,
+            'on_headers_finished': self.on_headers_finished,
+        }
+
+    def on_part_begin(self):
+        self._disposition = b''
+        self._part_data = None
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b'content-disposition':
+            self._disposition = self._header_value
+        self._header_name = b''
+        self._header_value = b''
+
+    def on_headers_finished(self):
+        from python_multipart.multipart import parse_options_header
+
+        _, options = parse_options_header(self._disposition)
+        if b'name' not in options:
+            raise InvalidUploadError('Multipart part without a name')
+        self._part_name = options[b'name'].decode('utf-8', errors='replace')
+        if b'filename' not in options:
+            self._part_data = bytearray()
+            return
+
+        filename = options[b'filename'].decode('utf-8', errors='replace')
+        if self._part_name != self.file_field or self.path is not None:
+            raise InvalidUploadError(f"Unexpected file field '{self._part_name}'")
+        if not filename:
+            raise InvalidUploadError('No file provided')
+        suffix = Path(filename).suffix.lower()
+        if suffix not in self.suffixes:
+            raise InvalidUploadError(f"Unsupported file format. Supported formats: {self.suffixes}")
+        self.filename = filename
+        self._file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=self.scratch_dir)
+        self.path = self._file.name
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._part_data is not None:
+            self._field_bytes += end - start
+            if self._field_bytes > MULTIPART_OVERHEAD:
+                raise InvalidUploadError('Form fields are too large')
+            self._part_data += data[start:end]
+            return
+        self.size += end - start
+        if self.size > self.max_size:
+            raise UploadTooLargeError(self.max_size)
+        chunk = data[start:end]
+        self.digest.update(chunk)
+        self._file.write(chunk)
+
+    def on_part_end(self):
+        if self._part_data is not None:
+            self.fields[self._part_name] = self._part_data.decode('utf-8', errors='replace')
+        elif self._file is not None:
+            self._file.close()
+
+    def discard(self):
+        """Remove the partially written file."""
+        if self._file is not None:
+            self._file.close()
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+def _download(url: str, destination_path: str, max_size: int, chunk_size: int, timeout: float) -> StoredUpload:
+    """Fetch a URL to disk in chunks, without following redirects."""
+    import requests
+
+    with requests.get(url, stream=True, timeout=timeout, allow_redirects=False) as response:
+        if response.status_code != 200:
+            raise DownloadError(f"Download failed with HTTP {response.status_code}")
+        content_length = response.headers.get('Content-Length', '')
+        if content_length.isdigit() and int(content_length) > max_size:
+            raise UploadTooLargeError(max_size)
+        return _copy_chunks(response.iter_content(chunk_size), destination_path, max_size)
+
+
+async def receive_upload(request: Request, file_field: str, suffixes: List[str], max_size: int,
+                         scratch_dir: Optional[str] = None, chunk_size: int = 1024 * 1024) -> ReceivedUpload:
+    """
+    Stream a multipart/form-data upload to a scratch file.
+
+    The body is parsed as it is received instead of through FastAPI's form
+    handling, which would spool the file to a temporary file of its own
+    first. Parsing and disk writes run in a worker thread so they don't block
+    the event loop; network chunks are small, so they are gathered into
+    chunk_size blocks to hop to the thread once per block rather than per
+    chunk. The caller owns the returned file and must delete it.
+
+    Args:
+        request: Request whose body has not been read
+        file_field: Form field that carries the file; other file fields are rejected
+        suffixes: Accepted file extensions; the scratch file keeps the upload's, so decoders can detect the format
+        max_size: Largest accepted file in bytes
+        scratch_dir: Directory for scratch files (default: system temp dir)
+        chunk_size: Bytes of body gathered before each hand-off to the worker thread
+
+    Returns:
+        ReceivedUpload with the file name, scratch path, size in bytes, SHA-256 hex digest and the other form fields
+
+    Raises:
+        UploadTooLargeError: If the file is larger than max_size
+        InvalidUploadError: If the body is not valid multipart data, has no file or an unsupported extension
+    """
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+
+    content_type, options = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in options:
+        raise InvalidUploadError('Expected a multipart/form-data upload')
+
+    reader = _MultipartUploadReader(file_field, suffixes, max_size, scratch_dir)
+    parser = MultipartParser(options[b'boundary'], reader.callbacks())
+    pending, pending_size = [], 0
+    try:
+        async for chunk in request.stream():
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= chunk_size:
+                await anyio.to_thread.run_sync(parser.write, b''.join(pending))
+                pending, pending_size = [], 0
+        if pending_size:
+            await anyio.to_thread.run_sync(parser.write, b''.join(pending))
+        parser.finalize()
+    except BaseException as e:
+        reader.discard()
+        if isinstance(e, FormParserError):
+            raise InvalidUploadError('Invalid multipart data') from e
+        raise
+
+    if reader.path is None:
+        raise InvalidUploadError('No file provided')
+    return ReceivedUpload(reader.filename, reader.path, reader.size, reader.digest.hexdigest(), reader.fields)
+
+
+async def save_download(url: str, suffix: str, max_size: int, chunk_size: int, timeout: float,
+                        scratch_dir: Optional[str] = None) -> StoredUpload:
+    """
+    Download audio to a scratch file, like receive_upload does with an upload.
+
+    Redirects are not followed, so the caller's check of the URL's host holds.
+    The caller owns the returned file and must delete it.
+
+    Args:
+        url: URL to fetch; check its host before calling
+        suffix: File extension to give the scratch file
+        max_size: Largest accepted download in bytes
+        chunk_size: Bytes written per chunk
+        timeout: Seconds to wait for the connection and for each read
+        scratch_dir: Directory for scratch files (default: system temp dir)
+
+    Returns:
+        StoredUpload with the scratch path, size in bytes and SHA-256 hex digest
+
+    Raises:
+        UploadTooLargeError: If the download is larger than max_size
+        DownloadError: If the server does not answer with the file
+    """
+    tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=scratch_dir)
+    tmp_file_path = tmp_file.name
+    tmp_file.close()
+
+    try:
+        return await anyio.to_thread.run_sync(_download, url, tmp_file_path, max_size, chunk_size, timeout)
+    except BaseException as e:
+        try:
+            os.unlink(tmp_file_path)
+        except OSError:
+            pass
+        if isinstance(e, OSError) and not isinstance(e, DownloadError):
+            raise DownloadError(f"Download failed: {str(e)}") from e
+        raise
+
+
+class UploadSizeLimitMiddleware:
+    """ASGI middleware that rejects request bodies over a size limit before they are parsed."""
+
+    def __init__(self, app, max_body_size: int, path_prefix: str = "/"):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_size:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # Surfaces as a 413 response through FastAPI's exception handling
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    def _detail(self) -> str:
+        return f"Request body exceeds the maximum upload size of {self.max_body_size // (1024 * 1024)} MB"
+
+    async def _reject(self, send):
+        logger.warning("Rejected upload over the size limit")
+        body = ('{"detail": "%s"}' % self._detail()).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,132 @@
+"""
+Model Bundle Builder
+Packs the Keras head, the EfficientNetB0 ImageNet weights and the genres into a model bundle.
+
+Run once where the ImageNet weights can be downloaded (or are in the Keras
+cache), then ship the bundle directory with the container. The bundle is
+loaded back and compared with the Keras models before it replaces an existing
+one; the comparison is recorded in its manifest. Serve it with
+INFERENCE_BACKEND=bundle, the default when MODEL_BUNDLE_PATH exists.
+
+Usage (from the backend directory):
+    python -m app.tools.build_model_bundle
+    python -m app.tools.build_model_bundle --model cnn-models/new_head.h5 --output /models/bundle-v2
+    python -m app.tools.build_model_bundle --validation-dir data/validation
+"""
+import argparse
+import json
+import os
+import sys
+import shutil
+import tempfile
+import logging
+from datetime import datetime, timezone
+
+from ..config.music_config import MODEL_PATH, LABEL_ENCODER_PATH, MODEL_BUNDLE_PATH
+from ..services.music_classifier import MusicGenreClassifier, EXTRACTOR_VERSION
+from ..services.inference_backends import BundleBackend
+from ..services.model_bundle import (
+    BUNDLE_FORMAT_VERSION, HEAD_ARCHITECTURE_NAME, MANIFEST_NAME, WEIGHTS_NAME, file_sha256, write_weights
+)
+from .check_backend_parity import compare_backends, load_segment_images, synthetic_segment_images
+
+logger = logging.getLogger(__name__)
+
+
+def write_bundle(classifier: MusicGenreClassifier, bundle_dir: str) -> dict:
+    """
+    Write the classifier's Keras models and genres as a bundle.
+
+    Args:
+        classifier: Classifier with the Keras backend loaded
+        bundle_dir: Empty directory to write into
+
+    Returns:
+        The manifest, also written to manifest.json
+    """
+    backend = classifier.backend
+    with open(os.path.join(bundle_dir, HEAD_ARCHITECTURE_NAME), "w") as f:
+        f.write(backend.model.to_json())
+    weights = write_weights(
+        os.path.join(bundle_dir, WEIGHTS_NAME),
+        {"extractor": backend.feature_extractor, "head": backend.model}
+    )
+
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        # Same as the source model, so cached results and embeddings stay valid
+        "model_version": classifier.model_version,
+        "extractor_version": EXTRACTOR_VERSION,
+        "source_model": os.path.basename(classifier.model_path),
+        "genres": classifier.genres,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "files": {
+            name: {"sha256": file_sha256(os.path.join(bundle_dir, name)),
+                   "size_bytes": os.path.getsize(os.path.join(bundle_dir, name))}
+            for name in (HEAD_ARCHITECTURE_NAME, WEIGHTS_NAME)
+        },
+        "weights": weights,
+    }
+    with open(os.path.join(bundle_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def replace_directory(source: str, destination: str):
+    """Move source to destination, replacing an existing directory with as short a gap as possible."""
+    previous = None
+    if os.path.exists(destination):
+        previous = f"{destination}.previous"
+        shutil.rmtree(previous, ignore_errors=True)
+        os.rename(destination, previous)
+    os.rename(source, destination)
+    if previous:
+        shutil.rmtree(previous)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Build a self-contained model bundle from the Keras model.")
+    parser.add_argument("--model", default=MODEL_PATH, help="Keras .h5 head")
+    parser.add_argument("--encoder", default=LABEL_ENCODER_PATH, help="Label encoder pickle file")
+    parser.add_argument("--output", default=MODEL_BUNDLE_PATH, help="Bundle directory to write")
+    parser.add_argument("--validation-dir", help="Audio to compare the bundle with the Keras model on")
+    parser.add_argument("--validation-segments", type=int, default=32)
+    parser.add_argument("--max-probability-diff", type=float, default=1e-4,
+                        help="Fail if any probability differs from the Keras model by more than this")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    classifier = MusicGenreClassifier(args.model, args.encoder, mood_head_path=None)
+    if args.validation_dir:
+        images = load_segment_images(classifier, args.validation_dir, args.validation_segments)
+    else:
+        images = synthetic_segment_images(classifier, args.validation_segments)
+
+    output_dir = os.path.abspath(args.output)
+    os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=os.path.dirname(output_dir), prefix=".bundle-")
+    try:
+        manifest = write_bundle(classifier, staging_dir)
+
+        # The bundle must reproduce the Keras model, not just load
+        validation = compare_backends(classifier.backend, BundleBackend(staging_dir, verify=True), images)
+        logger.info(f"Validation: {json.dumps(validation)}")
+        if validation["max_abs_probability_diff"] > args.max_probability_diff or validation["top1_agreement"] < 1.0:
+            logger.error("The bundle does not reproduce the Keras model; not writing it")
+            return 1
+
+        manifest["validation"] = validation
+        with open(os.path.join(staging_dir, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+        replace_directory(staging_dir, output_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    size_mb = sum(entry["size_bytes"] for entry in manifest["files"].values()) / (1024 * 1024)
+    logger.info(f"Wrote {output_dir} ({size_mb:.1f} MB, model version {manifest['model_version']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Track Index Build
+Trains the IVF lists, and optionally the product quantizer, of the similar-track index.
+
+The API adds every classified track to the index in TRACK_INDEX_DIR and
+searches it exactly until it holds TRACK_INDEX_ANN_MIN_TRACKS tracks. Run this
+once the catalog is near that size, and again when it has grown several times
+over, so the lists stay balanced; tracks added in between are assigned to the
+existing lists. With --pq-subvectors the index can be served with
+TRACK_INDEX_STORAGE=pq. Before the new structure is kept, its recall against
+exact search is measured on tracks from the index; the previous one is
+restored if it falls below --min-recall. The API loads the new structure on
+its next start.
+
+Usage (from the backend directory):
+    python -m app.tools.build_track_index
+    python -m app.tools.build_track_index --lists 1024 --pq-subvectors 64 --min-recall 0.9
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import logging
+import time
+from typing import Dict
+
+import numpy as np
+
+from ..config.music_config import TRACK_INDEX_DIR, TRACK_INDEX_NPROBE, TRACK_INDEX_RERANK
+from ..services.track_index import TrackIndex
+
+logger = logging.getLogger(__name__)
+
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the k vectors with the highest inner product with each query, in one pass over the vectors.
+
+    Returns:
+        int array of shape (queries, k), best first
+    """
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best = np.zeros((len(queries), k), dtype=np.int64)
+    for start in range(0, len(vectors), 65536):
+        chunk = np.asarray(vectors[start:start + 65536])
+        scores = np.concatenate([best_scores, queries @ chunk.T], axis=1)
+        chunk_positions = np.broadcast_to(np.arange(start, start + len(chunk)), (len(queries), len(chunk)))
+        positions = np.concatenate([best, chunk_positions], axis=1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best = np.take_along_axis(positions, top, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best, order, axis=1)
+
+
+def measure_recall(index: TrackIndex, vectors: np.ndarray, queries: np.ndarray, k: int) -> Dict:
+    """
+    Share of the exact k nearest tracks that index.search returns, and its latency.
+
+    Returns:
+        Dictionary with 'recall', 'p50_ms' and 'p95_ms'
+    """
+    k = min(k, len(vectors))
+    truth = exact_neighbours(vectors, queries, k)
+    hits, latencies = 0, []
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        found = index.search(query, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += len({index.ids[p] for p in expected} & {track["id"] for track in found})
+    return {
+        "recall": hits / (len(queries) * k),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Build the IVF and PQ structures of the similar-track index.")
+    parser.add_argument("--index-dir", default=TRACK_INDEX_DIR, help="Index directory")
+    parser.add_argument("--lists", type=int, help="Inverted lists (default: 4 * sqrt(tracks))")
+    parser.add_argument("--pq-subvectors", type=int, default=0,
+                        help="Bytes per product-quantized code, a divisor of 1280 such as 64 (0: no quantizer)")
+    parser.add_argument("--sample-size", type=int, default=100000, help="Tracks k-means is trained on")
+    parser.add_argument("--iterations", type=int, default=10, help="k-means rounds")
+    parser.add_argument("--nprobe", type=int, default=TRACK_INDEX_NPROBE, help="Lists searched when measuring recall")
+    parser.add_argument("--rerank", type=int, default=TRACK_INDEX_RERANK,
+                        help="PQ candidates re-scored per track when measuring recall")
+    parser.add_argument("--queries", type=int, default=200, help="Tracks used as queries when measuring recall")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--min-recall", type=float, default=0.0,
+                        help="Restore the previous structure if recall@k is lower than this")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if not args.index_dir or not os.path.exists(os.path.join(args.index_dir, "vectors.f32")):
+        logger.error(f"No track index at {args.index_dir}")
+        return 1
+    ann_path = os.path.join(args.index_dir, "ann.npz")
+    backup_path = ann_path + ".previous"
+    if os.path.exists(ann_path):
+        shutil.copyfile(ann_path, backup_path)
+
+    try:
+        storage = "pq" if args.pq_subvectors else "float32"
+        index = TrackIndex(args.index_dir, storage=storage, nprobe=args.nprobe, ann_min_tracks=0, rerank=args.rerank)
+        index.build(args.lists, args.pq_subvectors, args.sample_size, args.iterations, args.seed)
+
+        vectors = np.memmap(os.path.join(args.index_dir, "vectors.f32"), dtype=np.float32, mode="r",
+                            shape=(len(index), index.dim))
+        rng = np.random.default_rng(args.seed)
+        queries = np.asarray(vectors[np.sort(rng.choice(len(index), min(args.queries, len(index)), replace=False))])
+        quality = measure_recall(index, vectors, queries, args.k)
+        logger.info(f"{json.dumps(index.stats())}, recall@{args.k} {json.dumps(quality)}")
+        if quality["recall"] < args.min_recall:
+            logger.error(f"Recall {quality['recall']:.3f} is below {args.min_recall}; restoring the previous structure")
+            if os.path.exists(backup_path):
+                os.replace(backup_path, ann_path)
+            else:
+                os.remove(ann_path)
+            return 1
+    finally:
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+
+    logger.info(f"Built the track index in {args.index_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+"""
+Bulk Library Classification
+Classifies whole audio libraries offline, with resumable output.
+
+Decoding and spectrogram rendering run in a pool of worker processes
+(MusicGenreClassifier.prepare_track), while this process runs the model on
+batches that mix the segments of several tracks. A bounded number of tracks is
+in flight, so the workers keep preparing the next tracks while a batch runs.
+
+Results are appended to a JSONL file or written as Parquet parts to a
+directory, and the output doubles as the checkpoint: a rerun with the same
+output skips every file it already holds, so a killed run resumes where it
+stopped. Files that failed are skipped as well unless --retry-failed is given.
+
+Usage (from the backend directory):
+    python -m app.tools.bulk_classify /music/library --output results.jsonl
+    python -m app.tools.bulk_classify --manifest files.txt --output results.parquet --workers 7
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import logging
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from ..config.music_config import (
+    SERVING_MODEL_PATH,
+    LABEL_ENCODER_PATH,
+    DEFAULT_SEGMENT_DURATION,
+    MAX_SEGMENTS_PER_TRACK,
+    SUPPORTED_AUDIO_FORMATS,
+    INFERENCE_NUM_THREADS,
+)
+from ..services.music_classifier import MusicGenreClassifier
+
+logger = logging.getLogger(__name__)
+
+# Preprocessing-only classifier of the current worker process
+_worker_classifier = None
+_worker_options: Dict = {}
+
+
+def _init_worker(segment_duration: int, max_segments: int, segment_hop: Optional[float]):
+    """Create the decoding classifier once per worker process."""
+    global _worker_classifier, _worker_options
+    _worker_classifier = MusicGenreClassifier(SERVING_MODEL_PATH, LABEL_ENCODER_PATH, preprocessing_only=True)
+    _worker_options = {"segment_duration": segment_duration, "max_segments": max_segments, "segment_hop": segment_hop}
+
+
+def _prepare(path: str) -> Dict:
+    """Decode a file and render its segment images; errors are returned, not raised."""
+    try:
+        prepared = _worker_classifier.prepare_track(path, **_worker_options)
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+    prepared["path"] = path
+    return prepared
+
+
+def iter_audio_files(inputs: Iterable[str], manifest: Optional[str] = None) -> Iterator[str]:
+    """
+    List the files to classify.
+
+    Args:
+        inputs: Directories, searched recursively for supported audio files, or single files
+        manifest: Text file with one path per line, or JSONL with a 'path' field;
+            relative paths are resolved against the manifest's directory
+
+    Yields:
+        Absolute file paths, in a stable order
+    """
+    for entry in inputs:
+        if os.path.isfile(entry):
+            yield os.path.abspath(entry)
+            continue
+        for root, dirs, files in os.walk(entry):
+            dirs.sort()
+            for name in sorted(files):
+                if Path(name).suffix.lower() in SUPPORTED_AUDIO_FORMATS:
+                    yield os.path.abspath(os.path.join(root, name))
+
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                path = json.loads(line)["path"] if line.startswith("{") else line
+                yield os.path.abspath(os.path.join(base, path))
+
+
+class JSONLResultWriter:
+    """Appends one JSON object per file; every write is flushed to disk."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def completed(self) -> Dict[str, str]:
+        """Status of every file already in the output, dropping a line cut off by a crash."""
+        statuses = {}
+        if not os.path.exists(self.path):
+            return statuses
+        with open(self.path, "rb+") as f:
+            valid_bytes = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                row = json.loads(line)
+                statuses[row["path"]] = row["status"]
+                valid_bytes += len(line)
+            f.truncate(valid_bytes)
+        return statuses
+
+    def write(self, rows: List[Dict]):
+        if self._file is None:
+            self._file = open(self.path, "a")
+        for row in rows:
+            self._file.write(json.dumps(row) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class ParquetResultWriter:
+    """
+    Writes results as numbered Parquet files in a directory; nested fields are stored as JSON strings.
+
+    Rows are buffered and written flush_rows at a time, so a crash loses at most
+    that many results, which the next run classifies again.
+    """
+
+    def __init__(self, path: str, flush_rows: int = 1000):
+        import pyarrow as pa  # fail before any work is done if Parquet support is missing
+
+        self.schema = pa.schema([
+            ("path", pa.string()),
+            ("status", pa.string()),
+            ("predicted_genre", pa.string()),
+            ("confidence", pa.float64()),
+            ("genre_distribution", pa.string()),
+            ("duration", pa.float64()),
+            ("num_segments", pa.int64()),
+            ("segment_duration", pa.int64()),
+            ("model_version", pa.string()),
+            ("segments", pa.string()),
+            ("error", pa.string()),
+        ])
+        self.path = path
+        self.flush_rows = flush_rows
+        self._rows: List[Dict] = []
+        os.makedirs(path, exist_ok=True)
+        self._next_part = len(self._parts())
+
+    def _parts(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.path) if name.startswith("part-") and name.endswith(".parquet"))
+
+    def completed(self) -> Dict[str, str]:
+        import pyarrow.parquet as pq
+
+        statuses = {}
+        for name in self._parts():
+            table = pq.read_table(os.path.join(self.path, name), columns=["path", "status"])
+            statuses.update(zip(table.column("path").to_pylist(), table.column("status").to_pylist()))
+        return statuses
+
+    def write(self, rows: List[Dict]):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.flush_rows:
+            self._write_part()
+
+    def _write_part(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = {}
+        for name in self.schema.names:
+            values = [row.get(name) for row in self._rows]
+            if name in ("genre_distribution", "segments"):
+                values = [json.dumps(value) if value is not None else None for value in values]
+            columns[name] = values
+
+        # Written under a temporary name, so a crash never leaves a truncated part behind
+        final_path = os.path.join(self.path, f"part-{self._next_part:05d}.parquet")
+        pq.write_table(pa.table(columns, schema=self.schema), final_path + ".tmp")
+        os.replace(final_path + ".tmp", final_path)
+        self._next_part += 1
+        self._rows = []
+
+    def close(self):
+        if self._rows:
+            self._write_part()
+
+
+def _result_row(classifier: MusicGenreClassifier, prepared: Dict, probabilities: np.ndarray,
+                include_segments: bool) -> Dict:
+    """Flatten a track result into an output row."""
+    result = classifier.result_from_probabilities(
+        probabilities, prepared["start_times"], prepared["segment_duration"], prepared["total_duration"]
+    )
+    row = {
+        "path": prepared["path"],
+        "status": "ok",
+        "predicted_genre": result["overall_prediction"]["predicted_genre"],
+        "confidence": float(result["overall_prediction"]["confidence"]),
+        "genre_distribution": result["overall_prediction"]["genre_distribution"],
+        "duration": result["track_info"]["duration"],
+        "num_segments": result["track_info"]["num_segments_analyzed"],
+        "segment_duration": result["track_info"]["segment_duration"],
+        "model_version": result["model_version"],
+    }
+    if include_segments:
+        row["segments"] = [
+            {"start_time": s["start_time"], "predicted_genre": s["predicted_genre"], "confidence": s["confidence"]}
+            for s in result["segment_predictions"]
+        ]
+    return row
+
+
+class _Progress:
+    """Counts finished files and logs throughput at a fixed interval."""
+
+    def __init__(self, report_every: float):
+        self.report_every = report_every
+        self.started = time.perf_counter()
+        self._last_report = self.started
+        self.files = 0
+        self.failed = 0
+        self.segments = 0
+        self.inference_seconds = 0.0
+
+    def summary(self) -> Dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "files": self.files,
+            "failed": self.failed,
+            "segments": self.segments,
+            "elapsed_seconds": round(elapsed, 1),
+            "files_per_second": round(self.files / elapsed, 2) if elapsed else 0.0,
+            "segments_per_second": round(self.segments / elapsed, 2) if elapsed else 0.0,
+            # Close to 1 means inference is the bottleneck, close to 0 means decoding is
+            "inference_busy": round(self.inference_seconds / elapsed, 2) if elapsed else 0.0,
+        }
+
+    def maybe_report(self, in_flight: int):
+        now = time.perf_counter()
+        if now - self._last_report >= self.report_every:
+            self._last_report = now
+            logger.info(f"Progress: {json.dumps(self.summary())}, in flight: {in_flight}")
+
+
+def run(classifier: MusicGenreClassifier, paths: Iterable[str], writer, workers: int, batch_size: int,
+        segment_duration: int, max_segments: int, segment_hop: Optional[float] = None,
+        include_segments: bool = False, report_every: float = 10.0) -> Dict:
+    """
+    Classify files with a pool of decode workers feeding batched inference.
+
+    Args:
+        classifier: Classifier with the model loaded, used for inference in this process
+        paths: Files to classify
+        writer: JSONLResultWriter or ParquetResultWriter
+        workers: Decode worker processes
+        batch_size: Segments per forward pass
+        segment_duration: Duration of each segment in seconds
+        max_segments: Hard cap on segments per file (0: no cap)
+        segment_hop: Seconds between segment starts (default: segment_duration)
+        include_segments: Add per-segment predictions to each row
+        report_every: Seconds between progress log lines
+
+    Returns:
+        Throughput summary
+    """
+    progress = _Progress(report_every)
+    paths = iter(paths)
+    ready: List[Dict] = []  # prepared tracks waiting for inference
+    ready_segments = 0
+
+    def run_inference():
+        nonlocal ready, ready_segments
+        started = time.perf_counter()
+        # One forward pass per batch_size segments, across track boundaries
+        probabilities = classifier.predict_images(
+            np.concatenate([prepared["images"] for prepared in ready]), max_batch_size=batch_size
+        )
+        offsets = np.cumsum([len(prepared["images"]) for prepared in ready])[:-1]
+        rows = [
+            _result_row(classifier, prepared, track_probabilities, include_segments)
+            for prepared, track_probabilities in zip(ready, np.split(probabilities, offsets))
+        ]
+        progress.inference_seconds += time.perf_counter() - started
+        writer.write(rows)
+        progress.files += len(rows)
+        progress.segments += ready_segments
+        ready, ready_segments = [], 0
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(segment_duration, max_segments, segment_hop)) as executor:
+        in_flight = set()
+        exhausted = False
+        try:
+            while True:
+                # Keep every worker busy with one file and one queued behind it
+                while not exhausted and len(in_flight) < workers * 2:
+                    path = next(paths, None)
+                    if path is None:
+                        exhausted = True
+                    else:
+                        in_flight.add(executor.submit(_prepare, path))
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                failures = []
+                for future in done:
+                    prepared = future.result()
+                    if "error" in prepared:
+                        logger.warning(f"Failed to prepare {prepared['path']}: {prepared['error']}")
+                        failures.append({"path": prepared["path"], "status": "error", "error": prepared["error"]})
+                    else:
+                        ready.append(prepared)
+                        ready_segments += len(prepared["images"])
+                if failures:
+                    writer.write(failures)
+                    progress.files += len(failures)
+                    progress.failed += len(failures)
+
+                # Run full batches, or whatever is left once nothing else is coming
+                if ready and (ready_segments >= batch_size or (exhausted and not in_flight)):
+                    run_inference()
+                progress.maybe_report(len(in_flight))
+        except KeyboardInterrupt:
+            logger.warning("Interrupted; finished files are saved and will be skipped when resuming")
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            writer.close()
+
+    return progress.summary()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Classify an audio library offline with resumable output.")
+    parser.add_argument("inputs", nargs="*", help="Directories (searched recursively) or files to classify")
+    parser.add_argument("--manifest", help="Text file with one path per line, or JSONL with a 'path' field")
+    parser.add_argument("--output", required=True, help="Results file (.jsonl) or directory (.parquet)")
+    parser.add_argument("--model", default=SERVING_MODEL_PATH, help="Model file (.h5, .tflite or .onnx)")
+    parser.add_argument("--encoder", default=LABEL_ENCODER_PATH, help="Label encoder pickle file")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Decode worker processes (default: one per core, minus one for inference)")
+    parser.add_argument("--threads", type=int, default=INFERENCE_NUM_THREADS,
+                        help="Inference threads for the TFLite and ONNX backends (default: runtime decides)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Segments per forward pass")
+    parser.add_argument("--segment-duration", type=int, default=DEFAULT_SEGMENT_DURATION)
+    parser.add_argument("--segment-hop", type=float, help="Seconds between segment starts (default: no overlap)")
+    parser.add_argument("--max-segments", type=int, default=MAX_SEGMENTS_PER_TRACK,
+                        help="Hard cap on segments per file (0: no cap)")
+    parser.add_argument("--segments", action="store_true", help="Include per-segment predictions")
+    parser.add_argument("--retry-failed", action="store_true", help="Classify files that failed in a previous run")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if not args.inputs and not args.manifest:
+        parser.error("Give at least one directory or file, or --manifest")
+
+    if args.output.endswith(".parquet"):
+        writer = ParquetResultWriter(args.output)
+    else:
+        writer = JSONLResultWriter(args.output)
+
+    # The output is the checkpoint: skip what an earlier run already finished
+    completed = writer.completed()
+    skip = {path for path, status in completed.items() if status == "ok" or not args.retry_failed}
+    if skip:
+        logger.info(f"Resuming: {len(skip)} files already in {args.output}")
+    paths = (path for path in iter_audio_files(args.inputs, args.manifest) if path not in skip)
+
+    # Rows carry genre only, so their model version must not include a mood head
+    classifier = MusicGenreClassifier(args.model, args.encoder, num_threads=args.threads, mood_head_path=None)
+    summary = run(
+        classifier, paths, writer, args.workers, args.batch_size, args.segment_duration, args.max_segments,
+        args.segment_hop, args.segments, args.report_every
+    )
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
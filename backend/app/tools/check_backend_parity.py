@@ -0,0 +1,176 @@
+"""
+Backend Parity Check
+Checks that inference backends agree on genre probabilities for the same audio.
+
+The reference model (the Keras .h5 by default) decodes and renders the audio;
+every candidate backend then runs the same spectrogram images and is compared
+on top-1 agreement, probability differences and embedding similarity. Exits
+with status 1 if any candidate falls outside the thresholds, so it can gate a
+deployment that switches INFERENCE_BACKEND.
+
+Usage (from the backend directory):
+    python -m app.tools.check_backend_parity --audio-dir /path/to/audio
+    python -m app.tools.check_backend_parity --candidates model.tflite model.onnx
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import logging
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from ..config.music_config import (
+    MODEL_PATH,
+    LABEL_ENCODER_PATH,
+    FUSED_MODEL_PATH,
+    ONNX_MODEL_PATH,
+    SAMPLE_RATE,
+    DEFAULT_SEGMENT_DURATION,
+    SUPPORTED_AUDIO_FORMATS,
+)
+from ..services.music_classifier import MusicGenreClassifier
+from ..services.inference_backends import InferenceBackend, create_backend
+
+logger = logging.getLogger(__name__)
+
+
+def load_segment_images(classifier: MusicGenreClassifier, audio_dir: str, max_segments: int,
+                        segment_duration: int = DEFAULT_SEGMENT_DURATION) -> np.ndarray:
+    """
+    Render spectrogram images of consecutive segments of the audio files in a directory.
+
+    Args:
+        classifier: Classifier used to decode and render
+        audio_dir: Directory searched recursively for supported audio files
+        max_segments: Stop after this many segments
+        segment_duration: Segment length in seconds
+
+    Returns:
+        float32 array of shape (N, 224, 224, 3)
+    """
+    paths = sorted(p for p in Path(audio_dir).rglob("*") if p.suffix.lower() in SUPPORTED_AUDIO_FORMATS)
+    if not paths:
+        raise ValueError(f"No supported audio files found in {audio_dir}")
+
+    images = []
+    segment_samples = segment_duration * SAMPLE_RATE
+    for path in paths:
+        y = classifier.load_audio(str(path))
+        for start in range(0, max(1, len(y) - segment_samples + 1), segment_samples):
+            images.append(classifier._spectrogram_image(y[start:start + segment_samples], SAMPLE_RATE))
+            if len(images) >= max_segments:
+                return np.stack(images)
+    return np.stack(images)
+
+
+def synthetic_segment_images(classifier: MusicGenreClassifier, count: int, seconds: int = 5,
+                             seed: int = 0) -> np.ndarray:
+    """Spectrograms of random tone mixtures, for a rough check when no audio is available."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(seconds * SAMPLE_RATE) / SAMPLE_RATE
+    images = []
+    for _ in range(count):
+        y = sum(rng.uniform(0.05, 0.3) * np.sin(2 * np.pi * rng.uniform(50, 4000) * t) for _ in range(4))
+        y = (y + 0.02 * rng.standard_normal(t.size)).astype(np.float32)
+        images.append(classifier._spectrogram_image(y, SAMPLE_RATE))
+    return np.stack(images)
+
+
+def _run(backend: InferenceBackend, images: np.ndarray, batch_size: int):
+    """Run a backend over images in batches, returning probabilities, embeddings and seconds taken."""
+    started = time.perf_counter()
+    outputs = [backend.predict(images[start:start + batch_size]) for start in range(0, len(images), batch_size)]
+    seconds = time.perf_counter() - started
+    return np.concatenate([p for p, _ in outputs]), np.concatenate([f for _, f in outputs]), seconds
+
+
+def compare_backends(reference: InferenceBackend, candidate: InferenceBackend, images: np.ndarray,
+                     batch_size: int = 8) -> Dict:
+    """
+    Compare a candidate backend with the reference on the same images.
+
+    Args:
+        reference: Backend whose outputs are taken as correct
+        candidate: Backend to check
+        images: Spectrogram images to compare on
+        batch_size: Images per forward pass
+
+    Returns:
+        Top-1 agreement, probability and embedding differences and per-segment latency of both
+    """
+    # One untimed batch each, so graph tracing and allocation don't count as latency
+    reference.predict(images[:1])
+    candidate.predict(images[:1])
+
+    reference_probabilities, reference_features, reference_seconds = _run(reference, images, batch_size)
+    probabilities, features, candidate_seconds = _run(candidate, images, batch_size)
+
+    flat_reference = reference_features.reshape(len(images), -1)
+    flat_features = features.reshape(len(images), -1)
+    cosine = np.sum(flat_reference * flat_features, axis=1) / np.maximum(
+        np.linalg.norm(flat_reference, axis=1) * np.linalg.norm(flat_features, axis=1), 1e-12
+    )
+    head_probabilities = candidate.predict_head(reference_features[:batch_size])
+
+    return {
+        "segments": len(images),
+        "top1_agreement": float(np.mean(reference_probabilities.argmax(axis=1) == probabilities.argmax(axis=1))),
+        "max_abs_probability_diff": float(np.max(np.abs(reference_probabilities - probabilities))),
+        "mean_abs_probability_diff": float(np.mean(np.abs(reference_probabilities - probabilities))),
+        "max_abs_head_probability_diff": float(np.max(np.abs(
+            reference_probabilities[:batch_size] - head_probabilities
+        ))),
+        "min_embedding_cosine": float(cosine.min()),
+        "reference_ms_per_segment": 1000 * reference_seconds / len(images),
+        "candidate_ms_per_segment": 1000 * candidate_seconds / len(images),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check that inference backends agree on genre probabilities.")
+    parser.add_argument("--reference", default=MODEL_PATH, help="Reference model (default: the Keras .h5)")
+    parser.add_argument("--candidates", nargs="+",
+                        help="Models to check (default: the configured TFLite and ONNX exports that exist)")
+    parser.add_argument("--encoder", default=LABEL_ENCODER_PATH, help="Label encoder pickle file")
+    parser.add_argument("--audio-dir", help="Audio to compare on (default: synthetic tones)")
+    parser.add_argument("--segments", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--min-agreement", type=float, default=0.98, help="Lowest accepted top-1 agreement")
+    parser.add_argument("--max-probability-diff", type=float, default=0.05,
+                        help="Largest accepted absolute probability difference")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    candidates: List[str] = args.candidates or [
+        path for path in (FUSED_MODEL_PATH, ONNX_MODEL_PATH) if os.path.exists(path)
+    ]
+    if not candidates:
+        parser.error("No candidate models given and no exports found; run app.tools.export_fused_model first")
+
+    classifier = MusicGenreClassifier(args.reference, args.encoder)
+    if args.audio_dir:
+        images = load_segment_images(classifier, args.audio_dir, args.segments)
+    else:
+        logger.warning("No audio directory given; comparing on synthetic tones only")
+        images = synthetic_segment_images(classifier, args.segments)
+
+    failed = False
+    for path in candidates:
+        candidate = create_backend(path)
+        report = compare_backends(classifier.backend, candidate, images, args.batch_size)
+        passed = (report["top1_agreement"] >= args.min_agreement
+                  and report["max_abs_probability_diff"] <= args.max_probability_diff)
+        failed = failed or not passed
+        print(json.dumps({"candidate": path, "backend": candidate.name,
+                          "quantization": candidate.quantization, "passed": passed, **report}, indent=2))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
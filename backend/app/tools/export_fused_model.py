@@ -0,0 +1,268 @@
+"""
+Fused Model Export
+Exports preprocessing, the EfficientNetB0 extractor and the genre head as one TFLite or ONNX model.
+
+The Keras models are traced into a single graph that maps images to
+probabilities and embeddings, plus a head-only graph for re-scoring cached
+embeddings. TFLite exports carry both as 'classify' and 'head' signatures;
+ONNX exports write the head next to the model as '<name>_head.onnx', and with
+--external-weights keep the weights of both in '<name>.onnx.data' files that
+worker processes can share (see SHARED_MODEL_WEIGHTS). The export is checked
+against the Keras models before it is written. Serve it with
+INFERENCE_BACKEND=tflite or INFERENCE_BACKEND=onnx.
+
+Usage (from the backend directory):
+    python -m app.tools.export_fused_model --quantization float16
+    python -m app.tools.export_fused_model --quantization int8 --calibration-dir data/calibration
+    python -m app.tools.export_fused_model --format onnx --quantization dynamic
+    python -m app.tools.export_fused_model --format onnx --quantization none --external-weights
+"""
+import argparse
+import json
+import os
+import sys
+import shutil
+import tempfile
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+
+from ..config.music_config import (
+    MODEL_PATH,
+    LABEL_ENCODER_PATH,
+    FUSED_MODEL_PATH,
+    ONNX_MODEL_PATH,
+    IMAGE_SIZE,
+)
+from ..services.music_classifier import MusicGenreClassifier, EXTRACTOR_VERSION
+from ..services.inference_backends import (
+    CLASSIFY_SIGNATURE, HEAD_SIGNATURE, create_backend, manifest_path, onnx_head_path, onnx_weights_path
+)
+from .check_backend_parity import compare_backends, load_segment_images, synthetic_segment_images
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = {
+    "tflite": ("none", "float16", "dynamic", "int8"),
+    "onnx": ("none", "dynamic"),
+}
+
+ONNX_OPSET = 17
+
+
+def _graph_functions(classifier: MusicGenreClassifier):
+    """The 'classify' and 'head' computations of the Keras backend, with their input signatures."""
+    import tensorflow as tf
+    from tensorflow.keras.applications.efficientnet import preprocess_input
+
+    extractor, head = classifier.backend.feature_extractor, classifier.backend.model
+
+    def classify(images):
+        features = extractor(preprocess_input(images), training=False)
+        return {"probabilities": head(features, training=False), "features": features}
+
+    def head_only(features):
+        return {"probabilities": head(features, training=False)}
+
+    image_spec = tf.TensorSpec((None, IMAGE_SIZE[0], IMAGE_SIZE[1], 3), tf.float32, name="images")
+    feature_spec = tf.TensorSpec((None,) + tuple(extractor.output_shape[1:]), tf.float32, name="features")
+    return (classify, image_spec), (head_only, feature_spec)
+
+
+def export_tflite(classifier: MusicGenreClassifier, output_path: str, quantization: str,
+                  calibration_images: Optional[np.ndarray] = None):
+    """
+    Convert the fused graph to TFLite.
+
+    Args:
+        classifier: Classifier with the Keras backend loaded
+        output_path: Where to write the .tflite file
+        quantization: 'none', 'float16' (half-precision weights), 'dynamic' (int8 weights)
+            or 'int8' (int8 weights and activations, calibrated on calibration_images)
+        calibration_images: Spectrogram images for int8 calibration
+    """
+    import keras
+    import tensorflow as tf
+
+    (classify, image_spec), (head_only, feature_spec) = _graph_functions(classifier)
+    archive = keras.export.ExportArchive()
+    archive.track(classifier.backend.feature_extractor)
+    archive.track(classifier.backend.model)
+    archive.add_endpoint(CLASSIFY_SIGNATURE, classify, input_signature=[image_spec])
+    archive.add_endpoint(HEAD_SIGNATURE, head_only, input_signature=[feature_spec])
+
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        archive.write_out(saved_model_dir, verbose=False)
+        converter = tf.lite.TFLiteConverter.from_saved_model(
+            saved_model_dir, signature_keys=[CLASSIFY_SIGNATURE, HEAD_SIGNATURE]
+        )
+        if quantization != "none":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == "float16":
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantization == "int8":
+            if calibration_images is None or len(calibration_images) == 0:
+                raise ValueError("int8 quantization needs calibration audio")
+
+            def representative_dataset():
+                for image in calibration_images:
+                    image = image[np.newaxis]
+                    _, features = classifier.predict_images(image, return_features=True)
+                    yield CLASSIFY_SIGNATURE, {"images": image}
+                    yield HEAD_SIGNATURE, {"features": features}
+
+            # Inputs and outputs stay float32, so the runtime code is the same for every mode
+            converter.representative_dataset = representative_dataset
+
+        flatbuffer = converter.convert()
+
+    with open(output_path, "wb") as f:
+        f.write(flatbuffer)
+
+
+def export_onnx(classifier: MusicGenreClassifier, output_path: str, quantization: str,
+                external_weights: bool = False):
+    """
+    Convert the fused graph and the head to ONNX.
+
+    Args:
+        classifier: Classifier with the Keras backend loaded
+        output_path: Where to write the .onnx file; the head goes to onnx_head_path(output_path)
+        quantization: 'none' or 'dynamic' (int8 weights)
+        external_weights: Write each model's weights to onnx_weights_path() instead of embedding them
+    """
+    import onnx
+    import tensorflow as tf
+    import tf2onnx
+    from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+    graphs = zip(_graph_functions(classifier), (output_path, onnx_head_path(output_path)))
+    for (function, spec), path in graphs:
+        # Freeze first: the converter misses some Keras variables, e.g. the normalization statistics
+        concrete = tf.function(function, input_signature=[spec]).get_concrete_function()
+        frozen = convert_variables_to_constants_v2(concrete)
+        # Freezing drops the output names; dict outputs are flattened in sorted key order
+        outputs = list(zip(sorted(concrete.structured_outputs), frozen.outputs))
+        model_proto, _ = tf2onnx.convert.from_graph_def(
+            frozen.graph.as_graph_def(),
+            input_names=[tensor.name for tensor in frozen.inputs],
+            output_names=[tensor.name for _, tensor in outputs],
+            opset=ONNX_OPSET
+        )
+
+        # Use the signature names instead of TensorFlow's 'images:0' / 'Identity:0'
+        names = {frozen.inputs[0].name: spec.name}
+        names.update({tensor.name: name for name, tensor in outputs})
+        for node in model_proto.graph.node:
+            node.input[:] = [names.get(name, name) for name in node.input]
+            node.output[:] = [names.get(name, name) for name in node.output]
+        for value in list(model_proto.graph.input) + list(model_proto.graph.output):
+            value.name = names.get(value.name, value.name)
+        onnx.save(model_proto, path)
+
+        if quantization == "dynamic":
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(path, path, weight_type=QuantType.QInt8)
+
+        if external_weights:
+            # onnx pads large tensors to page-aligned offsets, which lets ONNX Runtime map them
+            onnx.save_model(
+                onnx.load(path), path, save_as_external_data=True, all_tensors_to_one_file=True,
+                location=os.path.basename(onnx_weights_path(path))
+            )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export the genre classifier as a fused TFLite or ONNX model.")
+    parser.add_argument("--model", default=MODEL_PATH, help="Keras .h5 head to export")
+    parser.add_argument("--encoder", default=LABEL_ENCODER_PATH, help="Label encoder pickle file")
+    parser.add_argument("--format", choices=sorted(QUANTIZATION_MODES), default="tflite")
+    parser.add_argument("--output", help="Where to write the model (default: FUSED_MODEL_PATH or ONNX_MODEL_PATH)")
+    parser.add_argument("--quantization", default="float16",
+                        help="tflite: none, float16, dynamic or int8; onnx: none or dynamic")
+    parser.add_argument("--calibration-dir", help="Audio used for int8 calibration and the accuracy check")
+    parser.add_argument("--calibration-segments", type=int, default=200)
+    parser.add_argument("--validation-dir", help="Audio for the accuracy check (default: --calibration-dir)")
+    parser.add_argument("--validation-segments", type=int, default=200)
+    parser.add_argument("--min-agreement", type=float, default=0.98,
+                        help="Fail if top-1 agreement with the Keras model is lower than this")
+    parser.add_argument("--force", action="store_true", help="Write the model even if the accuracy check fails")
+    parser.add_argument("--external-weights", action="store_true",
+                        help="onnx: keep the weights in separate files that processes can map and share")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if args.quantization not in QUANTIZATION_MODES[args.format]:
+        parser.error(f"--quantization for {args.format} must be one of {QUANTIZATION_MODES[args.format]}")
+    if args.quantization == "int8" and not args.calibration_dir:
+        parser.error("--quantization int8 needs --calibration-dir")
+    output_path = args.output or (ONNX_MODEL_PATH if args.format == "onnx" else FUSED_MODEL_PATH)
+
+    classifier = MusicGenreClassifier(args.model, args.encoder, mood_head_path=None)
+
+    calibration_images = None
+    if args.calibration_dir:
+        calibration_images = load_segment_images(classifier, args.calibration_dir, args.calibration_segments)
+        logger.info(f"Loaded {len(calibration_images)} calibration segments")
+
+    validation_dir = args.validation_dir or args.calibration_dir
+    if validation_dir:
+        validation_images = load_segment_images(classifier, validation_dir, args.validation_segments)
+    else:
+        logger.warning("No validation audio given; checking accuracy on synthetic tones only")
+        validation_images = synthetic_segment_images(classifier, 32)
+
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=output_dir) as staging_dir:
+        # Export and check in a staging directory, so a failed export never replaces a served model
+        candidate_path = os.path.join(staging_dir, os.path.basename(output_path))
+        if args.format == "onnx":
+            export_onnx(classifier, candidate_path, args.quantization, args.external_weights)
+        else:
+            export_tflite(classifier, candidate_path, args.quantization, calibration_images)
+
+        accuracy = compare_backends(classifier.backend, create_backend(candidate_path), validation_images)
+        logger.info(f"Accuracy check: {json.dumps(accuracy)}")
+        if accuracy["top1_agreement"] < args.min_agreement and not args.force:
+            logger.error(
+                f"Top-1 agreement {accuracy['top1_agreement']:.3f} is below {args.min_agreement}; "
+                "not writing the model (use --force to write it anyway)"
+            )
+            return 1
+
+        files = [candidate_path]
+        if args.format == "onnx":
+            files.append(onnx_head_path(candidate_path))
+            files.extend(onnx_weights_path(path) for path in list(files) if os.path.exists(onnx_weights_path(path)))
+        manifest = {
+            "format": args.format,
+            "quantization": args.quantization,
+            "files": [os.path.basename(path) for path in files],
+            "extractor_version": EXTRACTOR_VERSION,
+            "source_model": os.path.basename(args.model),
+            "source_model_version": classifier.model_version,
+            "genres": classifier.genres,
+            "size_bytes": sum(os.path.getsize(path) for path in files),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "accuracy": accuracy,
+        }
+        for path in files:
+            shutil.move(path, os.path.join(output_dir, os.path.basename(path)))
+        if args.format == "onnx" and not args.external_weights:
+            # Weights files of an earlier export with --external-weights would look current
+            for path in (output_path, onnx_head_path(output_path)):
+                if os.path.exists(onnx_weights_path(path)):
+                    os.remove(onnx_weights_path(path))
+        with open(manifest_path(output_path), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    logger.info(f"Wrote {output_path} ({manifest['size_bytes'] / (1024 * 1024):.1f} MB, {args.quantization})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""
+Mood Head Training
+Trains the mood head on the EfficientNetB0 embeddings the genre head already uses.
+
+The training audio is a directory with one subdirectory of tracks per mood,
+e.g. data/moods/happy/*.mp3 and data/moods/sad/*.mp3. Every track is split
+into segments as in classify_full_track, and the embeddings of its segments,
+averaged over their grid, are the examples for its mood. A standardized
+multinomial logistic regression is fitted on them. Tracks are held out for
+validation as a whole, so segments of one track are never on both sides; the
+head that is written is then refitted on every track. The written head is
+loaded back and checked against the fitted model. The API picks it up from
+MOOD_HEAD_PATH on its next start, or with the next model version deployed.
+
+Usage (from the backend directory):
+    python -m app.tools.train_mood_head data/moods
+    python -m app.tools.train_mood_head data/moods --output cnn-models/mood_head_v2.npz --max-segments 10
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ..config.music_config import (
+    SERVING_MODEL_PATH,
+    LABEL_ENCODER_PATH,
+    MOOD_HEAD_PATH,
+    DEFAULT_SEGMENT_DURATION,
+    SUPPORTED_AUDIO_FORMATS,
+)
+from ..services.music_classifier import MusicGenreClassifier, EXTRACTOR_VERSION
+from ..services.mood_head import MoodHead, pool_embeddings, save_mood_head
+
+logger = logging.getLogger(__name__)
+
+
+def collect_tracks(audio_dir: str) -> List[Tuple[str, str]]:
+    """
+    List the labelled training tracks.
+
+    Args:
+        audio_dir: Directory with one subdirectory per mood, searched recursively
+
+    Returns:
+        (path, mood) pairs in a stable order
+    """
+    tracks = []
+    for mood_dir in sorted(p for p in Path(audio_dir).iterdir() if p.is_dir()):
+        paths = sorted(p for p in mood_dir.rglob("*") if p.suffix.lower() in SUPPORTED_AUDIO_FORMATS)
+        tracks.extend((str(path), mood_dir.name) for path in paths)
+    return tracks
+
+
+def embed_tracks(classifier: MusicGenreClassifier, tracks: List[Tuple[str, str]], segment_duration: int,
+                 max_segments: int) -> Tuple[List[np.ndarray], List[str]]:
+    """
+    Pooled segment embeddings of every track; tracks that cannot be decoded are skipped.
+
+    Returns:
+        Tuple of per-track (segments, 1280) arrays and their moods
+    """
+    features, moods = [], []
+    for i, (path, mood) in enumerate(tracks, 1):
+        try:
+            result = classifier.classify_full_track(
+                path, segment_duration, return_embeddings=True, max_segments=max_segments
+            )
+        except Exception as e:
+            logger.warning(f"Skipping {path}: {str(e)}")
+            continue
+        features.append(pool_embeddings(result['segment_embeddings']))
+        moods.append(mood)
+        if i % 50 == 0:
+            logger.info(f"Embedded {i} of {len(tracks)} tracks")
+    return features, moods
+
+
+def fit(features: List[np.ndarray], moods: List[str], regularization: float):
+    """
+    Fit a standardized logistic regression on the segments of the given tracks.
+
+    Returns:
+        The fitted scikit-learn pipeline
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    x = np.concatenate(features)
+    y = np.concatenate([[mood] * len(track) for track, mood in zip(features, moods)])
+    model = make_pipeline(StandardScaler(), LogisticRegression(C=regularization, max_iter=2000))
+    return model.fit(x, y)
+
+
+def evaluate(model, features: List[np.ndarray], moods: List[str]) -> Dict:
+    """
+    Segment accuracy, and track accuracy by majority vote as the API reports it.
+
+    Returns:
+        Dictionary with 'segment_accuracy', 'track_accuracy' and 'per_mood' track accuracy
+    """
+    segment_hits, segments, track_hits = 0, 0, Counter()
+    for track, mood in zip(features, moods):
+        predicted = model.predict(track)
+        segment_hits += int(np.sum(predicted == mood))
+        segments += len(track)
+        track_hits[mood] += int(Counter(predicted).most_common(1)[0][0] == mood)
+    tracks = Counter(moods)
+    return {
+        "segment_accuracy": segment_hits / segments,
+        "track_accuracy": sum(track_hits.values()) / len(moods),
+        "per_mood": {mood: track_hits[mood] / count for mood, count in sorted(tracks.items())},
+    }
+
+
+def head_arrays(model) -> Dict[str, np.ndarray]:
+    """Convert the fitted pipeline to the arrays MoodHead uses."""
+    scaler, regression = model[0], model[-1]
+    weights, bias = regression.coef_.T, regression.intercept_
+    if len(regression.classes_) == 2:
+        # A binary fit has one logit z for the second class; softmax over (-z/2, z/2) is sigmoid(z)
+        weights = np.concatenate([-weights, weights], axis=1) / 2
+        bias = np.concatenate([-bias, bias]) / 2
+    return {
+        "moods": [str(mood) for mood in regression.classes_],
+        # A constant feature has scale 0; the scaler leaves it unscaled
+        "mean": scaler.mean_,
+        "scale": np.where(scaler.scale_ > 0, scaler.scale_, 1.0),
+        "weights": weights,
+        "bias": bias,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Train the mood head on EfficientNetB0 embeddings.")
+    parser.add_argument("audio_dir", help="Directory with one subdirectory of tracks per mood")
+    parser.add_argument("--model", default=SERVING_MODEL_PATH, help="Model whose extractor computes the embeddings")
+    parser.add_argument("--encoder", default=LABEL_ENCODER_PATH, help="Label encoder pickle file")
+    parser.add_argument("--output", default=MOOD_HEAD_PATH, help="Where to write the head")
+    parser.add_argument("--segment-duration", type=int, default=DEFAULT_SEGMENT_DURATION)
+    parser.add_argument("--max-segments", type=int, default=10, help="Segments per track (0: all)")
+    parser.add_argument("--validation-split", type=float, default=0.2,
+                        help="Share of each mood's tracks held out for validation (0: no validation)")
+    parser.add_argument("--regularization", type=float, default=1.0,
+                        help="Inverse L2 strength; lower it if validation is much worse than training")
+    parser.add_argument("--min-accuracy", type=float, default=0.0,
+                        help="Fail if the validation track accuracy is lower than this")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    tracks = collect_tracks(args.audio_dir)
+    if len({mood for _, mood in tracks}) < 2:
+        parser.error(f"{args.audio_dir} needs subdirectories with audio for at least two moods")
+    logger.info(f"Training on {len(tracks)} tracks: {dict(Counter(mood for _, mood in tracks))}")
+
+    classifier = MusicGenreClassifier(args.model, args.encoder, mood_head_path=None)
+    features, moods = embed_tracks(classifier, tracks, args.segment_duration, args.max_segments)
+    if len(set(moods)) < 2:
+        logger.error("Fewer than two moods have tracks that could be decoded")
+        return 1
+
+    validation = None
+    if args.validation_split > 0:
+        from sklearn.model_selection import train_test_split
+
+        train, held_out = train_test_split(
+            np.arange(len(moods)), test_size=args.validation_split, stratify=moods, random_state=args.seed
+        )
+        model = fit([features[i] for i in train], [moods[i] for i in train], args.regularization)
+        validation = evaluate(model, [features[i] for i in held_out], [moods[i] for i in held_out])
+        logger.info(f"Validation: {json.dumps(validation)}")
+        if validation["track_accuracy"] < args.min_accuracy:
+            logger.error(
+                f"Validation track accuracy {validation['track_accuracy']:.3f} is below {args.min_accuracy}; "
+                "not writing the head"
+            )
+            return 1
+
+    model = fit(features, moods, args.regularization)
+    arrays = head_arrays(model)
+    metadata = {
+        "extractor_version": EXTRACTOR_VERSION,
+        "embedding_backend": classifier.backend.name,
+        "segment_duration": args.segment_duration,
+        "tracks": dict(Counter(moods)),
+        "segments": int(sum(len(track) for track in features)),
+        "training": evaluate(model, features, moods),
+        "validation": validation,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=output_dir, suffix=".npz", delete=False) as f:
+        staging_path = f.name
+    try:
+        save_mood_head(staging_path, metadata=metadata, **arrays)
+        # The API scores with MoodHead, not scikit-learn; both must agree
+        sample = np.concatenate(features)[:1000]
+        expected = model.predict_proba(sample)
+        difference = float(np.abs(MoodHead(staging_path).predict(sample) - expected).max())
+        if difference > 1e-3:
+            logger.error(f"The written head differs from the fitted model by {difference:.2e}")
+            return 1
+        os.replace(staging_path, args.output)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+    logger.info(f"Wrote {args.output} with moods {arrays['moods']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
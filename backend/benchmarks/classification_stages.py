@@ -0,0 +1,271 @@
+"""
+Classification Stage Benchmarks
+Times each stage of the classifier on synthetic audio and compares against a baseline.
+
+Stages, each timed on its own:
+    decode/<format>         load_audio of a 65 s fixture (librosa for native formats, FFmpeg for m4a)
+    conversion_fallback/*   decode_audio forced through FFmpeg for formats librosa also reads
+    mel/slice               mel spectrogram of one 30 s slice
+    mel/shared_windows      all 5 s-hop windows of the 65 s fixture cut from TrackMelSpectrogram
+    render                  dB conversion and resize of one mel spectrogram to an image
+    feature_extraction/bN   EfficientNetB0 on a batch of N images
+    head/bN                 genre head on a batch of N embeddings
+    aggregation             result_from_probabilities over 40 segments
+    track/<fixture>         classify_full_track end to end, non-adaptive
+
+Fixtures are generated once by benchmarks.fixtures. The model is the offline
+stand-in from benchmarks.stand_in unless --model is given; for TFLite and ONNX
+models, which run extractor and head in one call, feature_extraction includes
+the head.
+
+Results are written as JSON. With --baseline, stages whose median is slower
+than the baseline by more than --tolerance (and by at least --min-delta-ms)
+are reported and the exit code is 1.
+
+Usage (from the backend directory):
+    python -m benchmarks.classification_stages --output bench.json
+    python -m benchmarks.classification_stages --save-baseline benchmarks/baseline.json
+    python -m benchmarks.classification_stages --baseline benchmarks/baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import librosa
+
+from app.config.music_config import SAMPLE_RATE, N_MELS, FMAX, N_FFT, HOP_LENGTH, IMAGE_SIZE
+from app.services.ffmpeg_decoder import decode_audio, ffmpeg_available
+from app.services.music_classifier import MusicGenreClassifier
+from app.services.track_spectrogram import TrackMelSpectrogram
+from .fixtures import DEFAULT_FIXTURES_DIR, ensure_fixtures
+from .stand_in import stand_in_classifier
+
+logger = logging.getLogger(__name__)
+
+DECODE_FIXTURE = "mix-65s"
+TRACK_FIXTURES = ("tones-30s", "mix-65s", "mix-180s")
+BATCH_SIZES = (1, 8)
+
+
+def measure(fn: Callable[[], object], repeats: int, warmup: int = 1) -> Dict:
+    """
+    Time repeated calls of fn.
+
+    Args:
+        fn: Function to time, called without arguments
+        repeats: Timed calls
+        warmup: Untimed calls first, so caches, lazy imports and graph tracing are excluded
+
+    Returns:
+        Dictionary with 'repeats' and 'min_ms', 'median_ms', 'mean_ms', 'stdev_ms'
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "repeats": repeats,
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.fmean(samples),
+        "stdev_ms": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def run_stages(classifier: MusicGenreClassifier, fixtures: Dict[str, Dict[str, str]], repeats: int,
+               include: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """
+    Time every stage.
+
+    Args:
+        classifier: Classifier with a backend loaded
+        fixtures: Paths from ensure_fixtures
+        repeats: Timed calls per stage
+        include: Only run stages whose name starts with one of these prefixes
+
+    Returns:
+        {stage name: timings from measure}
+    """
+    results: Dict[str, Dict] = {}
+
+    def stage(name: str, fn: Callable[[], object], stage_repeats: int = repeats):
+        if include and not any(name.startswith(prefix) for prefix in include):
+            return
+        results[name] = measure(fn, stage_repeats)
+        logger.info(f"{name}: median {results[name]['median_ms']:.2f} ms")
+
+    decode_paths = fixtures[DECODE_FIXTURE]
+    for extension, path in sorted(decode_paths.items()):
+        stage(f"decode/{extension.lstrip('.')}", lambda path=path: classifier.load_audio(path))
+    if ffmpeg_available():
+        for extension in (".wav", ".mp3"):
+            if extension in decode_paths:
+                stage(f"conversion_fallback/{extension.lstrip('.')}",
+                      lambda path=decode_paths[extension]: decode_audio(path))
+
+    y = classifier.load_audio(decode_paths[".wav"])
+    segment = y[:30 * SAMPLE_RATE]
+    stage("mel/slice", lambda: librosa.feature.melspectrogram(
+        y=segment, sr=SAMPLE_RATE, n_mels=N_MELS, fmax=FMAX, n_fft=N_FFT, hop_length=HOP_LENGTH
+    ))
+
+    def shared_windows():
+        track_mel = TrackMelSpectrogram(y, SAMPLE_RATE)
+        for start in range(0, len(y) - len(segment) + 1, 5 * SAMPLE_RATE):
+            track_mel.window(start, len(segment))
+    stage("mel/shared_windows", shared_windows)
+
+    mel_spec = librosa.feature.melspectrogram(
+        y=segment, sr=SAMPLE_RATE, n_mels=N_MELS, fmax=FMAX, n_fft=N_FFT, hop_length=HOP_LENGTH
+    )
+    stage("render", lambda: classifier._mel_image(mel_spec))
+
+    image = classifier._mel_image(mel_spec)
+    backend = classifier.backend
+    for batch_size in BATCH_SIZES:
+        images = np.repeat(image[np.newaxis], batch_size, axis=0)
+        if hasattr(backend, "feature_extractor"):
+            from tensorflow.keras.applications.efficientnet import preprocess_input
+
+            def extract(images=images):
+                return backend.feature_extractor.predict(preprocess_input(images), batch_size=len(images), verbose=0)
+        else:
+            def extract(images=images):
+                return backend.predict(images)[1]
+        stage(f"feature_extraction/b{batch_size}", extract)
+
+        features = backend.predict(images)[1]
+        stage(f"head/b{batch_size}", lambda features=features: backend.predict_head(features))
+
+    probabilities = np.random.default_rng(0).dirichlet(np.ones(len(classifier.genres)), size=40).astype(np.float32)
+    start_times = [i * 30.0 for i in range(40)]
+    stage("aggregation", lambda: classifier.result_from_probabilities(probabilities, start_times, 30, 1200.0))
+
+    # End to end is slow; fewer repeats keep the whole run in minutes
+    for name in TRACK_FIXTURES:
+        if name in fixtures:
+            stage(f"track/{name}", lambda path=fixtures[name][".wav"]: classifier.classify_full_track(path),
+                  max(1, repeats // 3))
+
+    return results
+
+
+def environment() -> Dict:
+    """Versions and hardware the results were measured on."""
+    import tensorflow as tf
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "librosa": librosa.__version__,
+        "tensorflow": tf.__version__,
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float,
+            min_delta_ms: float) -> List[Dict]:
+    """
+    Compare median timings against a baseline.
+
+    Args:
+        results: Stage timings of this run
+        baseline: Stage timings of the baseline
+        tolerance: Allowed relative slowdown, e.g. 0.2 for 20%
+        min_delta_ms: Slowdowns smaller than this are noise, however large relatively
+
+    Returns:
+        One entry per stage in both runs with 'stage', 'baseline_ms', 'current_ms', 'ratio' and 'regression'
+    """
+    comparison = []
+    for name in sorted(set(results) & set(baseline)):
+        before, after = baseline[name]["median_ms"], results[name]["median_ms"]
+        comparison.append({
+            "stage": name,
+            "baseline_ms": before,
+            "current_ms": after,
+            "ratio": after / before if before > 0 else float("inf"),
+            "regression": after > before * (1 + tolerance) and after - before >= min_delta_ms,
+        })
+    return comparison
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Time each classification stage on synthetic audio.")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--save-baseline", help="Write the results as the new baseline")
+    parser.add_argument("--baseline", help="Compare against this baseline; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown of the median")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore slowdowns smaller than this")
+    parser.add_argument("--repeats", type=int, default=10, help="Timed calls per stage")
+    parser.add_argument("--stages", nargs="*", help="Only run stages starting with these prefixes")
+    parser.add_argument("--fixtures-dir", default=DEFAULT_FIXTURES_DIR, help="Where generated audio is cached")
+    parser.add_argument("--model", help="Benchmark this model instead of the stand-in (needs --encoder)")
+    parser.add_argument("--encoder", help="Label encoder for --model")
+    parser.add_argument("--threads", type=int, help="Inference threads for TFLite and ONNX models")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    # The classifier logs every decode and track
+    logging.getLogger("app").setLevel(logging.WARNING)
+
+    if args.model and not args.encoder:
+        parser.error("--model needs --encoder")
+    if args.model:
+        classifier = MusicGenreClassifier(args.model, args.encoder, args.threads)
+    else:
+        classifier = stand_in_classifier(args.threads)
+
+    fixtures = ensure_fixtures(directory=args.fixtures_dir)
+    results = {
+        "meta": {
+            **environment(),
+            "backend": classifier.backend.name,
+            "model_version": classifier.model_version,
+            "repeats": args.repeats,
+            "image_size": list(IMAGE_SIZE),
+        },
+        "stages": run_stages(classifier, fixtures, args.repeats, args.stages),
+    }
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Wrote {path}")
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("backend") != results["meta"]["backend"]:
+        logger.warning(f"Baseline was measured with the {baseline['meta'].get('backend')} backend")
+    comparison = compare(results["stages"], baseline["stages"], args.tolerance, args.min_delta_ms)
+    for row in comparison:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['stage']:<32} {row['baseline_ms']:>10.2f} -> {row['current_ms']:>10.2f} ms  "
+              f"x{row['ratio']:.2f}{flag}")
+
+    regressions = [row["stage"] for row in comparison if row["regression"]]
+    if regressions:
+        logger.error(f"{len(regressions)} stage(s) slower than the baseline: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
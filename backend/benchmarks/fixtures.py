@@ -0,0 +1,130 @@
+"""
+Benchmark Fixtures
+Deterministic synthetic audio for the benchmarks.
+
+Every fixture is generated from a fixed seed: harmonic tones with a simple
+beat, white noise, or a mix of both, at several lengths. WAV files are written
+with soundfile; the other formats are transcoded from the WAV with FFmpeg, so
+the same fixture exists as MP3, FLAC, OGG and M4A. Fixtures are cached in a
+directory and only generated when missing.
+"""
+import os
+import subprocess
+import tempfile
+import logging
+from typing import Dict, Iterable, NamedTuple
+
+import numpy as np
+import soundfile as sf
+
+from app.config.music_config import SAMPLE_RATE
+from app.services.ffmpeg_decoder import find_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIXTURES_DIR = os.path.join(tempfile.gettempdir(), "vibesync-benchmark-fixtures")
+
+# Encoder arguments per format; WAV is written directly
+FFMPEG_ENCODERS = {
+    ".mp3": ["-c:a", "libmp3lame", "-b:a", "192k"],
+    ".flac": ["-c:a", "flac"],
+    ".ogg": ["-c:a", "libvorbis", "-q:a", "5"],
+    ".m4a": ["-c:a", "aac", "-b:a", "192k"],
+}
+
+
+class Fixture(NamedTuple):
+    name: str
+    kind: str
+    seconds: float
+    seed: int
+
+
+FIXTURES = [
+    Fixture("tones-30s", "tones", 30, 1),
+    Fixture("mix-65s", "mix", 65, 2),
+    Fixture("noise-10s", "noise", 10, 3),
+    Fixture("mix-180s", "mix", 180, 4),
+]
+
+
+def synthesize(kind: str, seconds: float, seed: int, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Generate a stereo test signal.
+
+    Args:
+        kind: 'tones' (harmonic chords with a kick-like pulse), 'noise' (white noise) or 'mix' (both)
+        seconds: Length in seconds
+        seed: Random seed; the same arguments always give the same samples
+        sr: Sample rate
+
+    Returns:
+        float32 array of shape (samples, 2) in [-1, 1]
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    y = np.zeros_like(t)
+
+    if kind in ("tones", "mix"):
+        # A new chord every two seconds, three voices with four harmonics each
+        for start in np.arange(0, seconds, 2.0):
+            mask = (t >= start) & (t < start + 2.0)
+            for root in rng.choice([110.0, 146.8, 196.0, 261.6, 329.6], size=3, replace=False):
+                for harmonic in range(1, 5):
+                    y[mask] += 0.08 / harmonic * np.sin(2 * np.pi * root * harmonic * t[mask])
+        # Decaying 60 Hz pulse on every beat at 120 bpm
+        beat_phase = t % 0.5
+        y += 0.3 * np.exp(-beat_phase * 30) * np.sin(2 * np.pi * 60 * beat_phase)
+
+    if kind in ("noise", "mix"):
+        y += (0.3 if kind == "noise" else 0.05) * rng.standard_normal(t.size)
+
+    y = y / max(1.0, np.abs(y).max())
+    # Slightly different channels, so mono downmixing is exercised
+    return np.stack([y, np.roll(y, 7)], axis=1).astype(np.float32)
+
+
+def fixture_path(fixture: Fixture, extension: str, directory: str = DEFAULT_FIXTURES_DIR) -> str:
+    return os.path.join(directory, f"{fixture.name}{extension}")
+
+
+def ensure_fixtures(extensions: Iterable[str] = (".wav", ".mp3", ".flac", ".ogg", ".m4a"),
+                    fixtures: Iterable[Fixture] = FIXTURES,
+                    directory: str = DEFAULT_FIXTURES_DIR) -> Dict[str, Dict[str, str]]:
+    """
+    Generate the fixture files that are missing.
+
+    Formats that need FFmpeg are skipped with a warning when it is not installed.
+
+    Args:
+        extensions: Formats to generate
+        fixtures: Fixtures to generate
+        directory: Cache directory
+
+    Returns:
+        {fixture name: {extension: path}} of the files that exist
+    """
+    os.makedirs(directory, exist_ok=True)
+    ffmpeg_path = find_ffmpeg()
+    paths: Dict[str, Dict[str, str]] = {}
+
+    for fixture in fixtures:
+        wav_path = fixture_path(fixture, ".wav", directory)
+        if not os.path.exists(wav_path):
+            sf.write(wav_path, synthesize(fixture.kind, fixture.seconds, fixture.seed), SAMPLE_RATE, subtype="PCM_16")
+        paths[fixture.name] = {".wav": wav_path}
+
+        for extension in extensions:
+            if extension == ".wav":
+                continue
+            path = fixture_path(fixture, extension, directory)
+            if not os.path.exists(path):
+                if not ffmpeg_path:
+                    logger.warning(f"FFmpeg not found; skipping {extension} fixtures")
+                    continue
+                cmd = [ffmpeg_path, "-hide_banner", "-loglevel", "error", "-y", "-i", wav_path,
+                       *FFMPEG_ENCODERS[extension], "-map_metadata", "-1", path]
+                subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL)
+            paths[fixture.name][extension] = path
+
+    return paths
@@ -0,0 +1,150 @@
+"""
+Import Time Benchmark
+Measures how long importing the API takes and checks the ML stack stays out of it.
+
+Each run imports app.main in a fresh interpreter with '-X importtime'. The
+result is the median over the runs of the total import time, plus the slowest
+imports. The run fails when a module from HEAVY_MODULES was imported (those
+load on the first classification), or when the median is above --max-ms or
+more than --tolerance slower than a saved baseline.
+
+Usage (from the backend directory):
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --save-baseline benchmarks/import_baseline.json
+    python -m benchmarks.import_time --baseline benchmarks/import_baseline.json --max-ms 1500
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded only when a classification needs them
+HEAVY_MODULES = (
+    "tensorflow", "keras", "onnxruntime", "ai_edge_litert", "numba", "scipy.stats", "scipy.signal",
+    "sklearn", "librosa.core", "librosa.feature", "matplotlib", "cv2", "pydub", "moviepy",
+)
+
+_PRINT_MODULES = "import json, sys; print(json.dumps(sorted(sys.modules)))"
+
+
+def import_once(module: str) -> Tuple[float, List[Tuple[str, float]], List[str]]:
+    """
+    Import a module in a fresh interpreter.
+
+    Args:
+        module: Module to import
+
+    Returns:
+        Tuple of the total import time in ms, (module, cumulative ms) of every import,
+        and the names of all modules loaded afterwards
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}; {_PRINT_MODULES}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(cumulative) / 1000))
+
+    total = next(ms for name, ms in reversed(imports) if name == module)
+    return total, imports, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(module: str, runs: int, top: int) -> Dict:
+    """
+    Import a module several times and summarize.
+
+    Args:
+        module: Module to import
+        runs: Fresh interpreters to time
+        top: Slowest imports to report
+
+    Returns:
+        Dictionary with 'median_ms', 'min_ms', 'slowest' from the median run and 'heavy_modules' that were loaded
+    """
+    results = [import_once(module) for _ in range(runs)]
+    totals = [total for total, _, _ in results]
+    _, imports, loaded = sorted(results, key=lambda r: r[0])[len(results) // 2]
+
+    # Report each top-level package once, at its slowest import
+    slowest: Dict[str, float] = {}
+    for name, ms in imports:
+        if name != module:
+            package = name.split(".")[0] if not name.startswith("app.") else name
+            slowest[package] = max(slowest.get(package, 0.0), ms)
+
+    return {
+        "module": module,
+        "runs": runs,
+        "median_ms": statistics.median(totals),
+        "min_ms": min(totals),
+        "slowest": dict(sorted(slowest.items(), key=lambda item: -item[1])[:top]),
+        "heavy_modules": sorted(name for name in HEAVY_MODULES if name in loaded),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Time importing the API and check the ML stack is lazy.")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to report")
+    parser.add_argument("--max-ms", type=float, help="Fail if the median is above this")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--save-baseline", help="Write the results as the new baseline")
+    parser.add_argument("--baseline", help="Compare against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown of the median")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    result = measure(args.module, args.runs, args.top)
+    result["meta"] = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    logger.info(f"import {args.module}: median {result['median_ms']:.0f} ms over {args.runs} runs")
+    for name, ms in result["slowest"].items():
+        logger.info(f"  {name:<40} {ms:>8.1f} ms")
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"Wrote {path}")
+
+    failed = False
+    if result["heavy_modules"]:
+        logger.error(f"Imported at startup, should load lazily: {', '.join(result['heavy_modules'])}")
+        failed = True
+    if args.max_ms is not None and result["median_ms"] > args.max_ms:
+        logger.error(f"Median import time {result['median_ms']:.0f} ms is above {args.max_ms:.0f} ms")
+        failed = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if result["median_ms"] > baseline["median_ms"] * (1 + args.tolerance):
+            logger.error(
+                f"Median import time {result['median_ms']:.0f} ms is more than {args.tolerance:.0%} "
+                f"above the baseline {baseline['median_ms']:.0f} ms"
+            )
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+Stand-in Model
+Randomly initialized model with the production architecture, for offline benchmarks.
+
+EfficientNetB0 is built without downloading the ImageNet weights and the head
+is a small seeded Dense classifier over the pooled embeddings, so timings have
+the shape and cost of the real model while its predictions mean nothing.
+"""
+from typing import Optional
+
+from app.config.music_config import IMAGE_SIZE, EXPECTED_GENRES
+from app.services.inference_backends import InferenceBackend, KerasBackend
+from app.services.music_classifier import MusicGenreClassifier
+
+STAND_IN_MODEL_PATH = "stand-in.h5"
+
+
+class StandInBackend(KerasBackend):
+    name = "stand-in"
+
+    def __init__(self, num_threads: Optional[int] = None, seed: int = 0):
+        # Skip KerasBackend.__init__, there is no model file to load
+        InferenceBackend.__init__(self, STAND_IN_MODEL_PATH, num_threads)
+        import keras
+        from tensorflow.keras.applications import EfficientNetB0
+
+        keras.utils.set_random_seed(seed)
+        self.feature_extractor = EfficientNetB0(
+            weights=None, include_top=False, input_shape=(IMAGE_SIZE[0], IMAGE_SIZE[1], 3)
+        )
+        self.feature_extractor.trainable = False
+        self.model = keras.Sequential([
+            keras.Input(self.feature_extractor.output_shape[1:]),
+            keras.layers.GlobalAveragePooling2D(),
+            keras.layers.Dense(64, activation="relu"),
+            keras.layers.Dense(len(EXPECTED_GENRES), activation="softmax"),
+        ])
+
+
+def stand_in_classifier(num_threads: Optional[int] = None, seed: int = 0) -> MusicGenreClassifier:
+    """
+    A classifier that runs on the stand-in model.
+
+    Args:
+        num_threads: Passed to the backend
+        seed: Weight initialization seed
+
+    Returns:
+        MusicGenreClassifier with the stand-in backend and EXPECTED_GENRES as labels
+    """
+    classifier = MusicGenreClassifier(STAND_IN_MODEL_PATH, "stand-in.pkl", num_threads, preprocessing_only=True)
+    classifier.backend = StandInBackend(num_threads, seed)
+    classifier.extractor_version += classifier.backend.version_tag
+    classifier.genres = list(EXPECTED_GENRES)
+    classifier.model_version = "stand-in"
+    return classifier
@@ -0,0 +1,211 @@
+"""
+Track Index Benchmark
+Measures similar-track query latency, recall and memory against catalog size.
+
+For every catalog size a synthetic catalog is written to a scratch index:
+unit vectors drawn around --clusters random centres with Gaussian noise,
+standing in for track embeddings. The IVF lists (4 * sqrt(tracks)) and a
+64-byte product quantizer are built once, then the index is reopened in each
+configuration:
+
+    exact/float32   vectorized search over every track
+    exact/float16   the same over half-size vectors, converted in chunks
+    ivf/float32     the nprobe nearest inverted lists only
+    ivf/float16
+    ivf/pq          PQ codes of the nprobe lists, the best k * rerank re-scored from disk
+
+Queries are fresh draws from the same distribution. Recall@k is measured
+against an exact float32 scan of the catalog on disk. Configurations whose
+vectors would not fit in --max-memory-gb are skipped (exact/float32 of a
+million tracks needs 5.1 GB).
+
+Usage (from the backend directory):
+    python -m benchmarks.track_index --output track_index.json
+    python -m benchmarks.track_index --sizes 10000 100000 --nprobe 8 16 32 --rerank 10 50 100
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CONFIGURATIONS = ("exact/float32", "exact/float16", "ivf/float32", "ivf/float16", "ivf/pq")
+DIM = 1280
+PQ_SUBVECTORS = 64
+BYTES_PER_TRACK = {"float32": 4 * DIM, "float16": 2 * DIM, "pq": PQ_SUBVECTORS + 4}
+
+
+def synthetic_vectors(centres: np.ndarray, count: int, noise: float, rng: np.random.Generator) -> np.ndarray:
+    """Unit vectors scattered around randomly chosen centres."""
+    vectors = centres[rng.integers(0, len(centres), count)]
+    vectors += noise * rng.standard_normal((count, centres.shape[1]), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def available_memory_gb() -> float:
+    """MemAvailable from /proc/meminfo, or 4 GB where it cannot be read."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    return 4.0
+
+
+def measure_configuration(index_dir: str, configuration: str, queries: np.ndarray, truth: List[set],
+                          k: int, nprobe: int, rerank: int) -> Dict:
+    """
+    Open the index in one configuration and time its queries.
+
+    Returns:
+        Dictionary with load time, latency percentiles, recall and vector memory
+    """
+    from app.services.track_index import TrackIndex
+
+    search, storage = configuration.split("/")
+    started = time.perf_counter()
+    index = TrackIndex(index_dir, storage=storage, nprobe=nprobe, rerank=rerank,
+                       ann_min_tracks=0 if search == "ivf" else sys.maxsize)
+    load_seconds = time.perf_counter() - started
+    index.search(queries[0], k)
+
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        found = index.search(query, k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += len(expected & {track["id"] for track in found})
+    stats = index.stats()
+    return {
+        "configuration": configuration,
+        "nprobe": nprobe if search == "ivf" else None,
+        "rerank": rerank if storage == "pq" else None,
+        "load_seconds": load_seconds,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_ms": float(np.mean(latencies)),
+        f"recall@{k}": hits / (len(queries) * k),
+        "vector_memory_mb": stats["vector_memory_bytes"] / 1024 ** 2,
+    }
+
+
+def run(sizes: List[int], configurations: List[str], nprobes: List[int], reranks: List[int], queries: int, k: int,
+        clusters: int, noise: float, max_memory_gb: float, scratch_dir: str, seed: int) -> List[Dict]:
+    """
+    Benchmark every configuration on catalogs of every size.
+
+    Returns:
+        One result per size with its build time and a row per configuration
+    """
+    from app.services.track_index import TrackIndex
+    from app.tools.build_track_index import exact_neighbours
+
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, DIM), dtype=np.float32)
+    query_vectors = synthetic_vectors(centres, queries, noise, rng)
+    results = []
+    for size in sizes:
+        index_dir = tempfile.mkdtemp(prefix="track-index-", dir=scratch_dir)
+        try:
+            started = time.perf_counter()
+            index = TrackIndex(index_dir, storage="float16")
+            for start in range(0, size, 50000):
+                count = min(50000, size - start)
+                index.add_many([f"t{i}" for i in range(start, start + count)],
+                               synthetic_vectors(centres, count, noise, rng))
+            write_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            index.build(pq_subvectors=PQ_SUBVECTORS, sample_size=min(size, 100000))
+            build_seconds = time.perf_counter() - started
+            lists = len(index.centroids)
+            del index
+
+            vectors = np.memmap(os.path.join(index_dir, "vectors.f32"), dtype=np.float32, mode="r", shape=(size, DIM))
+            truth = [{f"t{p}" for p in row} for row in exact_neighbours(vectors, query_vectors, k)]
+            del vectors
+            logger.info(f"{size} tracks: written in {write_seconds:.1f}s, {lists} lists built in {build_seconds:.1f}s")
+
+            rows = []
+            for configuration in configurations:
+                storage = configuration.split("/")[1]
+                if size * BYTES_PER_TRACK[storage] / 1024 ** 3 > max_memory_gb:
+                    logger.info(f"{size} tracks, {configuration}: skipped, vectors exceed {max_memory_gb:.1f} GB")
+                    rows.append({"configuration": configuration, "skipped": "memory"})
+                    continue
+                for nprobe in (nprobes if configuration.startswith("ivf") else nprobes[:1]):
+                    for rerank in (reranks if storage == "pq" else reranks[:1]):
+                        row = measure_configuration(index_dir, configuration, query_vectors, truth, k, nprobe, rerank)
+                        logger.info(
+                            f"{size} tracks, {configuration}" + (f", nprobe {nprobe}" if row["nprobe"] else "") +
+                            (f", rerank {rerank}" if row["rerank"] else "") +
+                            f": p50 {row['p50_ms']:.2f} ms, p95 {row['p95_ms']:.2f} ms, "
+                            f"recall@{k} {row[f'recall@{k}']:.3f}, {row['vector_memory_mb']:.0f} MB"
+                        )
+                        rows.append(row)
+            results.append({
+                "tracks": size,
+                "lists": lists,
+                "write_seconds": write_seconds,
+                "build_seconds": build_seconds,
+                "configurations": rows,
+            })
+        finally:
+            shutil.rmtree(index_dir, ignore_errors=True)
+    return results
+
+
+def main(argv=None) -> int:
+    from app.config.music_config import TRACK_INDEX_NPROBE, TRACK_INDEX_RERANK
+
+    parser = argparse.ArgumentParser(description="Measure similar-track query latency against catalog size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Catalog sizes")
+    parser.add_argument("--configurations", nargs="+", choices=CONFIGURATIONS, default=list(CONFIGURATIONS))
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[TRACK_INDEX_NPROBE], help="Lists searched by IVF")
+    parser.add_argument("--rerank", type=int, nargs="+", default=[TRACK_INDEX_RERANK],
+                        help="PQ candidates re-scored per track returned")
+    parser.add_argument("--queries", type=int, default=100, help="Queries per configuration")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=1000, help="Centres the synthetic tracks are drawn around")
+    parser.add_argument("--noise", type=float, default=1.0, help="Per-dimension noise around the centres")
+    parser.add_argument("--max-memory-gb", type=float, default=available_memory_gb() / 2,
+                        help="Skip configurations whose vectors need more (default: half the available memory)")
+    parser.add_argument("--scratch-dir", help="Where catalogs are written (5.1 GB per million tracks)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    result = {
+        "results": run(args.sizes, args.configurations, args.nprobe, args.rerank, args.queries, args.k,
+                       args.clusters, args.noise, args.max_memory_gb, args.scratch_dir, args.seed),
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
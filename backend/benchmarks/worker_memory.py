@@ -0,0 +1,155 @@
+"""
+Worker Memory Benchmark
+Measures the memory each classification worker process uses for 1, 4 and 8 workers.
+
+For every worker count a ClassificationPool is started and warmed up with the
+given model, then the memory of each worker is read from
+/proc/<pid>/smaps_rollup (Linux only):
+
+    rss   resident memory, counting shared pages in full in every process
+    pss   resident memory with shared pages split between the processes sharing them
+    uss   memory private to the process
+
+The sum of PSS is what the workers cost the node together. With shared model
+weights the per-worker PSS drops as workers are added, while RSS stays flat.
+Fused TFLite/ONNX models are measured with and without SHARED_MODEL_WEIGHTS.
+
+Usage (from the backend directory):
+    python -m benchmarks.worker_memory --model cnn-models/efficientnet_music_genre_fused.onnx
+    python -m benchmarks.worker_memory --model cnn-models/efficientnet_music_genre_fused.tflite --workers 1 4
+    python -m benchmarks.worker_memory --modes shared --output memory.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Shared weights only change how the fused runtimes load their models
+SHARED_WEIGHTS_BACKENDS = ("tflite", "onnx")
+
+
+def process_memory(pid: int) -> Dict[str, float]:
+    """
+    Memory of a process in MB.
+
+    Returns:
+        Dictionary with 'rss', 'pss' and 'uss'
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss": values["Rss"],
+        "pss": values["Pss"],
+        "uss": values["Private_Clean"] + values["Private_Dirty"],
+    }
+
+
+async def measure_pool(model_path: str, encoder_path: str, workers: int, batch_size: int) -> Dict:
+    """
+    Start a warmed-up pool and read the memory of its workers.
+
+    Args:
+        model_path: Model the workers load
+        encoder_path: Label encoder pickle file
+        workers: Number of worker processes
+        batch_size: Largest batch each worker warms up with
+
+    Returns:
+        Dictionary with the per-worker values and their mean, and the total PSS
+    """
+    from app.services.classification_pool import ClassificationPool
+
+    pool = ClassificationPool(
+        model_path, encoder_path, workers=workers, intra_op_threads=1, warmup_batch_sizes=(1, batch_size)
+    )
+    try:
+        await pool.start()
+        per_worker = [process_memory(pid) for pid in pool.worker_pids]
+    finally:
+        pool.shutdown()
+
+    return {
+        "workers": len(per_worker),
+        "per_worker_mb": per_worker,
+        "mean_mb": {key: statistics.mean(worker[key] for worker in per_worker) for key in ("rss", "pss", "uss")},
+        "total_pss_mb": sum(worker["pss"] for worker in per_worker),
+    }
+
+
+def run(model_path: str, encoder_path: str, worker_counts: List[int], modes: List[str], batch_size: int) -> Dict:
+    """
+    Measure every combination of weight mode and worker count.
+
+    Returns:
+        {mode: [results of measure_pool, one per worker count]}
+    """
+    results = {}
+    for mode in modes:
+        # Read by each spawned worker when it loads its model
+        os.environ["SHARED_MODEL_WEIGHTS"] = "true" if mode == "shared" else "false"
+        results[mode] = []
+        for workers in worker_counts:
+            result = asyncio.run(measure_pool(model_path, encoder_path, workers, batch_size))
+            mean = result["mean_mb"]
+            logger.info(
+                f"{mode:<7} {result['workers']} workers: per worker rss {mean['rss']:.0f} MB, "
+                f"pss {mean['pss']:.0f} MB, uss {mean['uss']:.0f} MB; total pss {result['total_pss_mb']:.0f} MB"
+            )
+            results[mode].append(result)
+    return results
+
+
+def main(argv=None) -> int:
+    from app.config.music_config import LABEL_ENCODER_PATH, MAX_INFERENCE_BATCH_SIZE, SERVING_MODEL_PATH
+    from app.services.inference_backends import backend_class
+
+    parser = argparse.ArgumentParser(description="Measure per-worker memory of the classification pool.")
+    parser.add_argument("--model", default=SERVING_MODEL_PATH, help="Model the workers load")
+    parser.add_argument("--encoder", default=LABEL_ENCODER_PATH, help="Label encoder pickle file")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="Worker counts to measure")
+    parser.add_argument("--modes", nargs="+", choices=("copied", "shared"), default=["copied", "shared"],
+                        help="Weight modes for TFLite/ONNX models")
+    parser.add_argument("--batch-size", type=int, default=MAX_INFERENCE_BATCH_SIZE, help="Warm-up batch size")
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        logger.error("Needs /proc/<pid>/smaps_rollup (Linux 4.14 or later)")
+        return 1
+    backend = backend_class(args.model).name
+    modes = args.modes if backend in SHARED_WEIGHTS_BACKENDS else ["copied"]
+
+    result = {
+        "model": os.path.basename(os.path.normpath(args.model)),
+        "backend": backend,
+        "results": run(args.model, args.encoder, args.workers, modes, args.batch_size),
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
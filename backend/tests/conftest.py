@@ -0,0 +1,36 @@
+"""
+Shared fixtures: the stand-in model and spectrogram images of synthetic audio.
+
+Run from the backend directory:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Import app and benchmarks from the backend directory wherever pytest is started
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config.music_config import SAMPLE_RATE  # noqa: E402
+from benchmarks.fixtures import synthesize  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def stand_in():
+    """Classifier on the randomly initialized stand-in model."""
+    pytest.importorskip("tensorflow")
+    from benchmarks.stand_in import stand_in_classifier
+
+    return stand_in_classifier()
+
+
+@pytest.fixture(scope="session")
+def segment_images(stand_in) -> np.ndarray:
+    """Spectrogram images of 5-second tone, noise and mixed segments, shape (6, 224, 224, 3)."""
+    images = []
+    for seed, kind in enumerate(("tones", "noise", "mix", "tones", "noise", "mix")):
+        y = synthesize(kind, 5, seed).mean(axis=1)
+        images.append(stand_in._spectrogram_image(y, SAMPLE_RATE))
+    return np.stack(images)
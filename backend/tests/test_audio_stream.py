@@ -0,0 +1,60 @@
+"""Position-addressed reads from the SampleRingBuffer, including across its wrap-around."""
+import numpy as np
+import pytest
+
+from app.services.audio_stream import SampleRingBuffer
+
+
+def track(start, stop):
+    return np.arange(start, stop, dtype=np.float32)
+
+
+def test_reads_across_the_wrap_around():
+    buffer = SampleRingBuffer(10)
+    buffer.append(track(0, 7))
+    buffer.discard_until(5)
+    buffer.append(track(7, 15))  # Positions 10-14 wrap to the start of the storage
+
+    assert (buffer.start, buffer.end, len(buffer)) == (5, 15, 10)
+    np.testing.assert_array_equal(buffer.read(5, 15), track(5, 15))
+    np.testing.assert_array_equal(buffer.read(8, 12), track(8, 12))
+    np.testing.assert_array_equal(buffer.read(10, 13), track(10, 13))
+    assert len(buffer.read(9, 9)) == 0
+
+
+def test_many_wraps_match_the_track():
+    rng = np.random.default_rng(0)
+    samples = rng.standard_normal(1000).astype(np.float32)
+    buffer = SampleRingBuffer(64)
+    position = 0
+    while position < len(samples):
+        block = samples[position:position + int(rng.integers(1, 32))]
+        buffer.discard_until(buffer.end + len(block) - buffer.capacity)
+        buffer.append(block)
+        position += len(block)
+        start = int(rng.integers(buffer.start, buffer.end + 1))
+        np.testing.assert_array_equal(buffer.read(start, buffer.end), samples[start:buffer.end])
+
+
+def test_rejects_overflow_and_ranges_not_held():
+    buffer = SampleRingBuffer(10)
+    buffer.append(track(0, 8))
+    with pytest.raises(ValueError, match="do not fit"):
+        buffer.append(track(8, 11))
+
+    buffer.discard_until(4)
+    with pytest.raises(ValueError, match="not buffered"):
+        buffer.read(3, 6)
+    with pytest.raises(ValueError, match="not buffered"):
+        buffer.read(6, 9)
+
+
+def test_discarding_ahead_skips_samples_still_to_come():
+    buffer = SampleRingBuffer(10)
+    buffer.append(track(0, 4))
+    buffer.discard_until(12)
+    buffer.append(track(4, 10))
+    buffer.append(track(10, 16))
+
+    assert (buffer.start, buffer.end) == (12, 16)
+    np.testing.assert_array_equal(buffer.read(12, 16), track(12, 16))
@@ -0,0 +1,55 @@
+"""Size-bounded LRU eviction of the in-process cache tiers."""
+import numpy as np
+
+from app.services.classification_cache import ClassificationCache, LRUCacheTier
+
+
+def test_evicts_least_recently_used_by_size():
+    tier = LRUCacheTier(max_bytes=30)
+    for key in ("a", "b", "c"):
+        tier.set(key, key.encode() * 10)
+    assert tier.get("a") == b"a" * 10  # Now the most recently used
+
+    tier.set("d", b"d" * 10)
+
+    assert tier.get("b") is None
+    assert [tier.get(key) is not None for key in ("a", "c", "d")] == [True, True, True]
+    assert tier.get_stats() == {"entries": 3, "size_bytes": 30, "max_bytes": 30}
+
+
+def test_large_entry_evicts_several_and_oversized_entries_are_skipped():
+    tier = LRUCacheTier(max_bytes=30)
+    for key in ("a", "b", "c"):
+        tier.set(key, b"x" * 10)
+
+    tier.set("big", b"y" * 25)
+    assert [key for key in ("a", "b", "c", "big") if tier.get(key) is not None] == ["big"]
+
+    tier.set("huge", b"z" * 31)
+    assert tier.get("huge") is None and tier.get("big") is not None
+
+
+def test_replacing_an_entry_updates_the_size():
+    tier = LRUCacheTier(max_bytes=30)
+    tier.set("a", b"x" * 20)
+    tier.set("a", b"x" * 5)
+    tier.set("b", b"x" * 25)
+
+    assert tier.get("a") is not None and tier.get_stats()["size_bytes"] == 30
+
+
+def test_embeddings_cannot_evict_results():
+    cache = ClassificationCache(max_bytes=10 ** 4, embeddings_max_bytes=10 ** 4)
+    result_key = ClassificationCache.make_key("track", "hash", "v1", segment_duration=30)
+    cache.set_result(result_key, {"predicted_genre": "jazz"})
+
+    for i in range(10):
+        key = ClassificationCache.make_key("embeddings", f"hash{i}", "e1", segment_duration=30)
+        cache.set_embeddings(key, embeddings=np.zeros((4, 256), dtype=np.float16))
+
+    assert cache.get_result(result_key) == {"predicted_genre": "jazz"}
+    stats = cache.get_stats()
+    assert stats["memory"]["entries"] == 1
+    assert 0 < stats["embeddings_memory"]["entries"] < 10
+    latest = ClassificationCache.make_key("embeddings", "hash9", "e1", segment_duration=30)
+    assert cache.get_embeddings(latest)["embeddings"].dtype == np.float16
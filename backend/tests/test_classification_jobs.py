@@ -0,0 +1,110 @@
+"""Classification jobs shared between API processes through the Redis job store."""
+import asyncio
+import json
+
+from app.services import classification_jobs
+from app.services.classification_jobs import ClassificationJobManager, RedisJobStore, SharedClassificationJob
+
+GENRES = ["jazz", "rock"]
+
+
+class FakeRedis:
+    """The few Redis commands the job store uses, in memory."""
+
+    def __init__(self):
+        self.values = {}
+        self.lists = {}
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value.encode()
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value.encode())
+
+    def expire(self, key, seconds):
+        pass
+
+    def lrange(self, key, start, stop):
+        return self.lists.get(key, [])[start:]
+
+
+def shared_managers():
+    """Two job managers, as in two uvicorn workers, sharing one Redis."""
+    client = FakeRedis()
+    managers = []
+    for _ in range(2):
+        manager = ClassificationJobManager(ttl_seconds=60, max_jobs=10)
+        manager.store = RedisJobStore.__new__(RedisJobStore)
+        manager.store.ttl_seconds = 60
+        manager.store._client = client
+        managers.append(manager)
+    return managers
+
+
+def parse(stream):
+    return [(chunk.split("\n")[0][len("event: "):], json.loads(chunk.split("\n")[1][len("data: "):]))
+            for chunk in stream if chunk.startswith("event:")]
+
+
+def test_other_process_sees_status_and_events(monkeypatch):
+    monkeypatch.setattr(classification_jobs, "POLL_SECONDS", 0.01)
+    accepting, other = shared_managers()
+
+    async def scenario():
+        job = accepting.create_job(GENRES, "song.mp3", "u1", 30)
+        queued = await other.find_job(job.id)
+        assert isinstance(queued, SharedClassificationJob)
+        assert queued.user_id == "u1" and queued.to_dict()["status"] == "queued"
+
+        async def run():
+            job.mark_running()
+            await asyncio.sleep(0.05)
+            job.add_segment({"predicted_genre": "jazz", "confidence": 0.9})
+            await asyncio.sleep(0.05)
+            job.complete({"predicted_genre": "jazz", "segment_predictions": [
+                {"predicted_genre": "jazz", "confidence": 0.9}, {"predicted_genre": "rock", "confidence": 0.6}
+            ]})
+
+        async def follow():
+            return [chunk async for chunk in (await other.find_job(job.id)).stream_events()]
+
+        _, stream = await asyncio.gather(run(), follow())
+        return job, stream, (await other.find_job(job.id)).to_dict()
+
+    job, stream, status = asyncio.run(scenario())
+
+    events = parse(stream)
+    assert [event for event, _ in events] == ["status", "segment", "segment", "completed"]
+    assert events[2][1]["genre_votes"] == {"jazz": 1, "rock": 1}
+    assert status == job.to_dict()
+    assert status["status"] == "completed" and status["segments_completed"] == 2
+
+
+def test_unknown_job_is_not_found():
+    accepting, other = shared_managers()
+
+    assert asyncio.run(other.find_job("missing")) is None
+    assert asyncio.run(ClassificationJobManager(60, 10).find_job("missing")) is None
+
+
+def test_local_job_streams_without_a_store():
+    manager = ClassificationJobManager(ttl_seconds=60, max_jobs=10)
+
+    async def scenario():
+        job = manager.create_job(GENRES, "song.mp3", "u1", 30)
+        assert await manager.find_job(job.id) is job
+        job.mark_running()
+        job.fail("decoder crashed")
+        return [chunk async for chunk in job.stream_events()]
+
+    events = parse(asyncio.run(scenario()))
+    assert events == [("status", {"status": "running"}), ("failed", {"error": "decoder crashed"})]
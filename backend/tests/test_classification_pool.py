@@ -0,0 +1,31 @@
+"""ClassificationPool.start waits for every worker, not just the first one ready."""
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.services.classification_pool import ClassificationPool
+
+
+def record_loaded(directory: str):
+    """Worker initializer: the first worker loads at once, the others take a second."""
+    try:
+        os.close(os.open(os.path.join(directory, "first"), os.O_CREAT | os.O_EXCL))
+    except FileExistsError:
+        time.sleep(1)
+    open(os.path.join(directory, f"{os.getpid()}.loaded"), "w").close()
+
+
+def test_start_waits_for_every_worker(tmp_path):
+    pool = ClassificationPool("stand-in.h5", "stand-in.pkl", workers=3)
+    pool._executor = ProcessPoolExecutor(
+        max_workers=3, mp_context=pool._context, initializer=record_loaded, initargs=(str(tmp_path),)
+    )
+    try:
+        asyncio.run(pool.start())
+
+        loaded = sorted(int(name.split(".")[0]) for name in os.listdir(tmp_path) if name.endswith(".loaded"))
+        assert len(loaded) == 3
+        assert pool.worker_pids == loaded
+    finally:
+        pool.shutdown()
@@ -0,0 +1,57 @@
+"""Fused TFLite and ONNX exports of the stand-in model against its Keras backend."""
+import logging
+
+import pytest
+
+from app.services import inference_backends
+from app.services.inference_backends import KerasBackend, ONNXBackend, TFLiteBackend, create_backend
+from app.tools.check_backend_parity import compare_backends
+
+
+def check_parity(report):
+    assert report["top1_agreement"] == 1.0
+    assert report["max_abs_probability_diff"] < 1e-3
+    assert report["max_abs_head_probability_diff"] < 1e-3
+    assert report["min_embedding_cosine"] > 0.999
+
+
+def test_onnx_matches_keras(stand_in, segment_images, tmp_path):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("tf2onnx")
+    from app.tools.export_fused_model import export_onnx
+
+    path = str(tmp_path / "stand-in.onnx")
+    export_onnx(stand_in, path, "none")
+    candidate = create_backend(path)
+
+    assert isinstance(candidate, ONNXBackend)
+    check_parity(compare_backends(stand_in.backend, candidate, segment_images, batch_size=4))
+
+
+def test_tflite_matches_keras(stand_in, segment_images, tmp_path):
+    from app.tools.export_fused_model import export_tflite
+
+    path = str(tmp_path / "stand-in.tflite")
+    export_tflite(stand_in, path, "none")
+    candidate = create_backend(path)
+
+    assert isinstance(candidate, TFLiteBackend)
+    check_parity(compare_backends(stand_in.backend, candidate, segment_images, batch_size=4))
+
+
+def test_version_tags_separate_runtimes():
+    assert KerasBackend.version_tag_for({}) == ""
+    assert ONNXBackend.version_tag_for({}) == "+onnx-none"
+    assert TFLiteBackend.version_tag_for({"quantization": "float16"}) == "+tflite-float16"
+
+
+@pytest.mark.parametrize("backend, warned", [(KerasBackend, True), (TFLiteBackend, False), (ONNXBackend, False)])
+def test_shared_weights_warn_on_backends_that_copy_them(monkeypatch, caplog, backend, warned):
+    loaded = type(backend.__name__, (backend,), {"__init__": lambda self, model_path, num_threads: None})
+    monkeypatch.setattr(inference_backends, "backend_class", lambda model_path: loaded)
+    monkeypatch.setattr(inference_backends, "SHARED_MODEL_WEIGHTS", True)
+
+    with caplog.at_level(logging.WARNING, logger=inference_backends.__name__):
+        assert isinstance(create_backend("model"), backend)
+
+    assert ("SHARED_MODEL_WEIGHTS has no effect" in caplog.text) == warned
@@ -0,0 +1,118 @@
+"""Micro-batching and shutdown of the InferenceScheduler."""
+import threading
+
+import numpy as np
+import pytest
+
+from app.services.inference_scheduler import InferenceScheduler
+
+
+class BlockingModel:
+    """Records batch sizes; the first call waits until released so later requests queue up behind it."""
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, images):
+        self.batch_sizes.append(len(images))
+        self.started.set()
+        self.release.wait(5)
+        # Probabilities and features that identify each image
+        return images[:, 0, 0, :2] * 2, images[:, 0, 0, :1]
+
+
+def images(*values):
+    return np.stack([np.full((2, 2, 3), value, dtype=np.float32) for value in values])
+
+
+def test_concurrent_requests_share_a_batch():
+    model = BlockingModel()
+    scheduler = InferenceScheduler(model, max_batch_size=8, max_wait_ms=50)
+    try:
+        first = scheduler.submit(images(1))
+        assert model.started.wait(5)
+        queued = [scheduler.submit(images(2, 3)), scheduler.submit(images(4)), scheduler.submit(images(5, 6, 7))]
+        model.release.set()
+
+        assert first.result(5)[0].tolist() == [[2, 2]]
+        probabilities, features = queued[0].result(5)
+        assert probabilities.tolist() == [[4, 4], [6, 6]] and features.tolist() == [[2], [3]]
+        assert queued[1].result(5)[1].tolist() == [[4]]
+        assert queued[2].result(5)[1].tolist() == [[5], [6], [7]]
+        assert model.batch_sizes == [1, 6]
+
+        stats = scheduler.get_stats()
+        assert stats["batches"] == 2 and stats["requests"] == 4 and stats["images"] == 7
+    finally:
+        model.release.set()
+        scheduler.close(5)
+
+
+def test_batches_do_not_exceed_the_limit():
+    model = BlockingModel()
+    scheduler = InferenceScheduler(model, max_batch_size=3, max_wait_ms=50)
+    try:
+        scheduler.submit(images(0))
+        assert model.started.wait(5)
+        futures = [scheduler.submit(images(i, i)) for i in range(1, 4)]
+        model.release.set()
+
+        for i, future in enumerate(futures, start=1):
+            assert future.result(5)[1].tolist() == [[i], [i]]
+        # A request that does not fit leads the next batch
+        assert model.batch_sizes == [1, 2, 2, 2]
+    finally:
+        model.release.set()
+        scheduler.close(5)
+
+
+def test_oversized_request_runs_in_slices():
+    model = BlockingModel()
+    model.release.set()
+    scheduler = InferenceScheduler(model, max_batch_size=3, max_wait_ms=0)
+    try:
+        probabilities, features = scheduler.submit(images(*range(8))).result(5)
+
+        assert model.batch_sizes == [3, 3, 2]
+        assert features.ravel().tolist() == list(range(8))
+        assert probabilities[:, 0].tolist() == [2 * value for value in range(8)]
+        stats = scheduler.get_stats()
+        assert stats["batches"] == 3 and stats["requests"] == 1 and stats["max_batch_size_seen"] == 3
+        assert scheduler.predict(images(*range(5))).shape == (5, 2)
+    finally:
+        scheduler.close(5)
+
+
+def test_close_finishes_queued_requests_then_rejects_new_ones():
+    model = BlockingModel()
+    scheduler = InferenceScheduler(model, max_batch_size=2, max_wait_ms=50)
+    first = scheduler.submit(images(1))
+    assert model.started.wait(5)
+    queued = [scheduler.submit(images(value)) for value in (2, 3, 4)]
+
+    closing = threading.Thread(target=scheduler.close, args=(5,))
+    closing.start()
+    model.release.set()
+    closing.join(5)
+
+    assert not closing.is_alive()
+    assert [future.result(0)[1].item() for future in [first] + queued] == [1, 2, 3, 4]
+    with pytest.raises(RuntimeError, match="closed"):
+        scheduler.submit(images(5))
+    scheduler.close()  # Closing twice is a no-op
+
+
+def test_failed_batch_fails_its_requests():
+    def broken(images):
+        raise ValueError("model exploded")
+
+    scheduler = InferenceScheduler(broken, max_wait_ms=0)
+    try:
+        with pytest.raises(ValueError, match="exploded"):
+            scheduler.predict(images(1))
+        with pytest.raises(ValueError, match="No images"):
+            scheduler.submit(np.empty((0, 2, 2, 3), dtype=np.float32))
+    finally:
+        scheduler.close(5)
@@ -0,0 +1,121 @@
+"""Text format of the metrics registry, worker deltas and metrics shared between API processes."""
+import json
+import os
+
+import pytest
+
+from app.services import metrics
+from app.services.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+
+def registry_with_metrics():
+    registry = MetricsRegistry()
+    requests = Counter("test_requests_total", "Requests served", ["route"], registry=registry)
+    in_flight = Gauge("test_in_flight", "Requests in flight", registry=registry)
+    latency = Histogram("test_latency_seconds", "Request latency", ["route"], registry=registry, buckets=(0.1, 1.0))
+    return registry, requests, in_flight, latency
+
+
+def test_render_format():
+    registry, requests, in_flight, latency = registry_with_metrics()
+    requests.labels(route='/say "hi"\n').inc()
+    requests.labels(route="/a").inc(2.5)
+    in_flight.set(3)
+    for value in (0.05, 0.5, 0.5, 7):
+        latency.labels(route="/a").observe(value)
+
+    assert registry.render() == "\n".join([
+        "# HELP test_requests_total Requests served",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{route="/a"} 2.5',
+        'test_requests_total{route="/say \\"hi\\"\\n"} 1',
+        "# HELP test_in_flight Requests in flight",
+        "# TYPE test_in_flight gauge",
+        "test_in_flight 3",
+        "# HELP test_latency_seconds Request latency",
+        "# TYPE test_latency_seconds histogram",
+        'test_latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'test_latency_seconds_bucket{route="/a",le="1"} 3',
+        'test_latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'test_latency_seconds_sum{route="/a"} 8.05',
+        'test_latency_seconds_count{route="/a"} 4',
+    ]) + "\n"
+
+
+def test_gauge_function_is_read_at_render_time():
+    registry = MetricsRegistry()
+    gauge = Gauge("test_ratio", "Ratio", registry=registry)
+    value = [0.25]
+    gauge.set_function(lambda: value[0])
+
+    assert "test_ratio 0.25" in registry.render()
+    value[0] = 0.5
+    assert "test_ratio 0.5" in registry.render()
+
+
+def test_wrong_labels_and_negative_counts_are_rejected():
+    _, requests, _, _ = registry_with_metrics()
+
+    with pytest.raises(ValueError):
+        requests.labels(method="GET")
+    with pytest.raises(ValueError):
+        requests.labels(route="/a").inc(-1)
+
+
+def test_merge_delta_adds_what_a_worker_recorded():
+    parent, parent_requests, _, parent_latency = registry_with_metrics()
+    _, worker_requests, _, worker_latency = registry_with_metrics()
+    parent_requests.labels(route="/a").inc()
+    parent_latency.labels(route="/a").observe(0.05)
+
+    for _ in range(2):
+        worker_requests.labels(route="/a").inc()
+        worker_latency.labels(route="/a").observe(0.5)
+        parent_requests.merge_delta(worker_requests.collect_delta())
+        parent_latency.merge_delta(worker_latency.collect_delta())
+
+    # collect_delta hands over what was recorded since the previous call, once
+    assert worker_requests.collect_delta() == {}
+    rendered = parent.render()
+    assert 'test_requests_total{route="/a"} 3' in rendered
+    assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in rendered
+    assert 'test_latency_seconds_bucket{route="/a",le="1"} 3' in rendered
+    assert 'test_latency_seconds_count{route="/a"} 3' in rendered
+
+
+def write_other_process(directory, pid, requests, in_flight, latency_counts, latency_total):
+    """The file another API process would have written."""
+    with open(os.path.join(directory, f"{pid}.json"), "w") as f:
+        json.dump({
+            "test_requests_total": [[["/a"], requests]],
+            "test_in_flight": [[[], in_flight]],
+            "test_latency_seconds": [[["/a"], [latency_counts, latency_total]]],
+        }, f)
+
+
+def test_shared_registries_render_every_process(tmp_path, monkeypatch):
+    alive = {os.getpid(), 101}
+    monkeypatch.setattr(metrics, "_process_alive", lambda pid: pid in alive)
+    registry, requests, in_flight, latency = registry_with_metrics()
+    registry.share(str(tmp_path), interval=3600)
+    requests.labels(route="/a").inc()
+    in_flight.set(1)
+    latency.labels(route="/a").observe(0.5)
+    write_other_process(tmp_path, 101, 2, 4, [1, 0, 0], 0.05)
+    write_other_process(tmp_path, 102, 5, 9, [0, 0, 1], 7.0)
+
+    rendered = registry.render()
+
+    # Counters and histograms include the exited process 102, gauges only the live processes
+    assert 'test_requests_total{route="/a"} 8' in rendered
+    assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in rendered
+    assert 'test_latency_seconds_bucket{route="/a",le="1"} 2' in rendered
+    assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 3' in rendered
+    assert 'test_latency_seconds_sum{route="/a"} 7.55' in rendered
+    assert f'test_in_flight{{pid="{os.getpid()}"}} 1' in rendered
+    assert 'test_in_flight{pid="101"} 4' in rendered
+    assert 'pid="102"' not in rendered
+
+    # The scrape also wrote this process's values for the others
+    with open(tmp_path / f"{os.getpid()}.json") as f:
+        assert json.load(f)["test_requests_total"] == [[["/a"], 1.0]]
@@ -0,0 +1,74 @@
+"""Early-exit decisions of adaptive segment sampling."""
+import numpy as np
+import pytest
+
+from app.services.music_classifier import MusicGenreClassifier
+
+GENRES = 10
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return MusicGenreClassifier("stand-in.h5", "stand-in.pkl", preprocessing_only=True)
+
+
+def segments(*rows):
+    """Probabilities for segments given as {genre: probability}; the rest is spread evenly."""
+    probabilities = np.zeros((len(rows), GENRES))
+    for i, row in enumerate(rows):
+        rest = (1 - sum(row.values())) / (GENRES - len(row))
+        probabilities[i] = rest
+        for genre, probability in row.items():
+            probabilities[i, genre] = probability
+    return probabilities
+
+
+def test_lead_the_remaining_segments_cannot_overturn(classifier):
+    probabilities = segments({0: 0.6}, {0: 0.6}, {0: 0.6})
+
+    assert classifier._outcome_decided(probabilities, remaining=2)
+    assert not classifier._outcome_decided(probabilities, remaining=3, min_segments=10)
+
+
+def test_needs_min_segments_before_the_statistical_tests(classifier):
+    probabilities = segments(*[{0: 0.9, 1: 0.05}] * 4)
+
+    assert not classifier._outcome_decided(probabilities, remaining=20, min_segments=5)
+    assert classifier._outcome_decided(probabilities, remaining=20, min_segments=4)
+
+
+def test_tied_votes_are_not_decided(classifier):
+    probabilities = segments({0: 0.9}, {1: 0.9}, {0: 0.9}, {1: 0.9})
+
+    assert not classifier._outcome_decided(probabilities, remaining=10, min_segments=2)
+
+
+def test_sign_test_decides_a_clear_vote_lead(classifier):
+    # 6 of 6 votes with small margins: p = 1/64 under equally likely genres
+    probabilities = segments(*[{0: 0.45, 1: 0.4}] * 6)
+
+    assert classifier._outcome_decided(probabilities, remaining=20, min_segments=3, confidence=0.95)
+    assert not classifier._outcome_decided(segments(*[{0: 0.45, 1: 0.4}] * 5, {1: 0.45, 0: 0.4}),
+                                           remaining=20, min_segments=3, confidence=0.99)
+
+
+def test_probability_margin_decides_a_narrow_vote_lead(classifier):
+    # 4 of 6 votes fail the sign test, but the leader wins its segments by far and loses the others narrowly
+    probabilities = segments(*[{0: 0.85, 1: 0.05}] * 4, *[{1: 0.45, 0: 0.4}] * 2)
+
+    assert classifier._outcome_decided(probabilities, remaining=20, min_segments=3)
+
+
+def test_close_margins_are_not_decided(classifier):
+    probabilities = segments({0: 0.5, 1: 0.45}, {1: 0.5, 0: 0.45}, {0: 0.5, 1: 0.45},
+                             {1: 0.5, 0: 0.4}, {0: 0.5, 1: 0.48})
+
+    assert not classifier._outcome_decided(probabilities, remaining=20, min_segments=3)
+
+
+def test_runner_up_without_votes_is_ranked_by_probability(classifier):
+    # Genre 2 never wins a segment but is close behind genre 0 in every one
+    probabilities = segments(*[{0: 0.40, 2: 0.39, 1: 0.1}] * 3)
+
+    assert not classifier._outcome_decided(probabilities, remaining=3, min_segments=10)
+    assert classifier._outcome_decided(probabilities, remaining=2, min_segments=10)
@@ -0,0 +1,79 @@
+"""Profile IDs, the current profiler context and never overwriting a stored profile."""
+import os
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import music_classification
+from app.services.request_profiler import RequestProfiler, current_profiler, profile_path
+
+ADMIN = {"uid": "admin"}
+USER = {"uid": "user"}
+
+
+def test_activate_restores_the_previous_profiler(tmp_path):
+    outer = RequestProfiler("outer", 0.01, str(tmp_path))
+    with outer.activate():
+        with RequestProfiler("inner", 0.01, str(tmp_path)).activate() as inner:
+            assert current_profiler.get() is inner
+        assert current_profiler.get() is outer
+    assert current_profiler.get() is None
+
+
+def test_save_does_not_overwrite(tmp_path):
+    first = RequestProfiler("same-id", 0.01, str(tmp_path))
+    first.samples["a;b"] = 3
+    first.duration = 0.1
+    path = first.save()
+
+    with pytest.raises(FileExistsError):
+        RequestProfiler("same-id", 0.01, str(tmp_path)).save()
+    with open(path) as f:
+        assert f.read() == "a;b 3\n"
+
+
+@pytest.fixture
+def profiled_client(tmp_path, monkeypatch):
+    """An endpoint behind request_profiling, with every request sampled."""
+    monkeypatch.setattr(music_classification, "PROFILE_OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(music_classification, "PROFILING_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(music_classification, "PROFILING_ADMIN_UIDS", {"admin"})
+    user = {}
+
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work(profiler=Depends(music_classification.request_profiling)):
+        return {"profiled": profiler is not None}
+
+    app.dependency_overrides[music_classification.get_current_user] = lambda: user
+    client = TestClient(app)
+    client.user = user
+    return client
+
+
+def test_sampled_requests_ignore_the_client_request_id(profiled_client, tmp_path):
+    profiled_client.user.update(USER)
+    response = profiled_client.get("/work", headers={"X-Request-ID": "admin-profile"})
+
+    profile_id = response.headers["X-Profile-ID"]
+    assert response.json() == {"profiled": True}
+    assert profile_id != "admin-profile"
+    assert os.path.exists(profile_path(str(tmp_path), profile_id))
+    assert not os.path.exists(profile_path(str(tmp_path), "admin-profile"))
+
+
+def test_admins_choose_the_id_but_cannot_reuse_it(profiled_client, tmp_path):
+    profiled_client.user.update(ADMIN)
+    headers = {"X-Profile": "1", "X-Request-ID": "slow-upload"}
+
+    assert profiled_client.get("/work", headers=headers).headers["X-Profile-ID"] == "slow-upload"
+    assert os.path.exists(profile_path(str(tmp_path), "slow-upload"))
+    assert profiled_client.get("/work", headers=headers).status_code == 409
+
+
+def test_profiling_on_request_is_for_admins_only(profiled_client):
+    profiled_client.user.update(USER)
+
+    assert profiled_client.get("/work", headers={"X-Profile": "1"}).status_code == 403
@@ -0,0 +1,71 @@
+"""The NumPy renderer against the pyplot, PNG and cv2 pipeline the model was trained on."""
+import os
+import subprocess
+import sys
+
+import librosa
+import numpy as np
+import pytest
+
+from app.config.music_config import SAMPLE_RATE, N_MELS, FMAX, N_FFT, HOP_LENGTH
+from app.services.spectrogram_renderer import _VIRIDIS_LUT, render_spectrogram
+from benchmarks.fixtures import synthesize
+
+
+def pyplot_reference(mel_spec_db: np.ndarray, png_path: str) -> np.ndarray:
+    """The original notebook rendering, drawn and read back through a PNG file."""
+    cv2 = pytest.importorskip("cv2")
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(10, 4))
+    plt.imshow(mel_spec_db, aspect='auto', origin='lower', cmap='viridis')
+    plt.axis('off')
+    plt.tight_layout()
+    plt.savefig(png_path, bbox_inches='tight', pad_inches=0, dpi=100)
+    plt.close(fig)
+    return cv2.resize(cv2.imread(png_path), (224, 224)).astype(np.float32)
+
+
+@pytest.mark.parametrize("kind, seconds", [("tones", 30), ("noise", 30), ("mix", 30), ("mix", 5)])
+def test_matches_the_pyplot_rendering(kind, seconds, tmp_path):
+    y = synthesize(kind, seconds, seed=1).mean(axis=1)
+    mel_spec = librosa.feature.melspectrogram(y=y, sr=SAMPLE_RATE, n_mels=N_MELS, fmax=FMAX,
+                                              n_fft=N_FFT, hop_length=HOP_LENGTH)
+    mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
+
+    expected = pyplot_reference(mel_spec_db, str(tmp_path / "reference.png"))
+    image = render_spectrogram(mel_spec_db)
+
+    assert image.shape == (224, 224, 3) and image.dtype == np.float32
+    difference = np.abs(image - expected)
+    assert difference.mean() < 1.5
+    assert np.percentile(difference, 99) < 12
+
+
+def test_constant_spectrogram_renders_the_lowest_colour():
+    image = render_spectrogram(np.full((128, 50), -20.0, dtype=np.float32))
+
+    # Darkest viridis colour, in BGR order
+    np.testing.assert_array_equal(image[0, 0], [84, 1, 68])
+    assert (image == image[0, 0]).all()
+
+
+def test_rejects_empty_spectrograms():
+    with pytest.raises(ValueError, match="non-empty 2D"):
+        render_spectrogram(np.zeros((128, 0), dtype=np.float32))
+
+
+def test_colour_table_is_matplotlib_viridis_in_bgr():
+    colormaps = pytest.importorskip("matplotlib").colormaps
+
+    np.testing.assert_array_equal(_VIRIDIS_LUT, colormaps["viridis"](np.arange(256), bytes=True)[:, 2::-1])
+
+
+def test_rendering_does_not_import_matplotlib():
+    code = ("import sys, numpy as np\n"
+            "from app.services.spectrogram_renderer import render_spectrogram\n"
+            "render_spectrogram(np.arange(12.0).reshape(3, 4))\n"
+            "assert 'matplotlib' not in sys.modules\n")
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
@@ -0,0 +1,103 @@
+"""Recall of exact, IVF and PQ search in the TrackIndex, and reopening it from disk."""
+import numpy as np
+import pytest
+
+from app.services.track_index import TrackIndex, track_vector
+from app.tools.build_track_index import exact_neighbours, measure_recall
+from benchmarks.track_index import synthetic_vectors
+
+DIM = 128
+TRACKS = 3000
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((40, DIM), dtype=np.float32)
+    return synthetic_vectors(centres, TRACKS, 0.5, rng), synthetic_vectors(centres, 50, 0.5, rng)
+
+
+@pytest.fixture(scope="module")
+def built_index_dir(catalog, tmp_path_factory):
+    """Index directory holding the catalog with 64 IVF lists and 16-byte PQ codes."""
+    path = str(tmp_path_factory.mktemp("track-index"))
+    index = TrackIndex(path, dim=DIM)
+    index.add_many([f"t{i}" for i in range(TRACKS)], catalog[0], [{"n": i} for i in range(TRACKS)])
+    index.build(lists=64, pq_subvectors=16)
+    return path
+
+
+def open_index(path, storage, search):
+    return TrackIndex(path, dim=DIM, storage=storage, nprobe=8, rerank=10,
+                      ann_min_tracks=0 if search == "ivf" else TRACKS + 1)
+
+
+@pytest.mark.parametrize("storage, min_recall", [("float32", 1.0), ("float16", 0.98)])
+def test_exact_search_finds_the_true_neighbours(catalog, built_index_dir, storage, min_recall):
+    vectors, queries = catalog
+    index = open_index(built_index_dir, storage, "exact")
+
+    assert index.mode == "exact"
+    assert measure_recall(index, vectors, queries, 10)["recall"] >= min_recall
+
+
+@pytest.mark.parametrize("storage, min_recall", [("float32", 0.9), ("float16", 0.9), ("pq", 0.85)])
+def test_ivf_recall(catalog, built_index_dir, storage, min_recall):
+    vectors, queries = catalog
+    index = open_index(built_index_dir, storage, "ivf")
+
+    assert index.mode == "ivf" and index.stats()["storage"] == storage
+    assert measure_recall(index, vectors, queries, 10)["recall"] >= min_recall
+
+
+def test_pq_scores_are_exact_after_rerank(catalog, built_index_dir):
+    vectors, queries = catalog
+    index = open_index(built_index_dir, "pq", "ivf")
+
+    for track in index.search(queries[0], 5):
+        position = int(track["id"][1:])
+        assert track["score"] == pytest.approx(float(vectors[position] @ queries[0]), abs=1e-5)
+        assert track["n"] == position
+
+
+def test_reload_keeps_tracks_and_results(catalog, tmp_path):
+    vectors, queries = catalog
+    path = str(tmp_path)
+    index = TrackIndex(path, dim=DIM)
+    assert index.add_many([f"t{i}" for i in range(100)], vectors[:100]) == 100
+    assert index.add("t0", vectors[0]) is False
+    before = index.search(queries[0], 5)
+
+    reopened = TrackIndex(path, dim=DIM)
+
+    assert len(reopened) == 100 and "t99" in reopened
+    assert reopened.search(queries[0], 5) == before
+    np.testing.assert_allclose(reopened.vector("t7"), vectors[7], rtol=1e-6)
+
+
+def test_refresh_picks_up_tracks_added_by_another_instance(catalog, tmp_path):
+    vectors, queries = catalog
+    path = str(tmp_path)
+    reader = TrackIndex(path, dim=DIM)
+    writer = TrackIndex(path, dim=DIM)
+    writer.add_many([f"t{i}" for i in range(10)], vectors[:10], [{"n": i} for i in range(10)])
+
+    found = reader.search(vectors[3], 1)
+
+    assert len(reader) == 10
+    assert found[0]["id"] == "t3" and found[0]["n"] == 3
+
+
+def test_track_vector_is_unit_length():
+    rng = np.random.default_rng(0)
+    vector = track_vector(rng.standard_normal((3, 7, 7, 1280)).astype(np.float16))
+
+    assert vector.shape == (1280,)
+    assert np.linalg.norm(vector) == pytest.approx(1.0, abs=1e-5)
+
+
+def test_exact_neighbours_matches_a_full_sort(catalog):
+    vectors, queries = catalog
+    scores = queries @ vectors.T
+    found = exact_neighbours(vectors, queries, 10)
+    np.testing.assert_allclose(np.take_along_axis(scores, found, axis=1), -np.sort(-scores, axis=1)[:, :10])
@@ -0,0 +1,105 @@
+"""The 413 responses of UploadSizeLimitMiddleware and streaming uploads to scratch files."""
+import hashlib
+import os
+
+import anyio
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.services.upload_storage import UploadSizeLimitMiddleware, receive_upload
+
+LIMIT = 1024 * 1024
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    received = []
+
+    @app.post("/api/music/classify/upload")
+    async def upload(request: Request):
+        received.append(len(await request.body()))
+        return {"size": received[-1]}
+
+    @app.post("/api/other")
+    async def other(request: Request):
+        return {"size": len(await request.body())}
+
+    app.add_middleware(UploadSizeLimitMiddleware, max_body_size=LIMIT, path_prefix="/api/music/classify")
+    with TestClient(app) as test_client:
+        test_client.received = received
+        yield test_client
+
+
+def chunks(total, size=64 * 1024):
+    for start in range(0, total, size):
+        yield b"x" * min(size, total - start)
+
+
+def test_declared_length_over_the_limit_is_rejected_before_the_endpoint(client):
+    response = client.post("/api/music/classify/upload", content=b"x" * (LIMIT + 1))
+
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body exceeds the maximum upload size of 1 MB"}
+    assert client.received == []
+
+
+def test_streamed_body_over_the_limit_is_rejected(client):
+    # Chunked transfer, so there is no content-length to check up front
+    response = client.post("/api/music/classify/upload", content=chunks(LIMIT + 1))
+
+    assert response.status_code == 413
+    assert "maximum upload size" in response.json()["detail"]
+    assert client.received == []
+
+
+@pytest.mark.parametrize("body", [b"x" * LIMIT, chunks(LIMIT)])
+def test_bodies_up_to_the_limit_pass(client, body):
+    response = client.post("/api/music/classify/upload", content=body)
+
+    assert response.status_code == 200
+    assert response.json() == {"size": LIMIT}
+
+
+def test_other_paths_are_not_limited(client):
+    response = client.post("/api/other", content=b"x" * (LIMIT + 1))
+
+    assert response.status_code == 200
+
+
+def multipart_request(body, chunk_size):
+    """A request whose body arrives in chunk_size pieces, as from the network."""
+    messages = [{"type": "http.request", "body": body[start:start + chunk_size], "more_body": True}
+                for start in range(0, len(body), chunk_size)]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+
+    async def receive():
+        return messages.pop(0)
+
+    scope = {"type": "http", "method": "POST", "path": "/upload",
+             "headers": [(b"content-type", b"multipart/form-data; boundary=b")]}
+    return Request(scope, receive)
+
+
+def test_upload_is_handed_to_the_writer_thread_in_blocks(tmp_path, monkeypatch):
+    writes = []
+    run_sync = anyio.to_thread.run_sync
+
+    async def counting_run_sync(function, *args, **kwargs):
+        writes.append(len(args[0]))
+        return await run_sync(function, *args, **kwargs)
+
+    monkeypatch.setattr(anyio.to_thread, "run_sync", counting_run_sync)
+    audio = os.urandom(LIMIT * 5 // 2)
+    body = (b'--b\r\nContent-Disposition: form-data; name="file"; filename="a.wav"\r\n\r\n'
+            + audio + b"\r\n--b--\r\n")
+
+    stored = anyio.run(receive_upload, multipart_request(body, 64 * 1024), "file", [".wav"], LIMIT * 4,
+                       str(tmp_path), LIMIT)
+
+    with open(stored.path, "rb") as f:
+        assert f.read() == audio
+    assert stored.size == len(audio) and stored.content_hash == hashlib.sha256(audio).hexdigest()
+    # 41 network chunks, 3 hand-offs
+    assert len(writes) == 3 and sum(writes) == len(body)
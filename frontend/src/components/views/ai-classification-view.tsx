@@ -79,7 +79,10 @@ export function AIClassificationView({ onTrackSelectAction }: AIClassificationVi
           label: result.overall_prediction.predicted_genre,
           confidence: result.overall_prediction.confidence
         },
-        mood: {
+        mood: result.mood_prediction ? {
+          label: result.mood_prediction.predicted_mood,
+          confidence: result.mood_prediction.confidence
+        } : {
           label: getMoodFromGenre(result.overall_prediction.predicted_genre), // Helper function
           confidence: 0.8 // Mock mood confidence
         },
@@ -120,7 +123,7 @@ export function AIClassificationView({ onTrackSelectAction }: AIClassificationVi
     }
   }
 
-  // Helper function to map genre to mood (since backend only returns genre)
+  // Helper function to map genre to mood (when the backend has no mood head loaded)
   const getMoodFromGenre = (genre: string): string => {
     const genreToMoodMap: Record<string, string> = {
       'rock': 'energetic',
@@ -47,6 +47,12 @@ export interface ClassificationResult {
     confidence: number;
     genre_distribution: Record<string, number>;
   };
+  // Only present when the backend has a mood head loaded
+  mood_prediction?: {
+    predicted_mood: string;
+    confidence: number;
+    mood_distribution: Record<string, number>;
+  };
   track_info: {
     duration: number;
     num_segments_analyzed: number;
@@ -58,6 +64,9 @@ export interface ClassificationResult {
     start_time: number;
     duration: number;
     genre_probabilities: Record<string, number>;
+    predicted_mood?: string;
+    mood_confidence?: number;
+    mood_probabilities?: Record<string, number>;
   }>;
   genre_votes: Record<string, number>;
   file_info: {